@@ -4,12 +4,22 @@ this is where you'll find all of the get/post request handlers
 the socket event handlers are inside of socket_routes.py
 '''
 "comment used for checking git commit"
-from flask import Flask, render_template, request, abort, url_for, jsonify, redirect, current_app
+# has to come before everything else, in a green async mode it monkey patches the standard library
+import green
+green.patch()
+
+from flask import Blueprint, Flask, render_template, request, abort, url_for, jsonify, redirect, current_app, stream_with_context
 from flask_socketio import SocketIO
 from flask_cors import CORS
 import db
+import config
 import secrets
-from werkzeug.security import check_password_hash
+import hashing
+import wire
+import assets
+import metrics
+import socket_routes
+from presence import user_room
 from flask_jwt_extended import JWTManager, create_access_token, set_access_cookies, unset_jwt_cookies, jwt_required, get_jwt_identity , exceptions
 
 
@@ -18,40 +28,58 @@ from flask_jwt_extended import JWTManager, create_access_token, set_access_cooki
 # this turns off Flask Logging, uncomment this to turn off Logging
 # log = logging.getLogger('werkzeug')
 # log.setLevel(logging.ERROR)
-app = Flask(__name__)
-CORS(app) 
-
-# secret key used to sign the session cookie
-app.config['SECRET_KEY'] = secrets.token_hex()
-socketio = SocketIO(app)
-
-# Configure JWT
-app.config['JWT_SECRET_KEY'] = 'your_jwt_secret_key'  # Change to your secret key
-app.config['JWT_TOKEN_LOCATION'] = ['cookies']
-app.config['JWT_COOKIE_SECURE'] = True  # Set to True in production with HTTPS
-app.config['JWT_COOKIE_CSRF_PROTECT'] = True  # Enable CSRF protection
 
-jwt = JWTManager(app) 
-
-# don't remove this!!
-import socket_routes
+# bound to the app by create_app(), socket_routes registers its handlers on it there too
+socketio = SocketIO()
+# every http route below, create_app() registers them on the app
+routes = Blueprint("chat", __name__)
+
+# builds the app, importing this module doesn't touch the database or start anything
+# python3 app.py calls it, so do tests and benchmarks (they can change app.config afterwards)
+def create_app():
+    app = Flask(__name__)
+    CORS(app) 
+
+    # secret key used to sign the session cookie
+    app.config['SECRET_KEY'] = secrets.token_hex()
+
+    # Configure JWT
+    app.config['JWT_SECRET_KEY'] = 'your_jwt_secret_key'  # Change to your secret key
+    app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+    app.config['JWT_COOKIE_SECURE'] = True  # Set to True in production with HTTPS
+    app.config['JWT_COOKIE_CSRF_PROTECT'] = True  # Enable CSRF protection
+    JWTManager(app) 
+
+    db.init()
+    # after JWTManager, so our NoAuthorizationError handler replaces its default one
+    app.register_blueprint(routes)
+    # request timings and /metrics when config.METRICS is on
+    metrics.instrument_app(app)
+    # /assets and asset_url() for the templates, see assets.py
+    assets.init(app)
+
+    # with a message queue, an emit to a room reaches clients connected to any worker
+    socketio.init_app(app, async_mode=config.ASYNC_MODE, message_queue=config.SOCKETIO_MESSAGE_QUEUE)
+    socket_routes.init(socketio)
+    return app
 
 # index page
-@app.route("/")
+# the same for everyone, so rendered once and served from memory (see assets.py)
+@routes.route("/")
 def index():
-    return render_template("index.jinja")
+    return assets.static_page("index.jinja")
 
-@app.errorhandler(exceptions.NoAuthorizationError)
+@routes.app_errorhandler(exceptions.NoAuthorizationError)
 def handle_auth_error(e):
-    return redirect(url_for('login'))
+    return redirect(url_for('chat.login'))
 
 # login page
-@app.route("/login")
+@routes.route("/login")
 def login():    
-    return render_template("login.jinja")
+    return assets.static_page("login.jinja")
 
 # handles a post request when the user clicks the log in button
-@app.route("/login/user", methods=["POST"])
+@routes.route("/login/user", methods=["POST"])
 def login_user():
     if not request.is_json:
         return jsonify({"login": False, "msg": "Invalid request format"}), 400
@@ -65,24 +93,27 @@ def login_user():
             return jsonify({"login": False, "msg": "User does not exist!"}), 404
 
         # Ensure this comparison is what you intend it to be
-        if not check_password_hash(user.password, password):
+        # hashing takes a while, it runs on the hashing pool (see hashing.py)
+        if not hashing.check_password(user.password, password):
             return jsonify({"login": False, "msg": "Password does not match!"}), 401
 
         access_token = create_access_token(identity=username)
         response = jsonify({'login': True, "msg": "Login successful"})
         set_access_cookies(response, access_token)
         return response
+    except hashing.Overloaded:
+        return jsonify({"login": False, "msg": "Too many logins right now, try again"}), 429, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"login": False, "msg": str(e)}), 500
 
 
 # handles a get request to the signup page
-@app.route("/signup")
+@routes.route("/signup")
 def signup():
-    return render_template("signup.jinja")
+    return assets.static_page("signup.jinja")
 
 # handles a post request when the user clicks the signup button
-@app.route("/signup/user", methods=["POST"])
+@routes.route("/signup/user", methods=["POST"])
 def signup_user():
     if not request.is_json:
         return jsonify({"msg": "Request must be JSON"}), 400
@@ -99,109 +130,353 @@ def signup_user():
         return jsonify({"msg": "User already exists!"}), 409
 
     # Ensure all required arguments are passed to the insert_user function
-    db.insert_user(username, password, public_key, salt)
+    try:
+        db.insert_user(username, password, public_key, salt)
+    except hashing.Overloaded:
+        return jsonify({"msg": "Too many signups right now, try again"}), 429, {"Retry-After": "1"}
     access_token = create_access_token(identity=username)
     response = jsonify({'signup': True})
     set_access_cookies(response, access_token)
     return response
 
 # handler when a "404" error happens
-@app.errorhandler(404)
+@routes.app_errorhandler(404)
 def page_not_found(_):
-    return render_template('404.jinja'), 404
+    return assets.static_page('404.jinja', 404)
 
 # home page, where the messaging app is
-@app.route("/home")
+@routes.route("/home")
 @jwt_required()
 def home():
     current_user = get_jwt_identity()  # Get the identity of the current user from JWT
-    friends = db.list_friends(current_user)
-    received_requests, sent_requests = db.list_friend_requests(current_user)
+    # friends, unread counts, last messages and pending requests in one query (or none, when cached)
+    dashboard = db.get_dashboard(current_user, previews=True)
 
-    return render_template("home.jinja", username=current_user, friends=friends,
-                           received_requests=received_requests, sent_requests=sent_requests)
+    return render_template("home.jinja", username=current_user, friends=dashboard.friends,
+                           received_requests=dashboard.received_requests, sent_requests=dashboard.sent_requests,
+                           groups=dashboard.groups)
 
-# Route to send a friend request
-@app.route("/add-friend", methods=["POST"])
+# number of unread messages from each friend
+@routes.route("/unread-counts", methods=["GET"])
+@jwt_required()
+def unread_counts():
+    return jsonify(db.get_unread_counts(get_jwt_identity()))
+
+# moves the read cursor for a conversation forward, e.g. once the messages are shown
+@routes.route("/mark-read", methods=["POST"])
+@jwt_required()
+def mark_read():
+    if not request.is_json:
+        abort(400)  # Bad Request
+
+    peer = request.json.get("peer")
+    message_id = request.json.get("message_id")
+    # bool is an int too, so true would pass as message 1
+    if not peer or not isinstance(message_id, int) or isinstance(message_id, bool):
+        return jsonify({"error": "Missing required parameters"}), 400
+    db.mark_read(get_jwt_identity(), peer, message_id)
+    return jsonify({"success": True})
+
+# what /add-friend answers for each db.send_friend_request result
+FRIEND_REQUEST_RESULTS = {
+    db.REQUEST_SENT: "Friend request sent successfully!",
+    db.REQUEST_ACCEPTED: "They had already sent you a request, you're friends now!",
+    db.REQUEST_PENDING: "Friend request already sent",
+    db.REQUEST_ALREADY_FRIENDS: "You're already friends",
+}
+
+# Route to send a friend request, from whoever is logged in
+# (a "sender" in the body is ignored, the reverse request is accepted on its behalf)
+@routes.route("/add-friend", methods=["POST"])
+@jwt_required()
 def add_friend():
     if not request.is_json:
         abort(400)  # Bad Request
 
-    sender = request.json.get("sender")
+    sender = get_jwt_identity()
     receiver = request.json.get("receiver")
-    
-    # You might want to add checks here to ensure both users exist
-    db.send_friend_request(sender, receiver)
-    return "Friend request sent successfully!", 200
+    if not isinstance(receiver, str) or not receiver:
+        return "Missing required parameters", 400
+    if sender == receiver:
+        return "You can't send a friend request to yourself", 400
+
+    result = db.send_friend_request(sender, receiver)
+    if result == db.REQUEST_INVALID:
+        return "User not found", 404
+    return FRIEND_REQUEST_RESULTS[result], 200
+
+# the list under key in the request's json, or None unless it's a list of kind
+def json_list(key: str, kind=str):
+    values = request.json.get(key, [])
+    if not isinstance(values, list) or not all(isinstance(value, kind) and not isinstance(value, bool) for value in values):
+        return None
+    return values
+
+# sends friend requests to several users at once, {"usernames": [...]}
+# answers {username: "sent" | "accepted" | "pending" | "friends" | "invalid"}
+@routes.route("/friend-requests", methods=["POST"])
+@jwt_required()
+def send_friend_requests():
+    if not request.is_json:
+        abort(400)  # Bad Request
+
+    usernames = json_list("usernames")
+    if not usernames or len(usernames) > db.MAX_FRIEND_REQUEST_BATCH:
+        return jsonify({"error": f"Send 1 to {db.MAX_FRIEND_REQUEST_BATCH} usernames"}), 400
+    return jsonify(db.send_friend_requests(get_jwt_identity(), usernames))
+
+# accepts or rejects any number of the user's received requests in one transaction,
+# picked by {"request_ids": [...]}, by sender {"usernames": [...]} or both
+# answers with the senders whose requests it answered
+def answer_friend_requests(answer):
+    if not request.is_json:
+        abort(400)  # Bad Request
+
+    request_ids = json_list("request_ids", int)
+    senders = json_list("usernames")
+    if request_ids is None or senders is None:
+        return jsonify({"error": "request_ids and usernames must be lists"}), 400
+    if len(request_ids) + len(senders) > db.MAX_FRIEND_REQUEST_BATCH:
+        return jsonify({"error": f"At most {db.MAX_FRIEND_REQUEST_BATCH} requests at a time"}), 400
+    return jsonify({"answered": answer(get_jwt_identity(), request_ids, senders)})
+
+@routes.route("/friend-requests/accept", methods=["POST"])
+@jwt_required()
+def accept_friend_requests():
+    return answer_friend_requests(db.accept_friend_requests)
+
+@routes.route("/friend-requests/reject", methods=["POST"])
+@jwt_required()
+def reject_friend_requests():
+    return answer_friend_requests(db.reject_friend_requests)
+
+# the friends the user has in common with username
+@routes.route("/friends/<username>/mutual", methods=["GET"])
+@jwt_required()
+def mutual_friends(username):
+    return jsonify({"mutual": db.mutual_friends(get_jwt_identity(), username)})
+
+# friends of friends, most mutual friends first, ?limit= up to MAX_FRIEND_SUGGESTIONS
+MAX_FRIEND_SUGGESTIONS = 50
+
+@routes.route("/friend-suggestions", methods=["GET"])
+@jwt_required()
+def friend_suggestions():
+    limit = request.args.get("limit", db.FRIEND_SUGGESTION_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_FRIEND_SUGGESTIONS))
+    suggestions = db.friend_suggestions(get_jwt_identity(), limit)
+    return jsonify([{"username": username, "mutual": mutual} for username, mutual in suggestions])
 
 # Route to list all friends for a user
-@app.route("/list-friends/<username>")
+@routes.route("/list-friends/<username>")
 def list_friends(username):
     friends = db.list_friends(username)
     return render_template("friends_list.jinja", friends=friends, username=username)
 
-# Route to accept a friend request
-@app.route("/accept-friend-request", methods=["POST"])
+# the request_id in the request's json, or None unless it's an int
+def json_request_id():
+    request_id = request.json.get("request_id")
+    if not isinstance(request_id, int) or isinstance(request_id, bool):
+        return None
+    return request_id
+
+# Route to accept a friend request, only one the logged in user received
+@routes.route("/accept-friend-request", methods=["POST"])
+@jwt_required()
 def accept_friend_request():
     if not request.is_json:
         abort(400)  # Bad Request
     
-    request_id = request.json.get("request_id")
-    db.accept_friend_request(request_id)
+    request_id = json_request_id()
+    if request_id is None:
+        return "Missing required parameters", 400
+    if not db.accept_friend_requests(get_jwt_identity(), [request_id]):
+        return "Friend request not found", 404
     return "Friend request accepted!", 200
 
-# Route to reject a friend request
-@app.route("/reject-friend-request", methods=["POST"])
+# Route to reject a friend request, only one the logged in user received
+@routes.route("/reject-friend-request", methods=["POST"])
+@jwt_required()
 def reject_friend_request():
     if not request.is_json:
         abort(400)  # Bad Request
     
-    request_id = request.json.get("request_id")
-    db.reject_friend_request(request_id)
+    request_id = json_request_id()
+    if request_id is None:
+        return "Missing required parameters", 400
+    if not db.reject_friend_requests(get_jwt_identity(), [request_id]):
+        return "Friend request not found", 404
     return "Friend request rejected", 200
 
-@app.route("/get-public-key/<username>", methods=["GET"])
+# public keys and salts barely change, so browsers can keep them for a while
+# and after that revalidate with the ETag instead of downloading them again
+KEY_CACHE_MAX_AGE = 3600
+
+def cacheable_json(payload):
+    response = jsonify(payload)
+    response.cache_control.public = True
+    response.cache_control.max_age = KEY_CACHE_MAX_AGE
+    response.add_etag()
+    # turns the response into a 304 if the browser's If-None-Match still matches
+    return response.make_conditional(request)
+
+@routes.route("/get-public-key/<username>", methods=["GET"])
 def get_public_key(username):
     #print("Fetching public key for:", username)
     user = db.get_user(username)
     if user is None:
-        print("User not found:", username)
         return jsonify({"error": "User not found"}), 404
     #print("Public key found:", user.public_key)
-    return jsonify({"public_key": user.public_key}), 200
+    return cacheable_json({"public_key": user.public_key})
 
-@app.route("/get-messages/<username>/<receiver>", methods=["GET"])
+@routes.route("/get-messages/<username>/<receiver>", methods=["GET"])
 @jwt_required()
 def get_messages(username, receiver):
     # Ensure the user requesting is the same as the session user
     current_user = get_jwt_identity()
     if username != current_user:
         return jsonify({"error": "Unauthorized"}), 401
-    messages = db.get_messages_between_users(username, receiver)
-    return jsonify([{"message": message.message, "iv": message.iv, "sender": message.sender, "timestamp": message.timestamp.isoformat()} for message in messages])
 
-@app.route('/get_salt/<username>', methods=['GET'])
+    # keyset pagination, pass the cursor of the oldest message you have as ?before=
+    # to page back, or the newest one as ?after= (or its id as ?since_id=) to get new messages
+    try:
+        before = db.decode_cursor(request.args["before"]) if "before" in request.args else None
+        after = db.decode_cursor(request.args["after"]) if "after" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    since_id = request.args.get("since_id", type=int)
+    limit = request.args.get("limit", db.MESSAGE_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, db.MAX_MESSAGE_PAGE_SIZE))
+
+    messages = db.get_messages_between_users(username, receiver, before=before, after=after, since_id=since_id, limit=limit)
+    # whatever the user just downloaded counts as read
+    received = [message.id for message in messages if message.sender == receiver]
+    if received:
+        db.mark_read(username, receiver, max(received))
+    items = [{"id": message.id, "cursor": db.encode_cursor(message), "message": message.message, "iv": message.iv, "sender": message.sender, "timestamp": message.timestamp.isoformat()} for message in messages]
+    return binary_response(items, ("message", "iv"))
+
+# msgpack clients get the raw bytes, json ones get the binary fields of each item base64'd
+def binary_response(items, binary_fields):
+    if request.accept_mimetypes.best_match(wire.available_types(), default=wire.JSON_TYPE) == wire.MSGPACK_TYPE:
+        return current_app.response_class(wire.pack(items), mimetype=wire.MSGPACK_TYPE)
+    for item in items:
+        for field in binary_fields:
+            item[field] = wire.to_base64(item[field])
+    return jsonify(items)
+
+# creates a group with some of the user's friends
+# messages to it go through the "group_send" socket event, see socket_routes.py
+@routes.route("/groups", methods=["POST"])
+@jwt_required()
+def create_group():
+    if not request.is_json:
+        abort(400)  # Bad Request
+
+    current_user = get_jwt_identity()
+    name = request.json.get("name")
+    members = request.json.get("members")
+    if not isinstance(name, str) or not name or not isinstance(members, list) or not all(isinstance(member, str) for member in members):
+        return jsonify({"error": "Missing required parameters"}), 400
+    members = set(members) - {current_user}
+    if not members or len(members) + 1 > db.MAX_GROUP_MEMBERS:
+        return jsonify({"error": f"A group needs 2 to {db.MAX_GROUP_MEMBERS} members"}), 400
+    if not members <= set(db.list_friends(current_user)):
+        return jsonify({"error": "You can only add friends to a group"}), 400
+
+    group_id = db.create_group(current_user, name, members)
+    group = {"id": group_id, "name": name, "members": sorted(members | {current_user})}
+    # members that are online join the group's room when they hear about it
+    for member in group["members"]:
+        socketio.emit("group_created", group, to=user_room(member))
+    return jsonify(group)
+
+# the groups the user is in
+@routes.route("/groups", methods=["GET"])
+@jwt_required()
+def list_groups():
+    return jsonify([group._asdict() for group in db.list_groups(get_jwt_identity())])
+
+# every member's public key in one request, to encrypt a group message's key for each of them
+@routes.route("/groups/<int:group_id>/keys", methods=["GET"])
+@jwt_required()
+def get_group_keys(group_id):
+    members = db.get_group_members(group_id)
+    if get_jwt_identity() not in members:
+        return jsonify({"error": "Group not found"}), 404
+    return jsonify({member: db.get_user(member).public_key for member in sorted(members)})
+
+# a page of a group's history, each message with the user's own key envelope
+# ?before_id= pages back from the oldest message you have, ?after_id= fetches newer ones
+@routes.route("/groups/<int:group_id>/messages", methods=["GET"])
+@jwt_required()
+def get_group_messages(group_id):
+    current_user = get_jwt_identity()
+    if current_user not in db.get_group_members(group_id):
+        return jsonify({"error": "Group not found"}), 404
+    limit = request.args.get("limit", db.MESSAGE_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, db.MAX_MESSAGE_PAGE_SIZE))
+    rows = db.get_group_messages(group_id, current_user, before_id=request.args.get("before_id", type=int),
+                                 after_id=request.args.get("after_id", type=int), limit=limit)
+    items = [{"id": row.id, "sender": row.sender, "body": row.body, "iv": row.iv, "key": row.envelope,
+              "timestamp": row.timestamp.isoformat()} for row in rows]
+    return binary_response(items, ("body", "iv", "key"))
+
+# every message the user sent or received as NDJSON (see history.py), streamed so it's never all in memory
+# pass the id of the last line you got as ?after_id= to pick up a download that broke off
+@routes.route("/export-messages", methods=["GET"])
+@jwt_required()
+def export_messages():
+    # only this route needs it
+    import history
+    current_user = get_jwt_identity()
+    after_id = request.args.get("after_id", 0, type=int)
+    response = current_app.response_class(stream_with_context(history.export_lines(current_user, after_id)),
+                                          mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = f"attachment; filename={current_user}-messages.ndjson"
+    return response
+
+@routes.route('/get_salt/<username>', methods=['GET'])
 def get_salt(username):
     user = db.get_user(username)
     if user and hasattr(user, 'salt') and user.salt:
-        return jsonify({"salt": user.salt}), 200
+        return cacheable_json({"salt": user.salt})
     else:
         return jsonify({"error": "User not found or salt unavailable"}), 404
     
-@app.route('/send-message', methods=['POST'])
+# the sender is whoever is logged in, a "sender" in the body is ignored
+@routes.route('/send-message', methods=['POST'])
+@jwt_required()
 def send_message():
-    if not request.is_json:
-        return jsonify({"error": "Invalid content type"}), 415
-    
-    data = request.get_json()
+    # json carries the ciphertext and iv as base64, msgpack as raw bytes
+    try:
+        if request.mimetype == wire.MSGPACK_TYPE and wire.msgpack is not None:
+            data = wire.unpack(request.get_data())
+        elif request.is_json:
+            data = request.get_json()
+        else:
+            return jsonify({"error": "Invalid content type"}), 415
+        if not isinstance(data, dict) or data.get('encryptedMessage') is None or 'receiver' not in data:
+            return jsonify({"error": "encryptedMessage and receiver are required"}), 400
+        message, iv = wire.to_bytes(data['encryptedMessage']), wire.to_bytes(data.get('iv'))
+    except wire.InvalidPayload as e:
+        return jsonify({"error": str(e)}), 400
+    sender, receiver = get_jwt_identity(), data['receiver']
+    # anything else would fail the whole batch it's written in
+    if not isinstance(receiver, str) or not receiver:
+        return jsonify({"error": "receiver must be a username"}), 400
+
     try:
-        db.insert_message(data['sender'], data['receiver'], data['encryptedMessage'], data['iv'])
+        db.queue_message(sender, receiver, message, iv)
         return jsonify({"success": True})
+    except db.QueueFull:
+        # backpressure, the writer can't keep up so tell the client to retry
+        return jsonify({"error": "Server busy, try again"}), 503, {"Retry-After": "1"}
     except Exception as e:
         current_app.logger.error(f"Exception during message insert: {e}", exc_info=True)
         return jsonify({"error": "Internal Server Error"}), 500
 
 if __name__ == '__main__':
-    socketio.run(app, host = 'localhost', port = 1204,
+    socketio.run(create_app(), host = config.HOST, port = config.PORT,
     keyfile = 'example.com+5-key.pem',
     certfile = 'example.com+5.pem')
\ No newline at end of file
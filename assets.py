@@ -0,0 +1,196 @@
+'''
+assets
+fingerprinted, precompressed static files and pre-rendered static pages
+
+`python assets.py build` copies every file in static/ into config.ASSETS_DIR
+(static/dist) under a name with a hash of its contents, js/home.js becomes
+js/home.<hash>.js, next to a gzip copy and, when the optional brotli package
+is installed (`pip install brotli`), a brotli one. manifest.json there maps
+each original path to its hashed one.
+
+Templates link static files with asset_url("js/home.js"). For a built file
+that's /assets/js/home.<hash>.js, sent precompressed in whatever encoding the
+browser takes, with Cache-Control: immutable so it's kept for a year and never
+asked for again. Changing the file changes its name, so nobody gets a stale copy.
+Files that aren't built, or changed since the last build, are linked as plain
+/static/ files like before, so a forgotten build is slower but not broken.
+
+The pages that are the same for everyone (index, login, signup, 404) are
+rendered once per process and kept in memory already compressed, with an ETag
+so a browser that has the page gets a 304.
+'''
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+from pathlib import Path
+from typing import Dict, NamedTuple
+
+from flask import abort, current_app, render_template, request, send_file, url_for
+from werkzeug.security import safe_join
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+DIST_DIR = Path(config.ASSETS_DIR) if config.ASSETS_DIR else STATIC_DIR / "dist"
+MANIFEST_NAME = "manifest.json"
+# a year, as long as browsers keep anything
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 12
+# text compresses, images and fonts already are
+COMPRESSIBLE = (".js", ".css", ".html", ".svg", ".json", ".txt", ".map")
+# below this the compressed copy saves less than its headers cost
+MIN_COMPRESS_SIZE = 512
+# file suffix of each precompressed copy, best first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(data: bytes) -> Dict[str, bytes]:
+    copies = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies["br"] = brotli.compress(data, quality=11)
+    # only the ones that are actually smaller
+    return {encoding: copy for encoding, copy in copies.items() if len(copy) < len(data)}
+
+# copies static_dir into dist_dir with hashed names and compressed copies, returns the manifest
+# earlier builds are left alone, pages that are already open may still link them
+def build(static_dir: Path = STATIC_DIR, dist_dir: Path = DIST_DIR) -> dict:
+    manifest = {}
+    for source in sorted(static_dir.rglob("*")):
+        if not source.is_file() or source.is_relative_to(dist_dir):
+            continue
+        data = source.read_bytes()
+        name = source.relative_to(static_dir).as_posix()
+        digest = hashlib.sha256(data).hexdigest()
+        # jquery.min.js -> jquery.min.<hash>.js
+        hashed = source.relative_to(static_dir).with_name(f"{source.stem}.{digest[:HASH_LENGTH]}{source.suffix}")
+        target = dist_dir / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        copies = compress(data) if source.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE else {}
+        for encoding, copy in copies.items():
+            target.with_name(target.name + ENCODINGS[encoding]).write_bytes(copy)
+        manifest[name] = {"path": hashed.as_posix(), "sha256": digest, "size": len(data),
+                          "encodings": {encoding: len(copy) for encoding, copy in copies.items()}}
+    (dist_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2) + "\n")
+    return manifest
+
+# the manifest's entries whose source hasn't changed since the build
+def load_manifest(static_dir: Path = STATIC_DIR, dist_dir: Path = DIST_DIR) -> dict:
+    try:
+        entries = json.loads((dist_dir / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    current = {}
+    for name, entry in entries.items():
+        try:
+            data = (static_dir / name).read_bytes()
+        except FileNotFoundError:
+            continue
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            logger.warning("static/%s changed since the last build, serving it unhashed until "
+                           "python assets.py build is run again", name)
+            continue
+        current[name] = entry
+    return current
+
+
+# set by init(): original path -> its manifest entry
+manifest: Dict[str, dict] = {}
+# hashed path -> the encodings it has a precompressed copy in
+encodings: Dict[str, tuple] = {}
+
+# the url for a file in static/, a template global
+def asset_url(name: str) -> str:
+    entry = manifest.get(name)
+    if entry is None:
+        return url_for("static", filename=name)
+    return url_for("assets", filename=entry["path"])
+
+# the best encoding out of available that the request accepts
+def negotiate(available) -> str:
+    return request.accept_encodings.best_match([*available, "identity"], default="identity")
+
+def serve_asset(filename: str):
+    path = safe_join(str(DIST_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    available = encodings.get(filename)
+    if available is None:
+        # from an earlier build, a page that's still open may link it
+        available = tuple(encoding for encoding, suffix in ENCODINGS.items() if os.path.isfile(path + suffix))
+    encoding = negotiate(available)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_file(path + ENCODINGS.get(encoding, ""), mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# a rendered page and its compressed copies
+class Page(NamedTuple):
+    etag: str
+    bodies: Dict[str, bytes]
+
+# template name -> Page, filled in the first time each page is asked for
+pages: Dict[str, Page] = {}
+
+# serves a template that renders the same for everyone from memory
+def static_page(template: str, status: int = 200):
+    page = pages.get(template)
+    if page is None:
+        html = render_template(template).encode()
+        page = pages[template] = Page(hashlib.sha256(html).hexdigest()[:HASH_LENGTH], {"identity": html, **compress(html)})
+    encoding = negotiate([encoding for encoding in ENCODINGS if encoding in page.bodies])
+    response = current_app.response_class(page.bodies[encoding], status=status, mimetype="text/html")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    # kept, but checked every time, a deploy changes the asset urls in it
+    response.cache_control.no_cache = True
+    if status != 200:
+        return response
+    response.set_etag(f"{page.etag}-{encoding}")
+    return response.make_conditional(request)
+
+
+# loads the manifest and adds the /assets route and asset_url, called by app.create_app()
+def init(app):
+    global manifest, encodings
+    manifest = load_manifest(STATIC_DIR, DIST_DIR)
+    encodings = {entry["path"]: tuple(encoding for encoding in ENCODINGS if encoding in entry["encodings"])
+                 for entry in manifest.values()}
+    app.add_url_rule("/assets/<path:filename>", "assets", serve_asset)
+    app.add_template_global(asset_url)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ["build"]:
+        print("usage: python assets.py build", file=sys.stderr)
+        sys.exit(2)
+    if brotli is None:
+        print("brotli isn't installed, only writing gzip copies (pip install brotli)")
+    built = build()
+    for name, entry in built.items():
+        sizes = ", ".join(f"{encoding} {size}" for encoding, size in entry["encodings"].items())
+        print(f"{name} -> {entry['path']} ({entry['size']} B{', ' + sizes if sizes else ''})")
+    print(f"{len(built)} files in {DIST_DIR}")
+
+
+if __name__ == "__main__":
+    main()
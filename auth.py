@@ -0,0 +1,50 @@
+'''
+auth
+verifies the JWT access cookie of socket.io connections
+
+socket_routes checks the token once when a socket connects and binds the
+identity to the socket's session id, so events never decode anything.
+Verified tokens are also remembered (by their hash) until they expire,
+so reconnects and extra tabs with the same token skip the signature check.
+'''
+
+import time
+import hashlib
+from flask import current_app
+from flask_jwt_extended import decode_token
+
+from cache import LRUCache
+
+TOKEN_CACHE_SIZE = 4096
+
+# sha256 of the token -> (identity, expiry as a unix time)
+token_cache = LRUCache(max_size=TOKEN_CACHE_SIZE)
+
+
+# returns the identity in a valid access token, or None
+def identify(token: str):
+    if not token:
+        return None
+    key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(key)
+    if cached is not None:
+        identity, expires = cached
+        if expires > time.time():
+            return identity
+        token_cache.invalidate(key)
+        return None
+
+    try:
+        # checks the signature and expiry, decode_token takes refresh tokens too
+        claims = decode_token(token)
+    except Exception:
+        return None
+    if claims.get("type") != "access":
+        return None
+    identity = claims[current_app.config["JWT_IDENTITY_CLAIM"]]
+    token_cache.set(key, (identity, claims.get("exp", float("inf"))))
+    return identity
+
+# the identity in the request's access token cookie, or None
+def identify_request(request):
+    return identify(request.cookies.get(current_app.config["JWT_ACCESS_COOKIE_NAME"]))
@@ -0,0 +1,142 @@
+'''
+bench_assets
+bytes on the wire and time to interactive for each page, with and without `python assets.py build`
+
+    python benchmarks/bench_assets.py --rtt 150 --bandwidth 1.6
+
+loads /, /login, /signup and /home like a browser would, the page and then
+every script it links from this server (the crypto-js CDN script isn't
+counted), through the Flask test client with a browser-like cache in front:
+fresh entries aren't asked for again, stale ones are revalidated with their
+ETag. "cold" is a first visit, "warm" is the same page again.
+
+  unbuilt  - no build, plain /static/ files, no compression (what the app sent before)
+  gzip     - built, the browser accepts gzip
+  br       - built, the browser accepts brotli (needs `pip install brotli`)
+
+time to interactive is modelled, not measured in a browser: the server time
+of every request, plus one round trip (--rtt ms) for the page, one more for
+its scripts (fetched in parallel), and every byte over --bandwidth Mbit/s.
+parsing and running the scripts isn't included, it's the same in every mode.
+'''
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+import warnings
+from html.parser import HTMLParser
+from pathlib import Path
+
+# puts the project root on sys.path
+import common
+
+warnings.filterwarnings("ignore")
+os.environ["CHAT_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+os.environ["CHAT_HASH_WORKERS"] = "0"
+
+import app as chat_app
+import assets
+import db
+
+PAGES = ["/", "/login", "/signup", "/home"]
+MODES = {"unbuilt": "identity", "gzip": "gzip", "br": "br, gzip"}
+
+
+class Scripts(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.sources = []
+
+    def handle_starttag(self, tag, attrs):
+        src = dict(attrs).get("src")
+        if tag == "script" and src and src.startswith("/"):
+            self.sources.append(src)
+
+
+class Browser():
+    def __init__(self, client, accept_encoding: str):
+        self.client = client
+        self.accept_encoding = accept_encoding
+        # url -> (etag, fresh, body)
+        self.cache = {}
+
+    # returns (body, bytes received, requests made, server seconds)
+    def get(self, url: str):
+        cached = self.cache.get(url)
+        if cached is not None and cached[1]:
+            return cached[2], 0, 0, 0.0
+        headers = {"Accept-Encoding": self.accept_encoding}
+        if cached is not None and cached[0]:
+            headers["If-None-Match"] = cached[0]
+        start = time.perf_counter()
+        response = self.client.get(url, headers=headers)
+        elapsed = time.perf_counter() - start
+        received = len(response.data) + sum(len(key) + len(value) + 4 for key, value in response.headers.items())
+        if response.status_code == 304:
+            return cached[2], received, 1, elapsed
+        body = response.get_data()
+        if response.headers.get("Content-Encoding") == "br":
+            body = assets.brotli.decompress(body)
+        elif response.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        cache_control = response.cache_control
+        fresh = bool(cache_control.immutable or (cache_control.max_age and not cache_control.no_cache))
+        self.cache[url] = (response.headers.get("ETag"), fresh, body)
+        return body, received, 1, elapsed
+
+    # loads a page and its scripts, returns (bytes, requests, modelled seconds to interactive)
+    def load(self, url: str, rtt: float, bandwidth: float):
+        html, received, requests, server = self.get(url)
+        network = rtt * requests
+        parser = Scripts()
+        parser.feed(html.decode())
+        script_requests = 0
+        for src in parser.sources:
+            _, size, count, seconds = self.get(src)
+            received += size
+            script_requests += count
+            server += seconds
+        requests += script_requests
+        network += rtt if script_requests else 0
+        return received, requests, server + network + received * 8 / bandwidth
+
+
+def make_app(dist_dir: Path):
+    assets.DIST_DIR = dist_dir
+    # rendered pages link the assets of the build they were rendered with
+    assets.pages.clear()
+    flask_app = chat_app.create_app()
+    flask_app.config["JWT_COOKIE_SECURE"] = False
+    return flask_app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=150, help="round trip in milliseconds")
+    parser.add_argument("--bandwidth", type=float, default=1.6, help="download speed in Mbit/s")
+    args = parser.parse_args()
+    rtt, bandwidth = args.rtt / 1000, args.bandwidth * 1e6
+
+    unbuilt = Path(tempfile.mkdtemp(prefix="chat-bench-"))
+    built = Path(tempfile.mkdtemp(prefix="chat-bench-"))
+    assets.build(dist_dir=built)
+    db.init()
+    db.insert_user("bench", "password", "key", "salt")
+
+    print(f"{'page':>8} {'mode':>8} {'cold KiB':>9} {'requests':>9} {'TTI ms':>8} {'warm KiB':>9} {'requests':>9} {'TTI ms':>8}")
+    for page in PAGES:
+        for mode, accept_encoding in MODES.items():
+            if mode == "br" and assets.brotli is None:
+                continue
+            client = make_app(unbuilt if mode == "unbuilt" else built).test_client()
+            client.post("/login/user", json={"username": "bench", "password": "password"})
+            browser = Browser(client, accept_encoding)
+            cold = browser.load(page, rtt, bandwidth)
+            warm = browser.load(page, rtt, bandwidth)
+            print(f"{page:>8} {mode:>8} {cold[0] / 1024:>9.1f} {cold[1]:>9} {cold[2] * 1000:>8.0f} "
+                  f"{warm[0] / 1024:>9.1f} {warm[1]:>9} {warm[2] * 1000:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+'''
+bench_broadcast
+broadcast latency of the "send" socket event when the clients of one room
+are spread across several worker processes
+
+    python benchmarks/bench_broadcast.py --workers 4 --clients 40 --message-queue redis://localhost:6379/0
+
+every worker is a separate `app` process on its own port, sharing one temporary
+database (so rooms use the "database" registry) and the given message queue.
+a single worker needs no message queue.
+needs the socket.io client: pip install "python-socketio[client]" websocket-client
+(and redis for a redis:// queue)
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import ROOT, WORKER, wait_for_port, percentile, mean, auth_cookie
+
+from sqlalchemy import create_engine, insert
+from models import Base, User, Friendship
+
+
+def seed(url: str, clients: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    names = [f"user{i}" for i in range(clients)]
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"username": name, "password": "x", "public_key": "x", "salt": "x"} for name in names])
+        # everyone is friends with user0, who hosts the room ("user0" sorts first)
+        connection.execute(insert(Friendship), [{"user_1": names[0], "user_2": name} for name in names[1:]])
+    engine.dispose()
+    return names
+
+def start_workers(count: int, base_port: int, directory: str, url: str, message_queue):
+    workers = []
+    for i in range(count):
+        env = dict(os.environ,
+                   PYTHONPATH=str(ROOT),
+                   CHAT_PORT=str(base_port + i),
+                   CHAT_DATABASE_URL=url,
+                   CHAT_ROOM_REGISTRY="database" if count > 1 else "local")
+        if message_queue:
+            env["CHAT_SOCKETIO_MESSAGE_QUEUE"] = message_queue
+        workers.append(subprocess.Popen([sys.executable, "-c", WORKER], cwd=directory, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    for i in range(count):
+        wait_for_port(base_port + i)
+    return workers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=20, help="clients in the room, spread over the workers")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between messages")
+    parser.add_argument("--message-queue", default=None)
+    parser.add_argument("--base-port", type=int, default=5200)
+    args = parser.parse_args()
+    if args.workers > 1 and not args.message_queue:
+        parser.error("more than one worker needs --message-queue")
+
+    import socketio
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    url = f"sqlite:///{directory}/bench.db"
+    names = seed(url, args.clients)
+    workers = start_workers(args.workers, args.base_port, directory, url, args.message_queue)
+
+    latencies = []
+    lock = threading.Lock()
+    clients = []
+    try:
+        for i, name in enumerate(names):
+            client = socketio.Client()
+
+            @client.on("incoming")
+            def incoming(data, color="black", name=name):
+                if isinstance(data, dict) and data.get("username") != name:
+                    with lock:
+                        latencies.append(time.time() - float(data["message"]))
+
+            client.connect(f"http://localhost:{args.base_port + i % args.workers}", transports=["websocket"],
+                           headers={"Cookie": auth_cookie(name)})
+            # user0 opens the room with user1, everyone else joins user0's room
+            room_id = client.call("join", (name, names[1] if i == 0 else names[0]))
+            clients.append((name, client, room_id))
+
+        sender_name, sender, room_id = clients[0]
+        for _ in range(args.messages):
+            sender.emit("send", (sender_name, repr(time.time()), room_id))
+            time.sleep(args.interval)
+        time.sleep(1)
+    finally:
+        for _, client, _ in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
+
+    expected = args.messages * (args.clients - 1)
+    print(f"workers {args.workers}, clients {args.clients}, delivered {len(latencies)}/{expected}")
+    print(f"latency ms: mean {mean(latencies) * 1000:.2f}, p50 {percentile(latencies, 50) * 1000:.2f}, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f}")
+
+
+if __name__ == "__main__":
+    main()
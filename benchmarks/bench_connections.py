@@ -0,0 +1,110 @@
+'''
+bench_connections
+how many idle socket.io connections one worker holds, and what they cost
+
+    python benchmarks/bench_connections.py --async-mode gevent --connections 10000
+
+starts one app worker in the given async mode, then opens websocket
+connections to it in steps, reporting the worker's resident memory and the
+time each step took to connect. the client side runs on gevent so it can
+hold all the connections from one process.
+needs gevent and websocket-client: pip install gevent websocket-client
+'''
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import websocket
+
+from common import ROOT, WORKER, wait_for_port, auth_cookie
+
+
+# lets both processes open more sockets than the usual 1024
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+def rss_mib(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+# one idle socket.io client speaking the engine.io v4 protocol directly,
+# it only answers the server's pings
+def idle_client(url: str, cookie: str, connected, stop):
+    try:
+        ws = websocket.create_connection(url, cookie=cookie)
+        ws.recv()          # engine.io open packet
+        ws.send("40")      # connect to the default namespace
+        ws.recv()          # namespace connected
+    except Exception:
+        return
+    connected.append(ws)
+    while not stop:
+        try:
+            packet = ws.recv()
+        except Exception:
+            return
+        if packet == "2":
+            ws.send("3")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--async-mode", default="gevent")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--step", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=5300)
+    args = parser.parse_args()
+
+    limit = raise_file_limit()
+    if limit < args.connections + 100:
+        print(f"warning: the open file limit is {limit}, connections will start failing before that")
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    env = dict(os.environ, PYTHONPATH=str(ROOT), CHAT_PORT=str(args.port),
+               CHAT_ASYNC_MODE=args.async_mode, CHAT_DATABASE_URL=f"sqlite:///{directory}/bench.db")
+    worker = subprocess.Popen([sys.executable, "-c", f"import resource; resource.setrlimit(resource.RLIMIT_NOFILE, "
+                               f"({limit}, {limit})); " + WORKER],
+                              cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connected, stop = [], []
+    try:
+        wait_for_port(args.port)
+        url = f"ws://localhost:{args.port}/socket.io/?EIO=4&transport=websocket"
+        # every connection uses the same token, the worker only verifies it once
+        cookie = auth_cookie("bench")
+        print(f"mode {args.async_mode}, worker rss at start {rss_mib(worker.pid):.1f} MiB")
+        print(f"{'connections':>12} {'step s':>8} {'rss MiB':>9} {'KiB/conn':>9}")
+        base = rss_mib(worker.pid)
+        clients = []
+        while len(connected) < args.connections:
+            target = min(len(connected) + args.step, args.connections)
+            start = time.perf_counter()
+            clients += [gevent.spawn(idle_client, url, cookie, connected, stop) for _ in range(target - len(connected))]
+            while len(connected) < target:
+                gevent.sleep(0.05)
+                if all(client.dead for client in clients[-args.step:]) and len(connected) < target:
+                    raise RuntimeError(f"connections failed at {len(connected)}")
+            elapsed = time.perf_counter() - start
+            rss = rss_mib(worker.pid)
+            print(f"{len(connected):>12} {elapsed:>8.2f} {rss:>9.1f} {(rss - base) * 1024 / len(connected):>9.1f}")
+    finally:
+        stop.append(True)
+        for ws in connected:
+            ws.close()
+        worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''
+bench_engine_profiles
+concurrent readers and writers against each engine profile in engine.py
+
+    python benchmarks/bench_engine_profiles.py --readers 8 --writers 4 --seconds 5
+
+readers page through a conversation like /get-messages, writers insert
+messages one commit at a time like db.insert_message. "locked" counts the
+operations that failed with "database is locked".
+'''
+
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from common import temp_database_url, percentile
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from models import Base, User, Message
+from engine import make_engine, ENGINE_PROFILES
+
+
+def seed(engine, messages: int):
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"username": name, "password": "x", "public_key": "x", "salt": "x"} for name in ("alice", "bob")])
+        connection.execute(insert(Message), [
+            {"sender": "alice", "receiver": "bob", "message": b"x" * 300, "iv": b"x",
+             "timestamp": datetime.utcnow()} for _ in range(messages)])
+
+def read(engine):
+    with Session(engine) as session:
+        session.query(Message).filter(Message.sender == "alice", Message.receiver == "bob") \
+            .order_by(Message.timestamp.desc(), Message.id.desc()).limit(50).all()
+
+def write(engine):
+    with Session(engine) as session:
+        session.add(Message(sender="bob", receiver="alice", message=b"x" * 300, iv=b"x"))
+        session.commit()
+
+def run(engine, readers: int, writers: int, seconds: float):
+    results = {"read": [], "write": [], "locked": 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def worker(kind, operation):
+        latencies, locked = [], 0
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                operation(engine)
+            except OperationalError:
+                locked += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        with lock:
+            results[kind].extend(latencies)
+            results["locked"] += locked
+
+    threads = [threading.Thread(target=worker, args=("read", read)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write", write)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(ENGINE_PROFILES))
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--messages", type=int, default=20000, help="messages seeded before the run")
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} {'reads/s':>9} {'read p99 ms':>12} {'writes/s':>9} {'write p99 ms':>13} {'locked':>7}")
+    for profile in args.profiles:
+        engine = make_engine(temp_database_url(), profile)
+        seed(engine, args.messages)
+        results = run(engine, args.readers, args.writers, args.seconds)
+        print(f"{profile:<10} {len(results['read']) / args.seconds:>9.0f} "
+              f"{percentile(results['read'], 99) * 1000:>12.2f} "
+              f"{len(results['write']) / args.seconds:>9.0f} "
+              f"{percentile(results['write'], 99) * 1000:>13.2f} {results['locked']:>7}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
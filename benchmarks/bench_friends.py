@@ -0,0 +1,117 @@
+'''
+bench_friends
+bulk friend request answers, and the friend graph queries as the number of users grows
+
+    python benchmarks/bench_friends.py --users 10000 100000 --friends 20 --requests 100
+
+seeds --users users, each friends with about --friends others close to them
+(so friends of friends overlap and have mutual friends like a real graph),
+into a temporary database and then times:
+
+  mutual / suggest - db.mutual_friends and db.friend_suggestions for random users
+  n+1 suggest      - the same suggestions worked out without the query: list_friends
+                     for the user and then for each of their friends, counted in python
+  single / bulk    - answering --requests received requests one POST (one transaction)
+                     each, like /accept-friend-request, against one accept_friend_requests call
+'''
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import warnings
+from collections import Counter
+
+from common import percentile, time_calls
+
+warnings.filterwarnings("ignore")
+# has to be set before db is imported
+os.environ["CHAT_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+
+from sqlalchemy import delete, insert
+import db
+from models import User, Friendship, FriendRequest
+
+# friends are picked from the next WINDOW users, so --friends has to stay under 2 * WINDOW
+WINDOW = 100
+SEED_CHUNK = 50000
+
+
+def seed(users: int, friends: int):
+    rng = random.Random(users)
+    names = [f"user{i}" for i in range(users)]
+    pairs = set()
+    for i, name in enumerate(names):
+        for step in rng.sample(range(1, WINDOW), friends // 2):
+            pairs.add(db.friendship_key(name, names[(i + step) % users]))
+    pairs = sorted(pairs)
+    with db.engine.begin() as connection:
+        connection.execute(delete(FriendRequest))
+        connection.execute(delete(Friendship))
+        connection.execute(delete(User))
+        for start in range(0, users, SEED_CHUNK):
+            connection.execute(insert(User), [{"username": name, "password": "x", "public_key": "x", "salt": "x"}
+                                              for name in names[start:start + SEED_CHUNK]])
+        for start in range(0, len(pairs), SEED_CHUNK):
+            connection.execute(insert(Friendship), [{"user_1": user_1, "user_2": user_2}
+                                                    for user_1, user_2 in pairs[start:start + SEED_CHUNK]])
+    return names, len(pairs)
+
+# friend_suggestions without the query, one list_friends per friend
+def suggest_n_plus_one(username: str, limit: int):
+    friends = set(db.list_friends(username))
+    counts = Counter(candidate for friend in friends for candidate in db.list_friends(friend)
+                     if candidate != username and candidate not in friends)
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+# requests from fresh users to receiver, returns their ids
+def pending_requests(receiver: str, count: int, tag: str):
+    senders = [f"{tag}{i}" for i in range(count)]
+    with db.engine.begin() as connection:
+        connection.execute(insert(User), [{"username": name, "password": "x", "public_key": "x", "salt": "x"}
+                                          for name in senders])
+        connection.execute(insert(FriendRequest), [{"sender": name, "receiver": receiver, "status": "pending"}
+                                                   for name in senders])
+    return [record.id for record in db.get_dashboard(receiver).received_requests]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--friends", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100, help="received requests answered at once")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    db.init()
+
+    print(f"{'users':>7} {'friendships':>12} {'query':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for users in args.users:
+        names, friendships = seed(users, args.friends)
+        pick = random.Random(0).choice
+        queries = {
+            "mutual": lambda: db.mutual_friends(pick(names), pick(names)),
+            "suggest": lambda: db.friend_suggestions(pick(names)),
+            "n+1 suggest": lambda: suggest_n_plus_one(pick(names), db.FRIEND_SUGGESTION_LIMIT),
+        }
+        for name, query in queries.items():
+            durations = time_calls(query, args.repeat)
+            print(f"{users:>7} {friendships:>12} {name:>11} {percentile(durations, 50) * 1000:>8.2f} "
+                  f"{percentile(durations, 99) * 1000:>8.2f}")
+
+        receiver = names[0]
+        ids = pending_requests(receiver, args.requests, f"single{users}-")
+        start = time.perf_counter()
+        for request_id in ids:
+            db.accept_friend_requests(receiver, [request_id])
+        single = time.perf_counter() - start
+        pending_requests(receiver, args.requests, f"bulk{users}-")
+        start = time.perf_counter()
+        db.accept_friend_requests(receiver, senders=[f"bulk{users}-{i}" for i in range(args.requests)])
+        bulk = time.perf_counter() - start
+        print(f"{users:>7} {friendships:>12} {'single':>11} {single * 1000:>8.2f} {'':>8}  "
+              f"({args.requests} requests, one transaction each)")
+        print(f"{users:>7} {friendships:>12} {'bulk':>11} {bulk * 1000:>8.2f} {'':>8}  (one transaction)")
+
+
+if __name__ == "__main__":
+    main()
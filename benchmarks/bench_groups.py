@@ -0,0 +1,104 @@
+'''
+bench_groups
+what a group message costs to store and send, against sending every member their own copy
+
+    python benchmarks/bench_groups.py --members 3 10 50 --size 200 2000 --messages 2000
+
+"copies" is a group done over the one to one path: the sender encrypts the
+message for each of the other members, each copy is a messages row and an
+emit to that pair's room. "group" is what group_send does: the body once plus
+a 256 byte key envelope per member (a group_message row and one message_key
+row each, in one transaction), one emit of the body to the group's room and a
+small "group_key" emit with each member's envelope. "all keys" is the same
+but with every envelope in the room emit instead, which is what the per-member
+key emits avoid: each member would receive every envelope.
+
+reports per message: rows and bytes stored (sqlite file size after a vacuum,
+divided by --messages), how long the write takes, emits, the bytes the server
+encodes and the bytes delivered to all members together.
+'''
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+# puts the project root on sys.path
+import common
+from socketio import packet
+from sqlalchemy import create_engine, insert, text
+
+from models import Base, GroupMessage, Message, MessageKey
+
+ENVELOPE_SIZE = 256
+IV_SIZE = 12
+# AES-GCM adds a 16 byte tag
+TAG_SIZE = 16
+
+
+def packet_size(data) -> int:
+    encoded = packet.Packet(packet.EVENT, data=data).encode()
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+def run(members: int, size: int, count: int, mode: str) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="chat-bench-"), "groups.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    names = [f"user{i}" for i in range(members)]
+    body = os.urandom(size + TAG_SIZE)
+    envelopes = {name: os.urandom(ENVELOPE_SIZE) for name in names}
+    start = time.perf_counter()
+    for _ in range(count):
+        timestamp = datetime.utcnow()
+        # the same statements as db.insert_messages and db.insert_group_message, a transaction per message
+        with engine.begin() as connection:
+            if mode == "copies":
+                connection.execute(insert(Message), [
+                    {"sender": names[0], "receiver": name, "message": body + envelopes[name], "iv": envelopes[name][:IV_SIZE],
+                     "timestamp": timestamp} for name in names[1:]])
+            else:
+                message_id = connection.execute(insert(GroupMessage).values(
+                    conversation_id=1, sender=names[0], body=body, iv=body[:IV_SIZE], timestamp=timestamp)).inserted_primary_key[0]
+                connection.execute(insert(MessageKey), [
+                    {"message_id": message_id, "username": name, "envelope": envelope} for name, envelope in envelopes.items()])
+    elapsed = time.perf_counter() - start
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    engine.dispose()
+    message = {"id": 1, "group_id": 1, "sender": names[0], "body": body, "iv": body[:IV_SIZE],
+               "timestamp": timestamp.isoformat()}
+    if mode == "copies":
+        sizes = [packet_size(["incoming", {"username": names[0], "message": body + envelopes[name]}]) for name in names[1:]]
+        rows, emits, encoded, delivered = members - 1, members - 1, sum(sizes), sum(sizes)
+    elif mode == "group":
+        size = packet_size(["group_message", message])
+        keys = [packet_size(["group_key", {"id": 1, "key": envelopes[name]}]) for name in names[1:]]
+        rows, emits, encoded, delivered = 1 + members, members, size + sum(keys), size * (members - 1) + sum(keys)
+    else:
+        size = packet_size(["group_message", dict(message, keys=envelopes)])
+        rows, emits, encoded, delivered = 1 + members, 1, size, size * (members - 1)
+    return {"rows": rows, "stored": os.path.getsize(path) / count, "write_ms": elapsed / count * 1000,
+            "emits": emits, "encoded": encoded, "delivered": delivered}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, nargs="+", default=[3, 10, 50])
+    parser.add_argument("--size", type=int, nargs="+", default=[200, 2000], help="plaintext bytes per message")
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'members':>7} {'size':>6} {'mode':>8} {'rows':>5} {'stored B':>9} {'write ms':>9} {'emits':>6} "
+          f"{'encoded B':>10} {'delivered B':>12}")
+    for members in args.members:
+        for size in args.size:
+            for mode in ("copies", "group", "all keys"):
+                r = run(members, size, args.messages, mode)
+                print(f"{members:>7} {size:>6} {mode:>8} {r['rows']:>5} {r['stored']:>9.0f} {r['write_ms']:>9.3f} "
+                      f"{r['emits']:>6} {r['encoded']:>10} {r['delivered']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''
+bench_history
+peak memory and throughput of history.py's NDJSON export and import as the
+messages table grows, memory should stay flat
+
+    python benchmarks/bench_history.py --rows 100000 1000000 10000000
+
+each size is seeded into a temporary database, then exported and imported
+into a second one, each in its own process so its peak RSS can be read.
+the "wal" engine profile maps up to 256 MiB of the database file and keeps a
+64 MiB page cache, both count towards RSS until they're full, so compare
+sizes with --profile default to see what the export itself holds
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from common import ROOT
+from sqlalchemy import create_engine, insert
+from models import Base, Message
+
+# runs history.main with the arguments after -c, then prints the process's peak rss in KiB
+RUNNER = "import sys, resource, history; history.main(sys.argv[1:]); " \
+         "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+SEED_BATCH = 50000
+
+
+def seed(url: str, rows: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    timestamp = datetime.utcnow()
+    with engine.begin() as connection:
+        for start in range(0, rows, SEED_BATCH):
+            connection.execute(insert(Message), [
+                {"sender": f"user{i % 100}", "receiver": f"user{(i + 1) % 100}", "message": os.urandom(256),
+                 "iv": os.urandom(12), "timestamp": timestamp} for i in range(start, min(rows, start + SEED_BATCH))])
+    engine.dispose()
+
+# runs a history.py command against the database, returns (seconds, peak rss in MiB)
+def run(directory: str, url: str, profile: str, *args):
+    env = dict(os.environ, PYTHONPATH=str(ROOT), CHAT_DATABASE_URL=url, CHAT_DATABASE_PROFILE=profile)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", RUNNER, *args], cwd=directory, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return time.perf_counter() - start, int(output.split()[-1]) / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--profile", default="wal", help="engine profile the export and import run with")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'export s':>9} {'rows/s':>9} {'peak MiB':>9} {'import s':>9} {'rows/s':>9} {'peak MiB':>9}")
+    for rows in args.rows:
+        directory = tempfile.mkdtemp(prefix="chat-bench-")
+        source = f"sqlite:///{directory}/source.db"
+        seed(source, rows)
+        path = os.path.join(directory, "export.ndjson")
+        export_time, export_rss = run(directory, source, args.profile, "export", path)
+        import_time, import_rss = run(directory, f"sqlite:///{directory}/target.db", args.profile, "import", path)
+        print(f"{rows:>10} {export_time:>9.1f} {rows / export_time:>9.0f} {export_rss:>9.1f} "
+              f"{import_time:>9.1f} {rows / import_time:>9.0f} {import_rss:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
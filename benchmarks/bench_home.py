@@ -0,0 +1,71 @@
+'''
+bench_home
+/home latency as the user's friend count grows, with the per-user dashboard
+summary cached and with it rebuilt on every request
+
+    python benchmarks/bench_home.py --friends 10 100 1000 5000 --requests 200
+
+runs the app in this process (Flask test client) against a temporary database
+'''
+
+import argparse
+import os
+import tempfile
+import warnings
+
+from common import percentile, time_calls
+
+warnings.filterwarnings("ignore")
+# has to be set before app/db are imported
+os.environ["CHAT_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+
+from sqlalchemy import insert
+import app as chat_app
+import db
+from models import User, Friendship, FriendRequest, Message
+
+
+def seed(user: str, friends: int):
+    names = [f"{user}-friend{i}" for i in range(friends)]
+    with db.engine.begin() as connection:
+        connection.execute(insert(User), [{"username": name, "password": "x", "public_key": "x", "salt": "x"}
+                                          for name in names])
+        connection.execute(insert(Friendship), [dict(zip(("user_1", "user_2"), db.friendship_key(user, name)))
+                                                for name in names])
+        connection.execute(insert(FriendRequest), [{"sender": name, "receiver": user, "status": "pending"}
+                                                   for name in names[:10]])
+        connection.execute(insert(Message), [{"sender": name, "receiver": user, "message": b"x", "iv": b"x"}
+                                             for name in names for _ in range(3)])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--friends", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    flask_app = chat_app.create_app()
+    flask_app.config["JWT_COOKIE_SECURE"] = False
+    print(f"{'friends':>8} {'cached p50':>11} {'cached p99':>11} {'uncached p50':>13} {'uncached p99':>13}  (ms)")
+    for count in args.friends:
+        user = f"user{count}"
+        db.insert_user(user, "pw", "x", "x")
+        seed(user, count)
+        client = flask_app.test_client()
+        client.post("/login/user", json={"username": user, "password": "pw"})
+
+        def home():
+            assert client.get("/home").status_code == 200
+
+        def home_uncached():
+            db.invalidate_dashboard(user)
+            home()
+
+        home()
+        cached = time_calls(home, args.requests)
+        uncached = time_calls(home_uncached, args.requests)
+        print(f"{count:>8} {percentile(cached, 50) * 1000:>11.2f} {percentile(cached, 99) * 1000:>11.2f} "
+              f"{percentile(uncached, 50) * 1000:>13.2f} {percentile(uncached, 99) * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
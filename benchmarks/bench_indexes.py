@@ -0,0 +1,110 @@
+'''
+bench_indexes
+times the lookups db.py makes with and without the indexes added by
+migrations.add_lookup_indexes
+
+    python benchmarks/bench_indexes.py --rows 100000 1000000
+
+every table is seeded with --rows rows, then each query is run --repeat times
+against a database without the indexes (like an old main.db) and again
+after running the migration
+'''
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import temp_database_url, time_calls, mean
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from models import Base, User, Message, Friendship, FriendRequest
+import migrations
+
+
+def seed(engine, rows: int, users: int):
+    names = [f"user{i}" for i in range(users)]
+    start = datetime(2024, 1, 1)
+    pick = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"username": name, "password": "x", "public_key": "x", "salt": "x"} for name in names])
+        connection.execute(Message.__table__.insert(), [
+            {"sender": pick.choice(names), "receiver": pick.choice(names), "message": b"x", "iv": b"x",
+             "timestamp": start + timedelta(seconds=i)} for i in range(rows)])
+        connection.execute(Friendship.__table__.insert(), [
+            {"user_1": pick.choice(names), "user_2": pick.choice(names)} for _ in range(rows)])
+        connection.execute(FriendRequest.__table__.insert(), [
+            {"sender": pick.choice(names), "receiver": pick.choice(names),
+             "status": pick.choice(("pending", "accepted", "rejected"))} for _ in range(rows)])
+    return names
+
+def drop_indexes(engine):
+    with engine.begin() as connection:
+        names = connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'")).scalars().all()
+        for name in names:
+            connection.execute(text(f"DROP INDEX {name}"))
+
+# the same query shapes db.py uses
+def lookups(engine, names):
+    pick = random.Random(1)
+
+    def list_friends():
+        user = pick.choice(names)
+        with Session(engine) as session:
+            session.query(Friendship).filter((Friendship.user_1 == user) | (Friendship.user_2 == user)).all()
+
+    def are_friends():
+        user1, user2 = pick.choice(names), pick.choice(names)
+        with Session(engine) as session:
+            session.query(Friendship).filter(
+                ((Friendship.user_1 == user1) & (Friendship.user_2 == user2)) |
+                ((Friendship.user_1 == user2) & (Friendship.user_2 == user1))).first()
+
+    def list_friend_requests():
+        user = pick.choice(names)
+        with Session(engine) as session:
+            session.query(FriendRequest).filter(FriendRequest.receiver == user, FriendRequest.status == "pending").all()
+            session.query(FriendRequest).filter(FriendRequest.sender == user, FriendRequest.status == "pending").all()
+
+    def get_messages_between_users():
+        user1, user2 = pick.choice(names), pick.choice(names)
+        with Session(engine) as session:
+            for sender, receiver in ((user1, user2), (user2, user1)):
+                session.query(Message).filter(Message.sender == sender, Message.receiver == receiver) \
+                    .order_by(Message.timestamp.desc(), Message.id.desc()).limit(50).all()
+
+    return {
+        "list_friends": list_friends,
+        "are_friends": are_friends,
+        "list_friend_requests": list_friend_requests,
+        "get_messages_between_users": get_messages_between_users,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'query':<28} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    for rows in args.rows:
+        engine = create_engine(temp_database_url())
+        Base.metadata.create_all(engine)
+        drop_indexes(engine)
+        names = seed(engine, rows, users=max(1000, rows // 100))
+
+        before = {name: mean(time_calls(fn, args.repeat)) for name, fn in lookups(engine, names).items()}
+        with engine.begin() as connection:
+            migrations.add_lookup_indexes(connection)
+        after = {name: mean(time_calls(fn, args.repeat)) for name, fn in lookups(engine, names).items()}
+
+        for name in before:
+            print(f"{rows:>10} {name:<28} {before[name] * 1000:>12.3f} {after[name] * 1000:>12.3f} "
+                  f"{before[name] / after[name]:>8.1f}x")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+'''
+bench_load
+load test of the main HTTP and socket.io paths, reported as JSON
+
+    python benchmarks/bench_load.py --users 200 --clients 16 --requests 50 --output results.json
+    python benchmarks/bench_load.py --compare results.json
+
+runs the app in this process against a temporary database seeded with
+--users users, each friends with the next --friends users and with
+--messages messages in every conversation. then --clients simulated clients
+(threads, each logged in as its own user with a Flask and a socket.io test
+client) run --requests operations of every scenario at the same time:
+
+    signup, login, get_messages, send_message, socket_join, socket_send, socket_leave
+
+every scenario reports throughput and latency percentiles. the test clients
+skip the network, so the numbers are what db.py and the handlers cost.
+--compare loads an earlier report and exits with status 1 if any scenario's
+p99 got more than --tolerance slower, so it can run before a deploy.
+
+passwords are hashed with --hash-method, cheap by default so signup/login
+measure the app rather than the password hash (pass the production
+"pbkdf2:sha256:260000" to include it).
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+from common import percentile, mean
+
+SCENARIOS = ["signup", "login", "get_messages", "send_message", "socket_join", "socket_send", "socket_leave"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--friends", type=int, default=5, help="friends per seeded user")
+    parser.add_argument("--messages", type=int, default=100, help="messages per conversation")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent simulated clients")
+    parser.add_argument("--requests", type=int, default=50, help="operations per client per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--hash-method", default="pbkdf2:sha256:1000")
+    parser.add_argument("--output", default=None, help="also write the report to this file")
+    parser.add_argument("--compare", default=None, help="an earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p99 slowdown for --compare")
+    args = parser.parse_args(argv)
+    if args.clients > args.users:
+        parser.error("--clients can't be more than --users")
+    return args
+
+def summarize(durations, errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(durations),
+        "errors": errors,
+        "throughput": round(len(durations) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(mean(durations) * 1000, 3),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p90_ms": round(percentile(durations, 90) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "max_ms": round(max(durations, default=0) * 1000, 3),
+    }
+
+# scenarios whose p99 in report is more than tolerance slower than in baseline
+def regressions(report: dict, baseline: dict, tolerance: float):
+    found = []
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before and before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            found.append(f"{name}: p99 {before['p99_ms']} ms -> {result['p99_ms']} ms")
+    return found
+
+
+class LoadTest():
+    def __init__(self, args):
+        self.args = args
+        # the app reads its config from the environment when it's imported
+        os.environ["CHAT_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+        os.environ["CHAT_HASH_METHOD"] = args.hash_method
+        warnings.filterwarnings("ignore")
+        import app as chat_app
+        import db
+        self.socketio = chat_app.socketio
+        self.flask_app = chat_app.create_app()
+        self.db = db
+        self.flask_app.config["JWT_COOKIE_SECURE"] = False
+        self.flask_app.config["JWT_COOKIE_CSRF_PROTECT"] = False
+        self.names = [f"user{i}" for i in range(args.users)]
+        self.signups = 0
+        self.lock = threading.Lock()
+
+    # users, friendships and messages straight into the database
+    def seed(self):
+        from sqlalchemy import insert
+        from models import User, Friendship, Message
+        import hashing
+        password = hashing.hash_password("password")
+        pairs = {self.db.friendship_key(name, self.names[(i + step) % len(self.names)])
+                 for i, name in enumerate(self.names) for step in range(1, self.args.friends + 1)}
+        pairs = [pair for pair in pairs if pair[0] != pair[1]]
+        with self.db.engine.begin() as connection:
+            connection.execute(insert(User), [{"username": name, "password": password, "public_key": "key",
+                                               "salt": "salt"} for name in self.names])
+            connection.execute(insert(Friendship), [{"user_1": a, "user_2": b} for a, b in pairs])
+            for a, b in pairs:
+                connection.execute(insert(Message), [
+                    {"sender": (a, b)[i % 2], "receiver": (b, a)[i % 2], "message": os.urandom(256),
+                     "iv": os.urandom(12)} for i in range(self.args.messages)])
+
+    # a logged in client for user i, talking to its first friend
+    def make_client(self, i: int) -> dict:
+        username = self.names[i]
+        http = self.flask_app.test_client()
+        response = http.post("/login/user", json={"username": username, "password": "password"})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        socket = self.socketio.test_client(self.flask_app, flask_test_client=http)
+        return {"username": username, "peer": self.names[(i + 1) % len(self.names)], "http": http,
+                "socket": socket, "room_id": None}
+
+    # one operation of the scenario, returns whether it succeeded
+    def run_once(self, scenario: str, client: dict) -> bool:
+        http, username, peer = client["http"], client["username"], client["peer"]
+        if scenario == "signup":
+            with self.lock:
+                self.signups += 1
+                name = f"signup{self.signups}"
+            response = http.post("/signup/user", json={"username": name, "password": "password",
+                                                       "public_key": "key", "salt": "salt"})
+            return response.status_code == 200
+        if scenario == "login":
+            response = http.post("/login/user", json={"username": username, "password": "password"})
+            return response.status_code == 200
+        if scenario == "get_messages":
+            return http.get(f"/get-messages/{username}/{peer}").status_code == 200
+        if scenario == "send_message":
+            response = http.post("/send-message", json={"receiver": peer, "encryptedMessage": "AAAA", "iv": "AAAA"})
+            return response.status_code == 200
+        socket = client["socket"]
+        if scenario == "socket_join":
+            client["room_id"] = socket.emit("join", username, peer, callback=True)
+            socket.get_received()
+            return isinstance(client["room_id"], int)
+        if scenario == "socket_send":
+            socket.emit("send", username, os.urandom(256), client["room_id"])
+            socket.get_received()
+            return True
+        if scenario == "socket_leave":
+            socket.emit("leave", username, client["room_id"])
+            socket.get_received()
+            # back in for the next round
+            client["room_id"] = socket.emit("join", username, peer, callback=True)
+            socket.get_received()
+            return True
+        raise ValueError(scenario)
+
+    # every client runs the scenario --requests times at once
+    def run_scenario(self, scenario: str, clients) -> dict:
+        durations, errors = [], [0]
+        start_line = threading.Barrier(len(clients) + 1)
+
+        def worker(client):
+            mine, failed = [], 0
+            start_line.wait()
+            for _ in range(self.args.requests):
+                start = time.perf_counter()
+                try:
+                    ok = self.run_once(scenario, client)
+                except Exception:
+                    ok = False
+                mine.append(time.perf_counter() - start)
+                failed += not ok
+            with self.lock:
+                durations.extend(mine)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return summarize(durations, errors[0], time.perf_counter() - start)
+
+    def run(self) -> dict:
+        self.seed()
+        clients = [self.make_client(i) for i in range(self.args.clients)]
+        if any(scenario.startswith("socket_") for scenario in self.args.scenarios):
+            for client in clients:
+                client["room_id"] = client["socket"].emit("join", client["username"], client["peer"], callback=True)
+        report = {
+            "config": {key: value for key, value in vars(self.args).items()
+                       if key not in ("output", "compare", "tolerance")},
+            "scenarios": {scenario: self.run_scenario(scenario, clients) for scenario in self.args.scenarios},
+        }
+        for client in clients:
+            client["socket"].disconnect()
+        return report
+
+
+def main():
+    args = parse_args()
+    report = LoadTest(args).run()
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as file:
+            found = regressions(report, json.load(file), args.tolerance)
+        for line in found:
+            print(f"regression: {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+'''
+bench_login_storm
+chat traffic latency on a worker that is also handling a storm of logins,
+hashing on the request thread (CHAT_HASH_WORKERS=0) vs. on the hashing pool
+
+    python benchmarks/bench_login_storm.py --async-mode gevent --logins 32 --chatters 8 --seconds 10
+
+chatters fetch a public key and store a message in a loop, like home.jinja's send()
+needs requests: pip install requests
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from sqlalchemy import create_engine, insert
+from werkzeug.security import generate_password_hash
+
+from common import ROOT, WORKER, auth_headers, wait_for_port, percentile
+from models import Base, User
+
+
+def seed(url: str, users: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    password = generate_password_hash("password")
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{"username": f"user{i}", "password": password, "public_key": "x", "salt": "x"}
+                                          for i in range(users)])
+    engine.dispose()
+
+def run(args, hash_workers):
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    url = f"sqlite:///{directory}/bench.db"
+    seed(url, args.logins + args.chatters)
+    env = dict(os.environ, PYTHONPATH=str(ROOT), CHAT_PORT=str(args.port), CHAT_DATABASE_URL=url,
+               CHAT_ASYNC_MODE=args.async_mode)
+    if hash_workers is not None:
+        env["CHAT_HASH_WORKERS"] = str(hash_workers)
+    worker = subprocess.Popen([sys.executable, "-c", WORKER], cwd=directory, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://localhost:{args.port}"
+    results = {"logins": 0, "shed": 0, "chat": []}
+    lock = threading.Lock()
+    try:
+        wait_for_port(args.port)
+        stop = time.monotonic() + args.seconds
+
+        def login(i):
+            session = requests.Session()
+            done = shed = 0
+            while time.monotonic() < stop:
+                status = session.post(f"{base}/login/user", json={"username": f"user{i}", "password": "password"}).status_code
+                done += status == 200
+                shed += status == 429
+            with lock:
+                results["logins"] += done
+                results["shed"] += shed
+
+        def chat(i):
+            session = requests.Session()
+            me, peer = f"user{args.logins + i}", f"user{i}"
+            # logged in without a login, the storm is the other threads' job
+            headers = auth_headers(me)
+            latencies = []
+            while time.monotonic() < stop:
+                start = time.perf_counter()
+                session.get(f"{base}/get-public-key/{peer}")
+                session.post(f"{base}/send-message", json={"receiver": peer, "encryptedMessage": "eA==", "iv": "eA=="},
+                             headers=headers)
+                latencies.append(time.perf_counter() - start)
+            with lock:
+                results["chat"].extend(latencies)
+
+        threads = [threading.Thread(target=login, args=(i,)) for i in range(args.logins)]
+        threads += [threading.Thread(target=chat, args=(i,)) for i in range(args.chatters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        worker.terminate()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--async-mode", default="gevent")
+    parser.add_argument("--logins", type=int, default=32, help="clients logging in over and over")
+    parser.add_argument("--chatters", type=int, default=8, help="clients sending messages")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5400)
+    args = parser.parse_args()
+
+    print(f"{'hashing':<14} {'logins/s':>9} {'429s':>6} {'chat ops/s':>11} {'chat p50 ms':>12} {'chat p99 ms':>12}")
+    for name, hash_workers in (("request thread", 0), ("process pool", None)):
+        results = run(args, hash_workers)
+        chat = results["chat"]
+        print(f"{name:<14} {results['logins'] / args.seconds:>9.1f} {results['shed']:>6} {len(chat) / args.seconds:>11.1f} "
+              f"{percentile(chat, 50) * 1000:>12.2f} {percentile(chat, 99) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
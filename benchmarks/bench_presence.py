@@ -0,0 +1,121 @@
+'''
+bench_presence
+how many socket.io events presence and typing send out as users pile up
+
+    python benchmarks/bench_presence.py --users 1000 5000 20000 --seconds 60
+
+simulates --users connected users, each with --friends friends and in a
+chat room with one of them, on a simulated clock, through presence.Presence
+with emits counted instead of sent. every user heartbeats every 20 seconds,
+--typing of them are typing at any moment (sending "typing" --rate times a
+second, far more than the client does, for --burst seconds before sending
+the message) and --churn of them go silent and are replaced every minute.
+
+"naive" is what an emit-per-event handler would send: one "typing" per
+received typing event to the room, one "presence" per friend on every
+connect and timeout. "batched" is what presence.py actually emitted.
+the flush column is the wall time one flush takes (median and max),
+everything else runs on the simulated clock so a minute takes seconds.
+'''
+
+import argparse
+import random
+import time
+
+from common import percentile
+from presence import Presence
+
+TICK = 0.05
+HEARTBEAT_INTERVAL = 20
+
+
+def run(args, users: int) -> dict:
+    rng = random.Random(users)
+    sent = {"presence": 0, "typing": 0}
+    presence = Presence(lambda event, data, to: sent.__setitem__(event, sent[event] + 1),
+                        timeout=args.timeout, typing_timeout=6, flush_interval=args.flush_interval,
+                        rate=args.limit_rate, burst=args.limit_burst)
+    # no flush thread, the loop below flushes on the simulated clock
+    presence.thread = "simulated"
+    names = [f"user{i}" for i in range(users)]
+    friends = {name: {names[(i + step) % users] for step in range(-args.friends // 2, args.friends // 2 + 1) if step}
+               for i, name in enumerate(names)}
+    room_of = {name: i // 2 for i, name in enumerate(names)}
+    naive = 0
+    now = 0.0
+    online = set(names)
+    next_heartbeat = {name: rng.uniform(0, HEARTBEAT_INTERVAL) for name in names}
+    for name in names:
+        presence.connect(name, friends[name], now)
+        naive += len(friends[name])
+    # username -> when they stop typing and send
+    typing = {}
+    flush_times = []
+    next_flush = args.flush_interval
+    end = args.seconds
+    while now < end:
+        now += TICK
+        for name in rng.sample(sorted(online - typing.keys()), max(0, int(users * args.typing) - len(typing))):
+            typing[name] = now + rng.uniform(0.5, 2) * args.burst
+        for name, until in list(typing.items()):
+            if until <= now:
+                del typing[name]
+                presence.stop_typing(name, room_of[name])
+                continue
+            # rate * TICK events a tick on average
+            for _ in range(int(args.rate * TICK + rng.random())):
+                presence.set_typing(name, name, room_of[name], True, now)
+                naive += 1
+        for name in online:
+            if next_heartbeat[name] <= now:
+                presence.heartbeat(name, name, now)
+                next_heartbeat[name] = now + HEARTBEAT_INTERVAL
+        # churn: some go silent (no disconnect event, they just stop) and others connect
+        leaving = rng.sample(sorted(online), int(len(online) * args.churn * TICK / 60))
+        for name in leaving:
+            online.discard(name)
+            typing.pop(name, None)
+            # an emit-per-event handler notices them on timeout
+            naive += len(friends[name])
+        for name in rng.sample(sorted(set(names) - online), len(leaving)):
+            online.add(name)
+            presence.limiter.forget(name)
+            presence.connect(name, friends[name], now)
+            next_heartbeat[name] = now + HEARTBEAT_INTERVAL
+            naive += len(friends[name])
+        if now >= next_flush:
+            start = time.perf_counter()
+            presence.flush(now)
+            flush_times.append(time.perf_counter() - start)
+            next_flush += args.flush_interval
+    batched = sent["presence"] + sent["typing"]
+    return {"received": presence.stats["received"] / now, "dropped": presence.stats["dropped"] / now,
+            "naive": naive / now, "batched": batched / now, "typing": sent["typing"] / now,
+            "presence": sent["presence"] / now, "flush_p50": percentile(flush_times, 50),
+            "flush_max": max(flush_times)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--friends", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=60, help="simulated seconds")
+    parser.add_argument("--typing", type=float, default=0.2, help="fraction of users typing at once")
+    parser.add_argument("--rate", type=float, default=10, help="typing events a typing user sends per second")
+    parser.add_argument("--burst", type=float, default=4, help="seconds a user types before sending")
+    parser.add_argument("--churn", type=float, default=0.05, help="fraction of users replaced per minute")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--limit-rate", type=float, default=2.0)
+    parser.add_argument("--limit-burst", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'users':>7} {'in/s':>9} {'dropped/s':>10} {'naive out/s':>12} {'batched out/s':>14} "
+          f"{'(typing':>8} {'presence)':>10} {'flush p50 ms':>13} {'max ms':>8}")
+    for users in args.users:
+        r = run(args, users)
+        print(f"{users:>7} {r['received']:>9.0f} {r['dropped']:>10.0f} {r['naive']:>12.0f} {r['batched']:>14.0f} "
+              f"{r['typing']:>8.0f} {r['presence']:>10.0f} {r['flush_p50'] * 1000:>13.2f} {r['flush_max'] * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
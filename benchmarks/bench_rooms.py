@@ -0,0 +1,69 @@
+'''
+bench_rooms
+memory and speed of the in-process Room registry with many simulated users
+
+    python benchmarks/bench_rooms.py --users 100000 --conversations 3
+
+every user opens --conversations chats with random other users, then looks
+up their rooms, then leaves everything. after the last leave there should be
+no users or rooms left, empty rooms are collected. (what memory is still
+reported then is python keeping the emptied dicts' hash tables at full size)
+'''
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import common  # puts the project root on sys.path
+
+from models import Room
+
+
+def timed(label: str, operations: int, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {operations:>9} ops {elapsed:>8.3f} s {operations / elapsed:>12.0f} ops/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--conversations", type=int, default=3, help="chats each user opens")
+    args = parser.parse_args()
+
+    pick = random.Random(0)
+    users = [f"user{i}" for i in range(args.users)]
+    chats = [(user, pick.choice(users)) for user in users for _ in range(args.conversations)]
+    chats = [(sender, receiver) for sender, receiver in chats if sender != receiver]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    room = Room()
+
+    def join_all():
+        for sender, receiver in chats:
+            room.get_or_create_room(sender, receiver)
+            # the receiver answers, landing in the same room
+            room.get_or_create_room(receiver, sender)
+
+    def lookup_all():
+        for user in users:
+            room.get_room_ids(user)
+
+    def leave_all():
+        for user in users:
+            room.leave_room(user)
+
+    timed("join", 2 * len(chats), join_all)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    print(f"{room.user_count()} users in {room.room_count()} rooms: {used / 2 ** 20:.1f} MiB, "
+          f"{used / room.user_count():.0f} bytes per user")
+    timed("lookup", len(users), lookup_all)
+    timed("leave", len(users), leave_all)
+    left = tracemalloc.get_traced_memory()[0] - baseline
+    print(f"after everyone left: {room.user_count()} users, {room.room_count()} rooms, {left / 2 ** 10:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
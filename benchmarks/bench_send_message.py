@@ -0,0 +1,102 @@
+'''
+bench_send_message
+message throughput with concurrent senders, committing every message on its own
+(the old db.insert_message) vs. the batched MessageWriter in both durability modes
+
+    python benchmarks/bench_send_message.py --senders 1 8 32 --messages 200
+'''
+
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from common import temp_database_url, percentile
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from models import Base, User, Message
+from message_writer import MessageWriter
+
+
+def make_engine():
+    engine = create_engine(temp_database_url())
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"username": name, "password": "x", "public_key": "x", "salt": "x"} for name in ("alice", "bob")])
+    return engine
+
+def row(i: int) -> dict:
+    return {"sender": "alice", "receiver": "bob", "message": f"message {i}".encode(), "iv": b"iv", "timestamp": datetime.utcnow()}
+
+# runs `senders` threads that each call send(i) `messages` times
+# returns (messages per second, per-message latencies)
+def drive(send, senders: int, messages: int):
+    latencies = []
+    lock = threading.Lock()
+
+    def sender():
+        mine = []
+        for i in range(messages):
+            start = time.perf_counter()
+            send(i)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=sender) for _ in range(senders)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return senders * messages / (time.perf_counter() - start), latencies
+
+def commit_each(engine):
+    # sqlite takes one writer at a time, queue them up here instead of failing with "database is locked"
+    lock = threading.Lock()
+
+    def send(i):
+        with lock, Session(engine) as session:
+            session.add(Message(**row(i)))
+            session.commit()
+    return send, None
+
+def batched(engine, durability):
+    def write_batch(rows):
+        with Session(engine) as session:
+            session.execute(insert(Message), rows)
+            session.commit()
+    writer = MessageWriter(write_batch, durability=durability)
+    return (lambda i: writer.submit(row(i))), writer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--messages", type=int, default=200, help="messages per sender")
+    args = parser.parse_args()
+
+    modes = {
+        "commit each": commit_each,
+        "batched, commit": lambda engine: batched(engine, "commit"),
+        "batched, enqueue": lambda engine: batched(engine, "enqueue"),
+    }
+    print(f"{'senders':>8} {'mode':<18} {'msg/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for senders in args.senders:
+        for name, make_sender in modes.items():
+            engine = make_engine()
+            send, writer = make_sender(engine)
+            rate, latencies = drive(send, senders, args.messages)
+            if writer is not None:
+                # enqueue mode isn't done until the queue has drained
+                start = time.perf_counter()
+                writer.close()
+                rate = senders * args.messages / (senders * args.messages / rate + time.perf_counter() - start)
+            print(f"{senders:>8} {name:<18} {rate:>10.0f} {percentile(latencies, 50) * 1000:>9.3f} "
+                  f"{percentile(latencies, 99) * 1000:>9.3f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
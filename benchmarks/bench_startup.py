@@ -0,0 +1,67 @@
+'''
+bench_startup
+how long a worker takes from a cold python process to answering its first request
+
+    python benchmarks/bench_startup.py --runs 10
+
+each run is a new process: import app, create_app() (split into db.init()
+and the rest) and a first GET / through the test client. runs against a
+database that doesn't exist yet (create_all + stamp) and one that is already
+at the latest migration (a single PRAGMA user_version). prints the median
+of every phase in milliseconds.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, percentile
+
+# times each phase and prints them as json
+PROBE = """
+import time, json
+start = time.perf_counter()
+import app, db
+imported = time.perf_counter()
+db.init()
+database = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+assert flask_app.test_client().get("/").status_code == 200
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "db.init": database - imported,
+                  "create_app": created - database, "first request": served - created,
+                  "total": served - start}))
+"""
+PHASES = ["import", "db.init", "create_app", "first request", "total"]
+
+
+def run(url: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(ROOT), CHAT_DATABASE_URL=url)
+    output = subprocess.run([sys.executable, "-W", "ignore", "-c", PROBE], env=env, cwd=ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'database':>10} " + " ".join(f"{phase:>13}" for phase in PHASES) + "  (median ms)")
+    for label in ("new", "current"):
+        results = []
+        for _ in range(args.runs):
+            url = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+            if label == "current":
+                # the first start creates and stamps it, the timed one finds it up to date
+                run(url)
+            results.append(run(url))
+        print(f"{label:>10} " + " ".join(f"{percentile([r[phase] for r in results], 50) * 1000:>13.1f}"
+                                          for phase in PHASES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+bench_wire_format
+what storing and sending the ciphertext as raw bytes saves over base64 text
+
+    python benchmarks/bench_wire_format.py --messages 20000 --page 500
+
+reports, for a chat message like home.jinja sends (a 2048 bit RSA-OAEP
+ciphertext and a 12 byte AES-GCM iv):
+  - the socket.io "send" packet with a base64 string vs a binary attachment
+  - the sqlite file holding --messages messages as base64 text vs as blobs
+  - a /get-messages page of --page messages as base64 JSON vs msgpack,
+    size and requests per second
+
+runs the app in this process (Flask test client) against a temporary database
+'''
+
+import argparse
+import base64
+import os
+import tempfile
+import time
+import warnings
+
+from common import time_calls, percentile
+
+warnings.filterwarnings("ignore")
+# has to be set before app/db are imported
+os.environ["CHAT_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+
+from socketio import packet
+from sqlalchemy import create_engine, insert, text
+import app as chat_app
+import db
+import wire
+from models import Base, Message, Friendship
+
+CIPHERTEXT_SIZE = 256
+IV_SIZE = 12
+
+
+def messages(count: int, encode):
+    return [{"sender": "alice", "receiver": "bob", "message": encode(os.urandom(CIPHERTEXT_SIZE)),
+             "iv": encode(os.urandom(IV_SIZE))} for _ in range(count)]
+
+def b64(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+# bytes on the wire for one socket.io packet, attachments included
+def packet_size(data) -> int:
+    encoded = packet.Packet(packet.EVENT, data=data).encode()
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+# size of a sqlite file holding the rows, after a vacuum
+def database_size(rows) -> int:
+    path = os.path.join(tempfile.mkdtemp(prefix="chat-bench-"), "size.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # core insert with text() so the base64 strings aren't run through LargeBinary
+        connection.execute(text("INSERT INTO messages (sender, receiver, message, iv) "
+                                "VALUES (:sender, :receiver, :message, :iv)"), rows)
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    engine.dispose()
+    return os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    ciphertext = os.urandom(CIPHERTEXT_SIZE)
+    as_text = packet_size(["send", "alice", b64(ciphertext), 1])
+    as_binary = packet_size(["send", "alice", ciphertext, 1])
+    print(f"socket.io send packet: base64 {as_text} B, binary {as_binary} B ({1 - as_binary / as_text:.0%} smaller)")
+
+    as_text = database_size(messages(args.messages, b64))
+    as_binary = database_size(messages(args.messages, bytes))
+    print(f"sqlite file, {args.messages} messages: base64 {as_text / 2**20:.2f} MiB, "
+          f"blobs {as_binary / 2**20:.2f} MiB ({1 - as_binary / as_text:.0%} smaller)")
+
+    if wire.msgpack is None:
+        print("msgpack isn't installed, skipping /get-messages")
+        return
+    flask_app = chat_app.create_app()
+    flask_app.config["JWT_COOKIE_SECURE"] = False
+    for user in ("alice", "bob"):
+        db.insert_user(user, "pw", "x", "x")
+    with db.engine.begin() as connection:
+        connection.execute(insert(Friendship), [{"user_1": "alice", "user_2": "bob"}])
+        connection.execute(insert(Message), messages(args.page, bytes))
+    client = flask_app.test_client()
+    client.post("/login/user", json={"username": "bob", "password": "pw"})
+    url = f"/get-messages/bob/alice?limit={args.page}"
+
+    print(f"/get-messages, {args.page} messages per page:")
+    for name, accept in (("json", wire.JSON_TYPE), ("msgpack", wire.MSGPACK_TYPE)):
+        size = len(client.get(url, headers={"Accept": accept}).data)
+        start = time.perf_counter()
+        durations = time_calls(lambda: client.get(url, headers={"Accept": accept}), args.requests)
+        rate = args.requests / (time.perf_counter() - start)
+        print(f"  {name:>8}: {size / 1024:8.1f} KiB, {rate:7.1f} pages/s, p50 {percentile(durations, 50) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
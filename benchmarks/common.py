@@ -0,0 +1,91 @@
+'''
+common
+helpers shared by the benchmark scripts in this folder
+
+the benchmarks import the app modules from the project root,
+so run them from anywhere with `python benchmarks/<script>.py`
+'''
+
+import sys
+import time
+import socket
+import tempfile
+import functools
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# python -c program that runs one app worker, configured by CHAT_* environment variables
+# (the werkzeug server only runs outside __main__ when told it's fine)
+WORKER = (
+    "import app, config; "
+    "app.socketio.run(app.create_app(), host=config.HOST, port=config.PORT, "
+    "**({'allow_unsafe_werkzeug': True} if config.ASYNC_MODE == 'threading' else {}))"
+)
+
+# the secret app.py signs its access tokens with
+JWT_SECRET_KEY = "your_jwt_secret_key"
+
+
+@functools.lru_cache(maxsize=None)
+def _token_app():
+    from flask import Flask
+    from flask_jwt_extended import JWTManager
+    token_app = Flask("bench")
+    token_app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+    token_app.config["JWT_TOKEN_LOCATION"] = ["cookies"]
+    JWTManager(token_app)
+    return token_app
+
+# a Cookie header holding an access token for username
+# sockets without one are refused on connect, this saves logging in through /login/user
+def auth_cookie(username: str) -> str:
+    from flask_jwt_extended import create_access_token
+    with _token_app().app_context():
+        return f"access_token_cookie={create_access_token(identity=username)}"
+
+# headers that log a plain http client (requests, curl) in as username, for POSTs to
+# @jwt_required routes: the access token cookie and the CSRF token that goes with it
+def auth_headers(username: str) -> dict:
+    from flask_jwt_extended import create_access_token, get_csrf_token
+    with _token_app().app_context():
+        token = create_access_token(identity=username)
+        return {"Cookie": f"access_token_cookie={token}", "X-CSRF-TOKEN": get_csrf_token(token)}
+
+# a fresh sqlite file in a new temporary directory
+def temp_database_url(name: str = "bench.db") -> str:
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    return f"sqlite:///{directory}/{name}"
+
+# runs fn `repeat` times and returns the per-call durations in seconds
+def time_calls(fn, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+# nearest-rank percentile, p is between 0 and 100
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def mean(values) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+# waits until a worker started with WORKER accepts connections
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} didn't start")
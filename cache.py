@@ -0,0 +1,64 @@
+'''
+cache
+a small in-process LRU cache with an optional time to live
+
+db.py uses it to keep rows that are read all the time but barely change
+(users, their public keys and salts) out of sqlite.
+Every process has its own copy, so anything that changes a cached row
+has to invalidate it, and the ttl bounds how stale another worker can get.
+'''
+
+import time
+from threading import Lock
+from collections import OrderedDict
+
+
+class LRUCache():
+    # max_size is the number of entries kept before the least recently used is evicted
+    # ttl is in seconds, None means entries only leave by eviction or invalidation
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry time, value), ordered from least to most recently used
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self.entries)
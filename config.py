@@ -0,0 +1,94 @@
+'''
+config
+deployment settings for the server
+
+each setting can be overridden with the environment variable of the same name
+prefixed with CHAT_, e.g. CHAT_MESSAGE_DURABILITY=enqueue python3 app.py
+'''
+
+import os
+
+
+def _setting(name: str, default, cast=str):
+    value = os.environ.get(f"CHAT_{name}")
+    return default if value is None else cast(value)
+
+
+# where the database lives, any sqlalchemy url works
+DATABASE_URL = _setting("DATABASE_URL", "sqlite:///database/main.db")
+# sqlite tuning profile, see engine.ENGINE_PROFILES
+DATABASE_PROFILE = _setting("DATABASE_PROFILE", "wal")
+
+# when /send-message answers the client:
+# "commit"  - once the message is committed to the database, nothing acknowledged is ever lost,
+#             every commit is fsynced (synchronous=FULL) even with the "wal" profile
+# "enqueue" - as soon as the message is queued, faster, but a crash loses whatever is still queued
+#             and, with the "wal" profile, a power cut can lose the last few commits
+MESSAGE_DURABILITY = _setting("MESSAGE_DURABILITY", "commit")
+# queued messages are written in one transaction once there are this many...
+MESSAGE_BATCH_SIZE = _setting("MESSAGE_BATCH_SIZE", 256, int)
+# ...or the oldest one has waited this many seconds
+# 0 writes whatever has queued up while the previous batch was being committed,
+# which already batches under load without delaying a lone message
+MESSAGE_BATCH_DELAY = _setting("MESSAGE_BATCH_DELAY", 0.0, float)
+# how many messages can wait to be written before /send-message starts refusing them
+MESSAGE_QUEUE_SIZE = _setting("MESSAGE_QUEUE_SIZE", 10000, int)
+# how long (seconds) a sender waits for room in a full queue before giving up
+MESSAGE_QUEUE_TIMEOUT = _setting("MESSAGE_QUEUE_TIMEOUT", 1.0, float)
+
+# where `python3 app.py` listens, give each worker its own port when running several
+HOST = _setting("HOST", "localhost")
+PORT = _setting("PORT", 1204, int)
+
+# message queue the socket.io workers use to pass emits to each other,
+# e.g. redis://localhost:6379/0 (needs the redis package, see requirements-optional.txt)
+# None keeps everything inside this one process
+SOCKETIO_MESSAGE_QUEUE = _setting("SOCKETIO_MESSAGE_QUEUE", None)
+# where room membership is kept:
+# "local"    - in this process (models.Room), fine for a single worker and for tests
+# "database" - in the database (models.SharedRoom), needed once there's more than one worker,
+#              rooms are only left with a "leave" event, not when a socket disconnects
+ROOM_REGISTRY = _setting("ROOM_REGISTRY", "local")
+
+# how the server handles concurrency:
+# "threading" - a thread per connection, simple, fine for a handful of users
+# "gevent" or "eventlet" - green threads, idle sockets are cheap so one worker can hold
+#                          thousands of them, database calls run on a pool of DB_THREADS threads
+ASYNC_MODE = _setting("ASYNC_MODE", "threading")
+DB_THREADS = _setting("DB_THREADS", 20, int)
+
+# /home is served from a per-user summary kept in memory, this many users' worth
+# 0 turns it off and every /home runs the dashboard query
+DASHBOARD_CACHE_SIZE = _setting("DASHBOARD_CACHE_SIZE", 4096, int)
+# seconds, with several workers a change made on another worker shows up after at most this long
+DASHBOARD_CACHE_TTL = _setting("DASHBOARD_CACHE_TTL", 30, float)
+
+# how new passwords are hashed, any method werkzeug's generate_password_hash takes,
+# e.g. "pbkdf2:sha256:600000" or "scrypt" (existing hashes keep working after a change)
+HASH_METHOD = _setting("HASH_METHOD", "pbkdf2:sha256:260000")
+HASH_SALT_LENGTH = _setting("HASH_SALT_LENGTH", 16, int)
+# processes hashing passwords, defaults to one per core, 0 hashes on the request thread
+HASH_WORKERS = _setting("HASH_WORKERS", None, int)
+# hashes allowed in flight at once, logins and signups past this get a 429
+HASH_QUEUE_LIMIT = _setting("HASH_QUEUE_LIMIT", 64, int)
+
+# where `python assets.py build` puts the fingerprinted, compressed static files, None is static/dist
+ASSETS_DIR = _setting("ASSETS_DIR", None)
+
+# timing histograms for routes, socket events and queries, served at /metrics
+# in the prometheus text format, off by default since /metrics is public
+METRICS = _setting("METRICS", "off") in ("on", "1", "true", "yes")
+# queries slower than this many milliseconds are logged with their sql, None logs none
+# works with or without METRICS
+SLOW_QUERY_MS = _setting("SLOW_QUERY_MS", None, float)
+
+# seconds without a heartbeat before a user shows as offline to their friends,
+# clients heartbeat every 20 seconds so this rides out a missed one or two
+PRESENCE_TIMEOUT = _setting("PRESENCE_TIMEOUT", 60, float)
+# seconds a "typing" lasts unless it's repeated, clients repeat it every few seconds while typing
+TYPING_TIMEOUT = _setting("TYPING_TIMEOUT", 6, float)
+# presence and typing changes are collected and sent out together this often (seconds)
+PRESENCE_FLUSH_INTERVAL = _setting("PRESENCE_FLUSH_INTERVAL", 1.0, float)
+# heartbeat and typing events each socket may send per second, with bursts of up to PRESENCE_EVENT_BURST
+PRESENCE_EVENT_RATE = _setting("PRESENCE_EVENT_RATE", 2.0, float)
+PRESENCE_EVENT_BURST = _setting("PRESENCE_EVENT_BURST", 5, int)
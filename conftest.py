@@ -0,0 +1,39 @@
+'''
+fixtures shared by the tests that need a database, each test gets a fresh file
+'''
+
+import pytest
+from sqlalchemy import insert
+
+import db
+from models import User, Friendship
+
+
+# db opened on an empty database file in tmp_path, with its caches emptied
+# the previous engine (if any) is put back afterwards
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "engine", None)
+    db.init(f"sqlite:///{tmp_path / 'main.db'}")
+    for cache in (db.user_cache, db.dashboard_cache, db.group_member_cache):
+        cache.clear()
+    yield db
+    db.engine.dispose()
+
+# adds users straight to the table, insert_user would hash a password for every one
+@pytest.fixture
+def add_users(database):
+    def add_users(*usernames):
+        with database.engine.begin() as connection:
+            connection.execute(insert(User), [{"username": username, "password": "x", "public_key": "key", "salt": "salt"}
+                                              for username in usernames])
+    return add_users
+
+# makes each (user, user) pair friends, in either order
+@pytest.fixture
+def befriend(database):
+    def befriend(*pairs):
+        with database.engine.begin() as connection:
+            connection.execute(insert(Friendship), [dict(zip(("user_1", "user_2"), database.friendship_key(*pair)))
+                                                    for pair in pairs])
+    return befriend
@@ -3,74 +3,257 @@ db
 database file, containing all the logic to interface with the sql database
 '''
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, literal, null, select, tuple_, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
 from models import *
-from werkzeug.security import generate_password_hash
+import migrations
+from engine import make_engine
+from cache import LRUCache
+from message_writer import MessageWriter, QueueFull
+import config
+import metrics
+import atexit
+from green import blocking
+from datetime import datetime
+import heapq
+from typing import NamedTuple, Dict, FrozenSet, List, Optional, Tuple
 
 
 from pathlib import Path
+from sqlalchemy.engine import make_url
 
-# creates the database directory
-Path("database") \
-    .mkdir(exist_ok=True)
+# set by init(), None until then
+engine = None
 
-# "database/main.db" specifies the database file
-# change it if you wish
-# turn echo = True to display the sql output
-engine = create_engine("sqlite:///database/main.db", echo=False)
+# builds the engine and brings the schema up to date, importing db doesn't touch the disk
+# app.create_app() calls this, scripts that use db without the app call it themselves
+# url defaults to config.DATABASE_URL ("database/main.db"), profile to config.DATABASE_PROFILE (see engine.py)
+# with MESSAGE_DURABILITY "commit" every commit is fsynced, a batch of messages still shares one
+# later calls return the engine that's already there
+def init(url: str = None, profile: str = None):
+    global engine
+    if engine is not None:
+        return engine
+    url = url or config.DATABASE_URL
+    # creates the database directory
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database and parsed.database != ":memory:":
+        Path(parsed.database).parent.mkdir(parents=True, exist_ok=True)
+    # turn echo = True to display the sql output
+    engine = make_engine(url, profile or config.DATABASE_PROFILE, echo=False,
+                         durable=config.MESSAGE_DURABILITY == "commit")
+    # query timings and the slow query log, a no-op unless config turns them on
+    metrics.instrument_engine(engine)
+    # costs a single pragma when the database is already current, see migrations.py
+    migrations.ensure_schema(engine, Base.metadata)
+    return engine
 
-# initializes the database
-Base.metadata.create_all(engine)
+# number of messages returned per page of history
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 500
+
+# read-only copy of a user row, unlike the ORM object it's safe to keep
+# around after the session closes, so it can live in user_cache
+class UserRecord(NamedTuple):
+    username: str
+    password: str
+    public_key: str
+    salt: str
+
+# get_user runs on every login, socket join, public key and salt lookup,
+# and user rows almost never change
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 300
+user_cache = LRUCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# anything that changes a user row (e.g. rotating their public key) must call this
+def invalidate_user(username: str):
+    user_cache.invalidate(username)
 
 # inserts a user to the database
+# raises hashing.Overloaded if too many passwords are already being hashed
 def insert_user(username: str, password: str, public_key: str, salt: str):
-    hashed_password = generate_password_hash(password)
+    # imported here so scripts that only read the database (history.py) don't load the process pool machinery
+    import hashing
+    hashed_password = hashing.hash_password(password)
+    _insert_user_row(username, hashed_password, public_key, salt)
+    invalidate_user(username)
+
+@blocking
+def _insert_user_row(username: str, hashed_password: str, public_key: str, salt: str):
     with Session(engine) as session:
         user = User(username=username, password=hashed_password, public_key=public_key, salt=salt)
         session.add(user)
         session.commit()
 
-# gets a user from the database
-def get_user(username: str):
+@blocking
+def _load_user(username: str):
     with Session(engine) as session:
-        return session.get(User, username)
+        row = session.get(User, username)
+        if row is None:
+            return None
+        return UserRecord(row.username, row.password, row.public_key, row.salt)
+
+# gets a user from the database, returns a UserRecord or None
+def get_user(username: str):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    user = _load_user(username)
+    # missing users aren't cached, they might sign up any moment
+    if user is not None:
+        user_cache.set(username, user)
+    return user
     
-def send_friend_request(sender_username: str, receiver_username: str):
+# what send_friend_requests did for each receiver
+REQUEST_SENT = "sent"
+# they had asked the sender already, so that request was accepted instead
+REQUEST_ACCEPTED = "accepted"
+# the sender's earlier request is still pending, there's only ever one
+REQUEST_PENDING = "pending"
+REQUEST_ALREADY_FRIENDS = "friends"
+# no such user, or the sender themselves
+REQUEST_INVALID = "invalid"
+
+# most request ids or usernames one bulk call takes, keeps the IN lists well under sqlite's variable limit
+MAX_FRIEND_REQUEST_BATCH = 500
+
+# friendships are stored once, with the two usernames in sorted order
+def friendship_key(user1: str, user2: str):
+    return (user1, user2) if user1 < user2 else (user2, user1)
+
+# sends friend requests from sender to each of receivers in one transaction
+# returns {receiver: REQUEST_*}
+@blocking
+def send_friend_requests(sender: str, receivers) -> Dict[str, str]:
+    receivers = set(receivers)
+    results = {receiver: REQUEST_INVALID for receiver in receivers}
+    receivers.discard(sender)
+    if not receivers:
+        return results
     with Session(engine) as session:
-        friend_request = FriendRequest(sender=sender_username, receiver=receiver_username, status='pending')
-        session.add(friend_request)
+        receivers = set(session.execute(select(User.username).where(User.username.in_(sorted(receivers)))).scalars())
+        keys = [friendship_key(sender, receiver) for receiver in receivers]
+        friends = session.execute(select(Friendship.user_1, Friendship.user_2)
+                                  .where(tuple_(Friendship.user_1, Friendship.user_2).in_(keys))).all() if keys else []
+        friends = {user_1 if user_2 == sender else user_2 for user_1, user_2 in friends}
+        # a request to someone who already asked you is a yes
+        answered = _answer_friend_requests(session, (FriendRequest.receiver == sender)
+                                           & FriendRequest.sender.in_(sorted(receivers - friends)), 'accepted')
+        accepted = {pair[0] for pair in answered}
+        new = receivers - friends - accepted
+        pending = set(session.execute(select(FriendRequest.receiver).where(
+            FriendRequest.sender == sender, FriendRequest.receiver.in_(sorted(new)), FriendRequest.status == 'pending')).scalars()) if new else set()
+        if new - pending:
+            # uq_friend_request_pending turns a request sent twice at once into a no-op
+            session.execute(sqlite_insert(FriendRequest).on_conflict_do_nothing(
+                index_elements=[FriendRequest.sender, FriendRequest.receiver], index_where=FriendRequest.status == 'pending'),
+                [{"sender": sender, "receiver": receiver, "status": 'pending'} for receiver in new - pending])
         session.commit()
+    results.update({receiver: REQUEST_ALREADY_FRIENDS for receiver in friends})
+    results.update({receiver: REQUEST_ACCEPTED for receiver in accepted})
+    results.update({receiver: REQUEST_PENDING for receiver in pending})
+    results.update({receiver: REQUEST_SENT for receiver in new - pending})
+    invalidate_dashboard(sender, *receivers)
+    return results
 
-def accept_friend_request(request_id: int):
-    with Session(engine) as session:
-        friend_request = session.get(FriendRequest, request_id)
-        if friend_request and friend_request.status == 'pending':
-            friend_request.status = 'accepted'
-            friendship = Friendship(user_1=friend_request.sender, user_2=friend_request.receiver)
-            session.add(friendship)
-            session.commit()
+# sends one friend request, returns one of the REQUEST_* results
+def send_friend_request(sender_username: str, receiver_username: str) -> str:
+    return send_friend_requests(sender_username, [receiver_username])[receiver_username]
+
+# sets status on the pending requests matching condition, inside the caller's transaction
+# accepting makes the friendships too, and accepts any request the other way round
+# returns the (sender, receiver) pairs that were answered
+def _answer_friend_requests(session, condition, status: str) -> List[Tuple[str, str]]:
+    rows = session.execute(select(FriendRequest.id, FriendRequest.sender, FriendRequest.receiver)
+                           .where(FriendRequest.status == 'pending', condition)).all()
+    if not rows:
+        return []
+    session.execute(update(FriendRequest).where(FriendRequest.id.in_([row.id for row in rows])).values(status=status))
+    pairs = [(row.sender, row.receiver) for row in rows]
+    if status == 'accepted':
+        keys = {friendship_key(*pair) for pair in pairs}
+        session.execute(sqlite_insert(Friendship).on_conflict_do_nothing(index_elements=[Friendship.user_1, Friendship.user_2]),
+                        [{"user_1": user_1, "user_2": user_2} for user_1, user_2 in keys])
+        session.execute(update(FriendRequest).where(
+            FriendRequest.status == 'pending',
+            tuple_(FriendRequest.sender, FriendRequest.receiver).in_([(receiver, sender) for sender, receiver in pairs]),
+        ).values(status='accepted'))
+    return pairs
 
-def reject_friend_request(request_id: int):
+# answers the pending requests username received, picked by id and/or by sender, in one transaction
+# returns the senders whose requests were answered, ids that aren't the user's are ignored
+def _answer_received_requests(username: str, request_ids, senders, status: str) -> List[str]:
+    request_ids, senders = list(request_ids), list(senders)
+    if not request_ids and not senders:
+        return []
     with Session(engine) as session:
-        friend_request = session.get(FriendRequest, request_id)
-        if friend_request and friend_request.status == 'pending':
-            friend_request.status = 'rejected'
-            session.commit()
+        pairs = _answer_friend_requests(session, (FriendRequest.receiver == username)
+                                        & (FriendRequest.id.in_(request_ids) | FriendRequest.sender.in_(senders)), status)
+        session.commit()
+    answered = sorted({sender for sender, _ in pairs})
+    invalidate_dashboard(username, *answered)
+    return answered
+
+@blocking
+def accept_friend_requests(username: str, request_ids=(), senders=()) -> List[str]:
+    return _answer_received_requests(username, request_ids, senders, 'accepted')
+
+@blocking
+def reject_friend_requests(username: str, request_ids=(), senders=()) -> List[str]:
+    return _answer_received_requests(username, request_ids, senders, 'rejected')
 
+# the usernames of everyone the user is friends with, as a query
+# the user can be on either side of the pair, each half is an index lookup
+def _friends_query(username: str):
+    return union_all(
+        select(Friendship.user_2.label("peer")).where(Friendship.user_1 == username),
+        select(Friendship.user_1.label("peer")).where(Friendship.user_2 == username),
+    )
+
+# returns the usernames of everyone the user is friends with
+@blocking
 def list_friends(username: str):
     with Session(engine) as session:
-        user = session.get(User, username)
-        if user:
-            friends = session.query(Friendship).filter(
-                (Friendship.user_1 == username) | (Friendship.user_2 == username)).all()
-            # Extract friend usernames from friendships
-            friend_usernames = [
-                friend.user2.username if friend.user1.username == username else friend.user1.username 
-                for friend in friends
-            ]
-            return friend_usernames
+        return session.execute(_friends_query(username)).scalars().all()
+
+# the friends username and other have in common, sorted
+# an index lookup per friend of other, whatever the number of users
+@blocking
+def mutual_friends(username: str, other: str) -> List[str]:
+    theirs = _friends_query(other).subquery()
+    query = select(theirs.c.peer).where(theirs.c.peer.in_(_friends_query(username))).order_by(theirs.c.peer)
+    with Session(engine) as session:
+        return session.execute(query).scalars().all()
 
+FRIEND_SUGGESTION_LIMIT = 10
+
+# friends of the user's friends who aren't friends with them yet and have no pending
+# request either way, most mutual friends first, as [(username, mutual friends)]
+# walks the friendship indexes out from the user's friends, so it costs about
+# friends x their friends lookups, not a scan of every friendship
+@blocking
+def friend_suggestions(username: str, limit: int = FRIEND_SUGGESTION_LIMIT) -> List[Tuple[str, int]]:
+    friends = _friends_query(username).subquery()
+    candidates = union_all(
+        select(Friendship.user_2.label("candidate")).join(friends, Friendship.user_1 == friends.c.peer),
+        select(Friendship.user_1.label("candidate")).join(friends, Friendship.user_2 == friends.c.peer),
+    ).subquery()
+    requested = union_all(
+        select(FriendRequest.receiver).where(FriendRequest.sender == username, FriendRequest.status == 'pending'),
+        select(FriendRequest.sender).where(FriendRequest.receiver == username, FriendRequest.status == 'pending'),
+    )
+    mutual = func.count().label("mutual")
+    query = select(candidates.c.candidate, mutual).where(
+        candidates.c.candidate != username,
+        candidates.c.candidate.not_in(_friends_query(username)),
+        candidates.c.candidate.not_in(requested),
+    ).group_by(candidates.c.candidate).order_by(mutual.desc(), candidates.c.candidate).limit(limit)
+    with Session(engine) as session:
+        return [(candidate, count) for candidate, count in session.execute(query)]
+
+@blocking
 def list_friend_requests(username: str):
     with Session(engine) as session:
         received_requests = session.query(FriendRequest).filter(
@@ -83,27 +266,361 @@ def list_friend_requests(username: str):
         ).all()
         return received_requests, sent_requests
 
+@blocking
 def are_friends(user1, user2):
+    user_1, user_2 = friendship_key(user1, user2)
     with Session(engine) as session:
-        exists = session.query(Friendship).filter(
-            ((Friendship.user_1 == user1) & (Friendship.user_2 == user2)) |
-            ((Friendship.user_1 == user2) & (Friendship.user_2 == user1))
-        ).first()
+        exists = session.query(Friendship.id).filter_by(user_1=user_1, user_2=user_2).first()
         return exists is not None
 
         
+@blocking
 def insert_message(sender_username, receiver_username, message, iv):
     with Session(engine) as session:
         new_message = Message(sender=sender_username, receiver=receiver_username, message=message, iv=iv)
         session.add(new_message)
         session.commit()
+    invalidate_dashboard(sender_username, receiver_username)
+
+# inserts a batch of message rows (dicts of Message columns) in one transaction
+@blocking
+def insert_messages(rows):
+    with Session(engine) as session:
+        session.execute(insert(Message), rows)
+        session.commit()
+    invalidate_dashboard(*{user for row in rows for user in (row["sender"], row["receiver"])})
+
+# /send-message goes through this queue so messages are committed in batches
+message_writer = MessageWriter(
+    insert_messages,
+    batch_size=config.MESSAGE_BATCH_SIZE,
+    batch_delay=config.MESSAGE_BATCH_DELAY,
+    queue_size=config.MESSAGE_QUEUE_SIZE,
+    queue_timeout=config.MESSAGE_QUEUE_TIMEOUT,
+    durability=config.MESSAGE_DURABILITY,
+)
+# write out whatever is still queued when the server shuts down
+atexit.register(message_writer.close)
 
+# queues a message to be stored, raises QueueFull if the server is too busy
+# returns once it's committed or once it's queued, depending on config.MESSAGE_DURABILITY
+# message and iv are the raw bytes, wire.to_bytes turns what clients send into them
+def queue_message(sender_username, receiver_username, message, iv):
+    # timestamped now so the batch delay doesn't change the message order
+    message_writer.submit({"sender": sender_username, "receiver": receiver_username,
+                           "message": message, "iv": iv, "timestamp": datetime.utcnow()})
 
-def get_messages_between_users(sender, receiver):
+
+# a cursor is the (timestamp, id) position of a message, written as "<iso timestamp>_<id>"
+def encode_cursor(message) -> str:
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+# raises ValueError if the cursor is malformed
+def decode_cursor(cursor: str):
+    timestamp, _, message_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+# one direction of a conversation, walked along ix_messages_pair_timestamp
+def _message_page(session, sender, receiver, before, after, since_id, limit, newest_first):
+    query = session.query(Message).filter(Message.sender == sender, Message.receiver == receiver)
+    position = tuple_(Message.timestamp, Message.id)
+    if before is not None:
+        query = query.filter(position < tuple_(*before))
+    if after is not None:
+        query = query.filter(position > tuple_(*after))
+    if since_id is not None:
+        query = query.filter(Message.id > since_id)
+    if newest_first:
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+    else:
+        query = query.order_by(Message.timestamp, Message.id)
+    return query.limit(limit).all()
+
+# returns at most `limit` messages between the two users, oldest first
+# before/after are decoded cursors, since_id only returns messages newer than that id
+# with no before/after/since_id the most recent page is returned
+@blocking
+def get_messages_between_users(sender, receiver, before=None, after=None, since_id=None, limit=MESSAGE_PAGE_SIZE):
+    # walking forward from a known point, otherwise walk backwards from the newest message
+    newest_first = after is None and since_id is None
     with Session(engine) as session:
-        # Retrieve messages where the current user is either the sender or the receiver
-        messages = session.query(Message).filter(
-            ((Message.sender == sender) & (Message.receiver == receiver)) |
-            ((Message.receiver == sender) & (Message.sender == receiver))
-        ).order_by(Message.timestamp).all()
+        # each direction is its own index range scan, then the two sorted pages are merged
+        pages = [
+            _message_page(session, sender, receiver, before, after, since_id, limit, newest_first),
+            _message_page(session, receiver, sender, before, after, since_id, limit, newest_first),
+        ]
+        merged = heapq.merge(*pages, key=lambda message: (message.timestamp, message.id), reverse=newest_first)
+        messages = [message for _, message in zip(range(limit), merged)]
+        if newest_first:
+            messages.reverse()
         return messages
+
+
+# rows fetched from sqlite at a time when streaming messages out
+EXPORT_CHUNK_SIZE = 1000
+
+# yields every message (as a row of Message's columns) with an id past after_id, in id order,
+# only the ones username sent or received if it's given
+# rows are fetched EXPORT_CHUNK_SIZE at a time so memory stays flat however big the table is.
+# it walks the primary key instead of the sender/receiver indexes,
+# those aren't in id order and sorting a big user's history would hold all of it at once.
+# not @blocking, it's a generator, the caller decides where it runs
+def iter_messages(username: Optional[str] = None, after_id: int = 0, chunk_size: int = EXPORT_CHUNK_SIZE):
+    query = select(Message.id, Message.sender, Message.receiver, Message.message, Message.iv, Message.timestamp) \
+        .where(Message.id > after_id).order_by(Message.id)
+    if username is not None:
+        query = query.where((Message.sender == username) | (Message.receiver == username))
+    with Session(engine) as session:
+        yield from session.execute(query.execution_options(yield_per=chunk_size))
+
+# bulk inserts message rows (dicts of Message columns) with one executemany
+# rows that keep their id skip ids that are already taken, so importing the same file twice is harmless
+@blocking
+def import_messages(rows):
+    with Session(engine) as session:
+        session.execute(sqlite_insert(Message).on_conflict_do_nothing(index_elements=[Message.id]), rows)
+        session.commit()
+    invalidate_dashboard(*{user for row in rows for user in (row["sender"], row["receiver"])})
+
+# at most this many unread messages are pushed to a client when it connects
+UNREAD_PUSH_LIMIT = 200
+
+# moves the user's read cursor for their conversation with peer up to message_id
+# cursors only ever move forward
+@blocking
+def mark_read(username: str, peer: str, message_id: int):
+    with Session(engine) as session:
+        statement = sqlite_insert(ReadCursor).values(username=username, peer=peer, last_read_id=message_id)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ReadCursor.username, ReadCursor.peer],
+            set_={"last_read_id": func.max(ReadCursor.last_read_id, statement.excluded.last_read_id)},
+        )
+        session.execute(statement)
+        session.commit()
+    invalidate_dashboard(username)
+
+# every friend's messages to the user past the user's read cursor for them,
+# one range scan on ix_messages_receiver_sender_id per friend
+def _unread_join(username: str):
+    friends = _friends_query(username).subquery()
+    cursor = func.coalesce(ReadCursor.last_read_id, 0)
+    return friends, select(friends.c.peer).select_from(friends) \
+        .outerjoin(ReadCursor, (ReadCursor.username == username) & (ReadCursor.peer == friends.c.peer)) \
+        .outerjoin(Message, (Message.receiver == username) & (Message.sender == friends.c.peer) & (Message.id > cursor))
+
+# returns {friend: number of unread messages from them} for every friend, in one query
+@blocking
+def get_unread_counts(username: str):
+    friends, query = _unread_join(username)
+    query = query.add_columns(func.count(Message.id)).group_by(friends.c.peer)
+    with Session(engine) as session:
+        return {peer: count for peer, count in session.execute(query)}
+
+# returns the unread messages from every friend, oldest first
+@blocking
+def get_unread_messages(username: str, limit: int = UNREAD_PUSH_LIMIT):
+    friends, query = _unread_join(username)
+    # drop the friends without unread messages, written with coalesce because sqlite turns
+    # "id IS NOT NULL" into an inner join and then scans every message the user ever got
+    query = query.with_only_columns(Message).where(func.coalesce(Message.id, 0) > 0).order_by(Message.id).limit(limit)
+    with Session(engine) as session:
+        return session.execute(query).scalars().all()
+
+
+# the most people a group can have, every group message carries a key envelope for each of them
+MAX_GROUP_MEMBERS = 50
+
+class GroupRecord(NamedTuple):
+    id: int
+    name: str
+    members: Tuple[str, ...]
+
+# a group's members are checked on every group message and only change when it's created
+group_member_cache = LRUCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# creates a group of the creator and members, returns its id
+@blocking
+def create_group(creator: str, name: str, members) -> int:
+    members = sorted(set(members) | {creator})
+    with Session(engine) as session:
+        conversation = Conversation(name=name, created_by=creator)
+        session.add(conversation)
+        session.flush()
+        group_id = conversation.id
+        session.execute(insert(ConversationMember), [
+            {"conversation_id": group_id, "username": member} for member in members])
+        session.commit()
+    invalidate_dashboard(*members)
+    return group_id
+
+@blocking
+def _load_group_members(group_id: int) -> FrozenSet[str]:
+    with Session(engine) as session:
+        return frozenset(session.scalars(
+            select(ConversationMember.username).where(ConversationMember.conversation_id == group_id)))
+
+# the usernames in a group, empty if there's no such group
+def get_group_members(group_id: int) -> FrozenSet[str]:
+    members = group_member_cache.get(group_id)
+    if members is None:
+        members = _load_group_members(group_id)
+        # unknown groups aren't cached, the id might be about to be handed out
+        if members:
+            group_member_cache.set(group_id, members)
+    return members
+
+# ids of the groups the user is in, one range scan on ix_conversation_member_username
+@blocking
+def get_group_ids(username: str) -> List[int]:
+    with Session(engine) as session:
+        return session.scalars(select(ConversationMember.conversation_id)
+                               .where(ConversationMember.username == username)).all()
+
+# (group id, name, member) for every member of every group the user is in
+def _groups_query(username: str):
+    mine = aliased(ConversationMember)
+    member = aliased(ConversationMember)
+    return select(Conversation.id, Conversation.name, member.username) \
+        .select_from(mine).join(Conversation, Conversation.id == mine.conversation_id) \
+        .join(member, member.conversation_id == mine.conversation_id) \
+        .where(mine.username == username).order_by(Conversation.id, member.username)
+
+def _group_records(rows) -> List[GroupRecord]:
+    names: Dict[int, str] = {}
+    members: Dict[int, List[str]] = {}
+    for group_id, name, member in rows:
+        names[group_id] = name
+        members.setdefault(group_id, []).append(member)
+    return [GroupRecord(group_id, name, tuple(members[group_id])) for group_id, name in names.items()]
+
+# the groups the user is in, with their members
+@blocking
+def list_groups(username: str) -> List[GroupRecord]:
+    with Session(engine) as session:
+        return _group_records(session.execute(_groups_query(username)))
+
+# stores a group message once and the key envelope of each member, in one transaction
+# keys is {username: envelope}, returns the message's (id, timestamp)
+@blocking
+def insert_group_message(group_id: int, sender: str, body: bytes, iv: bytes, keys: Dict[str, bytes]):
+    with Session(engine) as session:
+        message = GroupMessage(conversation_id=group_id, sender=sender, body=body, iv=iv, timestamp=datetime.utcnow())
+        session.add(message)
+        session.flush()
+        session.execute(insert(MessageKey), [
+            {"message_id": message.id, "username": username, "envelope": envelope}
+            for username, envelope in keys.items()])
+        session.commit()
+        return message.id, message.timestamp
+
+# at most `limit` of a group's messages as rows of (id, sender, body, iv, envelope, timestamp), oldest first
+# envelope is the message key for username, messages sent before they joined have none and are skipped
+# walks ix_group_message_conversation_id backwards from before_id (or the newest message),
+# or forwards from after_id, and looks each key up by primary key
+@blocking
+def get_group_messages(group_id: int, username: str, before_id: int = None, after_id: int = None,
+                       limit: int = MESSAGE_PAGE_SIZE):
+    query = select(GroupMessage.id, GroupMessage.sender, GroupMessage.body, GroupMessage.iv,
+                   MessageKey.envelope, GroupMessage.timestamp) \
+        .join(MessageKey, (MessageKey.message_id == GroupMessage.id) & (MessageKey.username == username)) \
+        .where(GroupMessage.conversation_id == group_id)
+    if before_id is not None:
+        query = query.where(GroupMessage.id < before_id)
+    if after_id is not None:
+        query = query.where(GroupMessage.id > after_id)
+    newest_first = after_id is None
+    query = query.order_by(GroupMessage.id.desc() if newest_first else GroupMessage.id).limit(limit)
+    with Session(engine) as session:
+        rows = session.execute(query).all()
+    if newest_first:
+        rows.reverse()
+    return rows
+
+
+# a pending friend request, detached from the session
+class FriendRequestRecord(NamedTuple):
+    id: int
+    sender: str
+    receiver: str
+
+class FriendSummary(NamedTuple):
+    username: str
+    unread: int
+    # only filled in when the dashboard is loaded with previews
+    last_message_id: Optional[int] = None
+    last_message_at: Optional[datetime] = None
+
+# everything the /home page shows
+class Dashboard(NamedTuple):
+    friends: List[FriendSummary]
+    received_requests: List[FriendRequestRecord]
+    sent_requests: List[FriendRequestRecord]
+    groups: List[GroupRecord]
+
+# per-user copy of get_dashboard's result, every write that changes what a user's
+# dashboard shows invalidates it (config.DASHBOARD_CACHE_SIZE = 0 turns it off)
+# the ttl bounds how stale it gets when another worker made the change
+dashboard_cache = LRUCache(max_size=config.DASHBOARD_CACHE_SIZE, ttl=config.DASHBOARD_CACHE_TTL)
+
+def invalidate_dashboard(*usernames: str):
+    for username in usernames:
+        dashboard_cache.invalidate((username, False))
+        dashboard_cache.invalidate((username, True))
+
+# the id of the newest message between the user and friend, either direction
+# each half is a max() on ix_messages_receiver_sender_id, so a single index seek
+def _last_message_id(username: str, friend):
+    received = aliased(Message)
+    sent = aliased(Message)
+    return func.max(
+        func.coalesce(select(func.max(received.id)).where(received.receiver == username, received.sender == friend).scalar_subquery(), 0),
+        func.coalesce(select(func.max(sent.id)).where(sent.receiver == friend, sent.sender == username).scalar_subquery(), 0),
+    )
+
+# friends (with unread counts and optionally the last message), and pending
+# received and sent friend requests, all in one query (groups are a second one, see _load_dashboard)
+def _dashboard_query(username: str, previews: bool):
+    friends, query = _unread_join(username)
+    last_id = _last_message_id(username, friends.c.peer) if previews else null()
+    per_friend = query.with_only_columns(
+        friends.c.peer, func.count(Message.id).label("unread"), last_id.label("last_id"),
+    ).group_by(friends.c.peer).subquery()
+    # the last message's timestamp, by primary key
+    last = aliased(Message)
+    friend_rows = select(
+        literal("friend").label("kind"), per_friend.c.peer.label("name"), null().label("request_id"),
+        per_friend.c.unread, per_friend.c.last_id, last.timestamp.label("last_at"),
+    ).select_from(per_friend).outerjoin(last, last.id == per_friend.c.last_id)
+    received_rows = select(
+        literal("received"), FriendRequest.sender, FriendRequest.id, null(), null(), null(),
+    ).where(FriendRequest.receiver == username, FriendRequest.status == 'pending')
+    sent_rows = select(
+        literal("sent"), FriendRequest.receiver, FriendRequest.id, null(), null(), null(),
+    ).where(FriendRequest.sender == username, FriendRequest.status == 'pending')
+    return union_all(friend_rows, received_rows, sent_rows)
+
+@blocking
+def _load_dashboard(username: str, previews: bool) -> Dashboard:
+    dashboard = Dashboard([], [], [], [])
+    with Session(engine) as session:
+        for kind, name, request_id, unread, last_id, last_at in session.execute(_dashboard_query(username, previews)):
+            if kind == "friend":
+                if previews and last_id:
+                    dashboard.friends.append(FriendSummary(name, unread, last_id, last_at))
+                else:
+                    dashboard.friends.append(FriendSummary(name, unread))
+            elif kind == "received":
+                dashboard.received_requests.append(FriendRequestRecord(request_id, name, username))
+            else:
+                dashboard.sent_requests.append(FriendRequestRecord(request_id, username, name))
+        dashboard.groups.extend(_group_records(session.execute(_groups_query(username))))
+    return dashboard
+
+# returns the user's Dashboard, from dashboard_cache when it's there
+def get_dashboard(username: str, previews: bool = False) -> Dashboard:
+    key = (username, previews)
+    dashboard = dashboard_cache.get(key)
+    if dashboard is None:
+        dashboard = _load_dashboard(username, previews)
+        dashboard_cache.set(key, dashboard)
+    return dashboard
@@ -0,0 +1,78 @@
+'''
+engine
+builds the sqlalchemy engine db.py uses, tuned by one of the profiles below
+
+pick a profile with config.DATABASE_PROFILE (CHAT_DATABASE_PROFILE=...)
+'''
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+
+
+# the pragmas are run on every new sqlite connection
+ENGINE_PROFILES = {
+    # sqlite's own defaults, rollback journal so readers block the writer
+    "default": {
+        "pragmas": {},
+    },
+    # write-ahead log, readers and the writer no longer block each other
+    "wal": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            # with WAL only a checkpoint needs a full fsync, a power cut can lose
+            # the last few commits but never corrupts the database
+            # (make_engine(durable=True) turns this back to FULL)
+            "synchronous": "NORMAL",
+            # wait up to 5 seconds for a lock instead of failing with "database is locked"
+            "busy_timeout": 5000,
+            # negative means KiB, so 64 MiB of page cache per connection
+            "cache_size": -64000,
+            # read the first 256 MiB of the file through mmap instead of read() calls
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+        # sqlite connections are cheap, but every thread/greenlet serving a request
+        # holds one while it talks to the database
+        "pool_size": 20,
+        "max_overflow": 40,
+    },
+}
+
+
+# sqlite:// and sqlite:///:memory: live in the connection, not in a file
+def is_memory(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+# durable fsyncs every commit whatever the profile says, so a commit survives a power cut,
+# db.init() asks for it when config.MESSAGE_DURABILITY is "commit"
+def make_engine(url: str, profile: str = "default", echo: bool = False, durable: bool = False):
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}, pick one of {list(ENGINE_PROFILES)}")
+    settings = ENGINE_PROFILES[profile]
+
+    options = {}
+    if is_memory(url):
+        # every connection to sqlite:// would be a new empty database, so all threads
+        # (the message writer's included) share the one connection, fine for tests and trying things out
+        options["poolclass"] = StaticPool
+        options["connect_args"] = {"check_same_thread": False}
+    elif "pool_size" in settings:
+        options["pool_size"] = settings["pool_size"]
+        options["max_overflow"] = settings["max_overflow"]
+    engine = create_engine(url, echo=echo, **options)
+
+    pragmas = dict(settings["pragmas"])
+    if durable:
+        pragmas["synchronous"] = "FULL"
+    if pragmas and engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                # pragmas can't take bound parameters
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+
+    return engine
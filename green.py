@@ -0,0 +1,75 @@
+'''
+green
+runs the server on green threads (gevent or eventlet) when config.ASYNC_MODE asks for it
+
+With green threads thousands of idle sockets only cost a greenlet each, but
+anything that blocks without yielding (sqlite calls, password hashing) stalls
+every socket on the worker. So db.py marks its database calls with @blocking,
+and in a green mode those run on a pool of real OS threads instead.
+In "threading" mode @blocking does nothing.
+
+patch() has to run before anything else imports socket/threading, which is
+why it's the first thing app.py does.
+'''
+
+import functools
+
+import config
+
+GREEN_MODES = ("gevent", "eventlet")
+ASYNC_MODES = ("threading",) + GREEN_MODES
+
+_patched = False
+# returns the id of the OS thread we're on, even after monkey patching
+_get_native_ident = None
+# id of the OS thread running the event loop
+_hub_thread = None
+# runs fn(*args, **kwargs) on the OS thread pool and waits (cooperatively) for the result
+_offload = None
+
+
+def is_green() -> bool:
+    return config.ASYNC_MODE in GREEN_MODES
+
+# monkey patches the standard library for the configured async mode
+def patch():
+    global _patched, _get_native_ident, _hub_thread, _offload
+    if config.ASYNC_MODE not in ASYNC_MODES:
+        raise ValueError(f"Unknown async mode {config.ASYNC_MODE!r}, pick one of {ASYNC_MODES}")
+    if _patched or not is_green():
+        return
+    _patched = True
+
+    if config.ASYNC_MODE == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+        import gevent
+        hub = gevent.get_hub()
+        hub.threadpool.maxsize = config.DB_THREADS
+        _get_native_ident = monkey.get_original("threading", "get_ident")
+        _offload = lambda fn, *args, **kwargs: hub.threadpool.apply(fn, args, kwargs)
+    else:
+        import os
+        # has to be set before tpool starts its threads
+        os.environ.setdefault("EVENTLET_THREADPOOL_SIZE", str(config.DB_THREADS))
+        import eventlet
+        eventlet.monkey_patch()
+        from eventlet import patcher, tpool
+        _get_native_ident = patcher.original("threading").get_ident
+        _offload = tpool.execute
+
+    _hub_thread = _get_native_ident()
+
+# runs a blocking call off the event loop in a green mode, or just calls it otherwise
+def run_blocking(fn, *args, **kwargs):
+    # already on a pool thread (e.g. one db function calling another), nothing to gain
+    if _offload is None or _get_native_ident() != _hub_thread:
+        return fn(*args, **kwargs)
+    return _offload(fn, *args, **kwargs)
+
+# decorator for functions that block on I/O or the CPU
+def blocking(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return run_blocking(fn, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,75 @@
+'''
+hashing
+password hashing and checking on a pool of worker processes
+
+Password hashes are slow on purpose, and during a login storm hashing them on
+the request thread starves everything else on the worker (in a green async
+mode it stalls every socket). So hashes run on a process pool sized to the
+cores, and at most config.HASH_QUEUE_LIMIT can be waiting at once. Past that
+hash_password/check_password raise Overloaded and the route answers 429.
+
+The pool's processes come from a forkserver (spawned where there's none): by
+the time the first password is hashed this process runs socket.io, the
+message writer and presence threads, and a plain fork() could copy a lock one
+of them holds and deadlock. Under eventlet hashes run on its OS thread pool
+instead (hashlib releases the GIL while hashing, so that still uses every core).
+Like anything using a spawned pool, workers import the main module, so scripts
+that hash passwords need an `if __name__ == "__main__":` guard.
+'''
+
+import os
+import atexit
+import multiprocessing
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import config
+import green
+
+
+# raised when too many hashes are already queued, the caller should shed the request
+class Overloaded(Exception):
+    pass
+
+
+HASH_WORKERS = config.HASH_WORKERS if config.HASH_WORKERS is not None else os.cpu_count()
+
+# a forkserver is a clean single threaded process to fork from, it starts with werkzeug
+# already imported so each worker doesn't have to import it again
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_slots = BoundedSemaphore(config.HASH_QUEUE_LIMIT)
+_executor = None
+_executor_lock = Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                context = multiprocessing.get_context(START_METHOD)
+                if START_METHOD == "forkserver":
+                    context.set_forkserver_preload(["werkzeug.security"])
+                _executor = ProcessPoolExecutor(HASH_WORKERS, mp_context=context)
+                atexit.register(_executor.shutdown)
+    return _executor
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise Overloaded("too many passwords waiting to be hashed")
+    try:
+        if HASH_WORKERS == 0:
+            # no pool, hash on the calling thread
+            return fn(*args)
+        if config.ASYNC_MODE == "eventlet":
+            return green.run_blocking(fn, *args)
+        return _get_executor().submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password: str) -> str:
+    return _run(generate_password_hash, password, config.HASH_METHOD, config.HASH_SALT_LENGTH)
+
+def check_password(password_hash: str, password: str) -> bool:
+    return _run(check_password_hash, password_hash, password)
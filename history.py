@@ -0,0 +1,159 @@
+'''
+history
+streams message history out to NDJSON and back in
+
+one JSON object per line, in id order:
+    {"id": 1, "sender": "a", "receiver": "b", "message": "<base64>", "iv": "<base64>", "timestamp": "<iso>"}
+
+    python history.py export backup.ndjson [--user alice] [--resume]
+    python history.py import backup.ndjson [--new-ids]
+
+Exports stream from sqlite (see db.iter_messages) and imports go in batches,
+so neither ever holds more than a chunk in memory. An export that stopped
+halfway continues with --resume from the last id in the file. An import that
+stopped halfway can just be run again, rows whose id is already in the
+database are skipped (--new-ids appends them under fresh ids instead, for
+merging into a database that has its own messages).
+The same export is served to users for their own messages at /export-messages.
+'''
+
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+from typing import Iterable, Optional
+
+import db
+import wire
+
+# rows per executemany on import
+IMPORT_BATCH_SIZE = 5000
+
+
+def to_line(row) -> str:
+    return json.dumps({
+        "id": row.id,
+        "sender": row.sender,
+        "receiver": row.receiver,
+        "message": wire.to_base64(row.message),
+        "iv": wire.to_base64(row.iv),
+        "timestamp": row.timestamp.isoformat() if row.timestamp is not None else None,
+    }) + "\n"
+
+# raises ValueError (or wire.InvalidPayload) on a malformed line
+def from_line(line: str, keep_id: bool = True) -> dict:
+    item = json.loads(line)
+    row = {
+        "sender": item["sender"],
+        "receiver": item["receiver"],
+        "message": wire.to_bytes(item["message"]),
+        "iv": wire.to_bytes(item.get("iv")),
+        "timestamp": datetime.fromisoformat(item["timestamp"]) if item.get("timestamp") else None,
+    }
+    if keep_id:
+        row["id"] = int(item["id"])
+    return row
+
+# NDJSON lines for the messages past after_id, only username's if it's given
+def export_lines(username: Optional[str] = None, after_id: int = 0) -> Iterable[str]:
+    for row in db.iter_messages(username, after_id):
+        yield to_line(row)
+
+# id of the last message in an export file, 0 if there's nothing in it yet
+# only reads the end of the file, and ignores a last line that was cut off mid-write
+def last_exported_id(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+        size = min(end, 64 * 1024)
+        file.seek(end - size)
+        lines = file.read(size).split(b"\n")
+    for line in reversed(lines):
+        try:
+            return int(json.loads(line)["id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0
+
+# appends the messages to path, returns how many were written
+def export_to(path: str, username: Optional[str] = None, resume: bool = False) -> int:
+    after_id = last_exported_id(path) if resume else 0
+    if resume and os.path.exists(path):
+        _drop_partial_line(path)
+    count = 0
+    with open(path, "a" if resume else "w", encoding="utf-8") as file:
+        for line in export_lines(username, after_id):
+            file.write(line)
+            count += 1
+    return count
+
+# an export killed mid-write can leave half a line at the end
+def _drop_partial_line(path: str):
+    with open(path, "rb+") as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+        if end == 0:
+            return
+        position = end
+        while position > 0:
+            step = min(position, 64 * 1024)
+            position -= step
+            file.seek(position)
+            chunk = file.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                file.truncate(position + newline + 1)
+                return
+        file.truncate(0)
+
+# loads an export back in, returns how many rows were sent to the database
+def import_from(path: str, keep_ids: bool = True, batch_size: int = IMPORT_BATCH_SIZE) -> int:
+    count = 0
+    batch = []
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(from_line(line, keep_ids))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{number}: {e}")
+            if len(batch) == batch_size:
+                db.import_messages(batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        db.import_messages(batch)
+        count += len(batch)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export or import message history as NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--user", default=None, help="only the messages this user sent or received")
+    export_parser.add_argument("--resume", action="store_true", help="continue after the last message in path")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--new-ids", action="store_true", help="give the messages fresh ids")
+    args = parser.parse_args(argv)
+
+    db.init()
+    if args.command == "export":
+        count = export_to(args.path, args.user, args.resume)
+        print(f"exported {count} messages to {args.path}")
+    else:
+        try:
+            count = import_from(args.path, keep_ids=not args.new_ids)
+        except ValueError as e:
+            sys.exit(f"import failed: {e}")
+        print(f"read {count} messages from {args.path}" + ("" if args.new_ids else ", ids already in the database were skipped"))
+
+
+if __name__ == "__main__":
+    main()
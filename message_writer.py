@@ -0,0 +1,155 @@
+'''
+message_writer
+write-behind queue for chat messages
+
+committing every message on its own means one fsync per message, which caps
+how many messages sqlite can take per second. MessageWriter queues messages
+and a background thread writes them in batches, one transaction per batch.
+
+In "commit" durability mode submit() blocks until the batch holding the message
+has been committed, so concurrent senders share one commit.
+In "enqueue" mode submit() returns straight away.
+'''
+
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ("commit", "enqueue")
+
+
+# raised by submit() when the queue stays full, the caller should shed the request
+class QueueFull(Exception):
+    pass
+
+# raised by submit() in commit mode when the batch couldn't be written
+class WriteFailed(Exception):
+    pass
+
+# a queued message, plus a way to tell the sender once it's been written
+class _Pending():
+    def __init__(self, row: dict, wait: bool):
+        self.row = row
+        self.done = threading.Event() if wait else None
+        self.error = None
+
+# put on the queue by close() to tell the writer thread to stop
+_STOP = object()
+
+
+class MessageWriter():
+    # write_batch is called with a list of row dicts and must write them in one transaction
+    def __init__(self, write_batch, batch_size: int = 256, batch_delay: float = 0.0,
+                 queue_size: int = 10000, queue_timeout: float = 1.0, durability: str = "commit"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, not {durability!r}")
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue_timeout = queue_timeout
+        self.durability = durability
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.closed = False
+
+    # the writer thread starts with the first message
+    def _ensure_started(self):
+        if self.thread is not None:
+            return
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self.thread.start()
+
+    # queues a row, raises QueueFull if there's no room after queue_timeout seconds
+    # in commit mode also waits for the write and raises WriteFailed if it failed
+    def submit(self, row: dict):
+        if self.closed:
+            raise QueueFull("message writer is shut down")
+        self._ensure_started()
+        pending = _Pending(row, wait=self.durability == "commit")
+        try:
+            self.queue.put(pending, timeout=self.queue_timeout)
+        except queue.Full:
+            raise QueueFull("message queue is full")
+        if pending.done is not None:
+            pending.done.wait()
+            if pending.error is not None:
+                raise WriteFailed(str(pending.error)) from pending.error
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            # keep collecting until the batch is full or the first message has waited long enough
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # drain anything queued after close() was called
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            self.write_batch([pending.row for pending in batch])
+            errors = [None] * len(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Failed to write a queued message: {e}", exc_info=True)
+                errors = [e]
+            else:
+                # one bad row fails the whole transaction, so write them one at a time
+                # and only the sender of the bad row gets the error
+                logger.warning(f"Failed to write {len(batch)} queued messages, retrying one at a time: {e}")
+                errors = [self._write_one(pending.row) for pending in batch]
+        for pending, error in zip(batch, errors):
+            if pending.done is not None:
+                pending.error = error
+                pending.done.set()
+
+    # writes a single row, returns the exception if it failed
+    def _write_one(self, row: dict):
+        try:
+            self.write_batch([row])
+        except Exception as e:
+            logger.error(f"Failed to write a queued message: {e}", exc_info=True)
+            return e
+        return None
+
+    # stops taking messages and waits for everything queued to be written
+    def close(self, timeout: float = None):
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
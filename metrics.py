@@ -0,0 +1,170 @@
+'''
+metrics
+timing histograms and gauges for the hot paths, served at /metrics
+
+With config.METRICS on, every Flask route, every socket.io event handler
+marked @metrics.timed and every query on db.engine is timed into a
+histogram, and a few gauges (connected sockets, rooms) are read when
+/metrics is scraped. The output is the Prometheus text format, so
+Prometheus can scrape it directly or you can just curl it.
+
+With it off nothing is hooked in at all: @timed hands the handler back
+untouched and no request or engine events are registered, so it costs nothing.
+config.SLOW_QUERY_MS logs slow queries either way.
+'''
+
+import time
+import logging
+import functools
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+from sqlalchemy import event
+
+import config
+
+ENABLED = config.METRICS
+
+# upper bounds in seconds, prometheus' defaults with a finer low end for sqlite
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger("chat.slow_query")
+
+
+class Histogram():
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> [count per bucket..., +Inf count, sum]
+        self.series: Dict[tuple, list] = {}
+        self.lock = Lock()
+
+    def observe(self, seconds: float, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(BUCKETS)] += 1
+            series[-1] += seconds
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = {key: list(value) for key, value in self.series.items()}
+        for label_values, counts in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {counts[-1]}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+
+class Gauge():
+    # read is called on every scrape, so the value is always current and costs nothing in between
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            yield f"{self.name} {self.read()}"
+        except Exception:
+            # a broken gauge shouldn't take the whole scrape down with it
+            pass
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+http_requests = Histogram("chat_http_request_duration_seconds", "Time spent handling HTTP requests",
+                          ("route", "method", "status"))
+socket_events = Histogram("chat_socketio_event_duration_seconds", "Time spent handling socket.io events",
+                          ("event",))
+db_queries = Histogram("chat_db_query_duration_seconds", "Time spent running database queries",
+                       ("statement",))
+gauges: Dict[str, Gauge] = {}
+
+
+def gauge(name: str, help: str, read: Callable[[], float]):
+    if ENABLED:
+        gauges[name] = Gauge(name, help, read)
+
+# the whole registry in the prometheus text format
+def render() -> str:
+    lines = []
+    for metric in (http_requests, socket_events, db_queries, *gauges.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# decorator for socket.io handlers, goes under @socketio.on
+def timed(event_name: str):
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                socket_events.observe(time.perf_counter() - start, event_name)
+        return wrapper
+    return decorator
+
+# times every request and adds the /metrics route
+def instrument_app(app):
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def stop_timer(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            # the url rule, not the path, so /get-messages/<username>/<receiver> is one series
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            http_requests.observe(time.perf_counter() - start, route, request.method, response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# times every query the engine runs and logs the slow ones
+def instrument_engine(engine):
+    if not ENABLED and config.SLOW_QUERY_MS is None:
+        return
+    slow = None if config.SLOW_QUERY_MS is None else config.SLOW_QUERY_MS / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(connection, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        if ENABLED:
+            # SELECT, INSERT, UPDATE... keeps the label set small
+            db_queries.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+        if slow is not None and elapsed >= slow:
+            # parameters are left out, they're message ciphertexts and password hashes
+            slow_query_log.warning("slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split()))
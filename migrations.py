@@ -0,0 +1,180 @@
+'''
+migrations
+upgrades existing database files to the current schema
+
+Base.metadata.create_all only creates tables that don't exist yet, it never
+adds columns or indexes to a table that is already there. So every change to
+an existing table goes in here as a numbered migration instead.
+
+The number of the last migration that ran is kept in sqlite's user_version
+pragma, so each migration only ever runs once per database file.
+To add one, write a function that takes a connection and append it to MIGRATIONS.
+Migrations should be safe to run twice (IF NOT EXISTS etc.), sqlite commits
+some DDL straight away so a failed upgrade can be partially applied.
+
+A database already at LATEST_VERSION isn't checked any further, so a new
+table needs a migration too, create_all only runs when the version is behind.
+'''
+
+import base64
+import binascii
+from sqlalchemy import inspect, text
+
+
+# 1: older database files were created before messages had an iv column
+def add_message_iv(connection):
+    columns = [column["name"] for column in inspect(connection).get_columns("messages")]
+    if "iv" not in columns:
+        connection.execute(text("ALTER TABLE messages ADD COLUMN iv VARCHAR"))
+
+# 2: indexes for the columns db.py filters on
+def add_lookup_indexes(connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_pair_timestamp ON messages (sender, receiver, timestamp, id)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_friendship_user_1 ON friendship (user_1, user_2)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_friendship_user_2 ON friendship (user_2, user_1)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_friend_request_receiver_status ON friend_request (receiver, status)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_friend_request_sender_status ON friend_request (sender, status)"))
+
+# 3: store each friendship once as (smaller username, larger username)
+# swaps the reversed rows, keeps the oldest copy of each pair, then makes the pair unique
+def canonicalize_friendships(connection):
+    connection.execute(text(
+        "UPDATE friendship SET user_1 = user_2, user_2 = user_1 WHERE user_1 > user_2"))
+    connection.execute(text(
+        "DELETE FROM friendship WHERE id NOT IN (SELECT MIN(id) FROM friendship GROUP BY user_1, user_2)"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_friendship_user_1"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_friendship_pair ON friendship (user_1, user_2)"))
+
+# 4: chat rooms remember which conversation they belong to, so both users share one room
+def add_chat_room_pair(connection):
+    columns = [column["name"] for column in inspect(connection).get_columns("chat_room")]
+    for column in ("user_1", "user_2"):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE chat_room ADD COLUMN {column} VARCHAR REFERENCES user (username)"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_room_pair ON chat_room (user_1, user_2)"))
+
+# 5: unread messages are looked up by receiver
+def add_message_receiver_index(connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_receiver_sender_id ON messages (receiver, sender, id)"))
+
+# 6: messages and ivs were stored as base64 text, now they're the raw bytes
+# sqlite doesn't care about declared column types, so older files keep their
+# TEXT columns and only the values are rewritten (typeof() skips rows already done).
+# values that aren't base64 are kept as their utf-8 bytes
+def store_message_bytes(connection):
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            "SELECT id, message, iv FROM messages WHERE id > :last_id "
+            "AND (typeof(message) = 'text' OR typeof(iv) = 'text') ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            return
+        connection.execute(text("UPDATE messages SET message = :message, iv = :iv WHERE id = :id"), [
+            {"id": id, "message": _text_to_bytes(message), "iv": _text_to_bytes(iv)} for id, message, iv in rows])
+        last_id = rows[-1].id
+
+MIGRATION_BATCH_SIZE = 1000
+
+def _text_to_bytes(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value.encode()
+
+# 7: group conversations, a message stored once plus one key envelope per member
+def add_group_conversations(connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS conversation (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR, "
+        "created_by VARCHAR REFERENCES user (username), created_at DATETIME)"))
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS conversation_member ("
+        "conversation_id INTEGER NOT NULL REFERENCES conversation (id), "
+        "username VARCHAR NOT NULL REFERENCES user (username), PRIMARY KEY (conversation_id, username))"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_conversation_member_username ON conversation_member (username, conversation_id)"))
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS group_message (id INTEGER NOT NULL PRIMARY KEY, "
+        "conversation_id INTEGER REFERENCES conversation (id), sender VARCHAR REFERENCES user (username), "
+        "body BLOB, iv BLOB, timestamp DATETIME)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_group_message_conversation_id ON group_message (conversation_id, id)"))
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS message_key ("
+        "message_id INTEGER NOT NULL REFERENCES group_message (id), "
+        "username VARCHAR NOT NULL REFERENCES user (username), envelope BLOB, PRIMARY KEY (message_id, username))"))
+
+# 8: at most one pending request per sender and receiver
+# keeps the oldest of each duplicate (the one the receiver sees first) and drops the rest,
+# requests between users who are friends already count as accepted
+def unique_pending_friend_requests(connection):
+    connection.execute(text(
+        "UPDATE friend_request SET status = 'accepted' WHERE status = 'pending' AND EXISTS "
+        "(SELECT 1 FROM friendship WHERE user_1 = min(sender, receiver) AND user_2 = max(sender, receiver))"))
+    connection.execute(text(
+        "DELETE FROM friend_request WHERE status = 'pending' AND id NOT IN "
+        "(SELECT MIN(id) FROM friend_request WHERE status = 'pending' GROUP BY sender, receiver)"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_friend_request_pending ON friend_request (sender, receiver) "
+        "WHERE status = 'pending'"))
+
+
+MIGRATIONS = [
+    add_message_iv,
+    add_lookup_indexes,
+    canonicalize_friendships,
+    add_chat_room_pair,
+    add_message_receiver_index,
+    store_message_bytes,
+    add_group_conversations,
+    unique_pending_friend_requests,
+]
+
+# the version a database is at once every migration has run
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+def set_version(connection, version: int):
+    # pragmas can't take bound parameters
+    connection.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+# makes sure the database matches the models as cheaply as possible:
+# a database at LATEST_VERSION costs one pragma, create_all (a PRAGMA table_info per table)
+# and the migrations only run for a new or outdated file
+def ensure_schema(engine, metadata):
+    with engine.connect() as connection:
+        if get_version(connection) == LATEST_VERSION:
+            return
+    fresh = not inspect(engine).get_table_names()
+    # create_all skips tables that already exist, so older database files
+    # are brought up to date by the migrations instead
+    metadata.create_all(engine)
+    upgrade(engine, fresh=fresh)
+
+# brings the database up to LATEST_VERSION
+# fresh should be True when create_all just made the tables from scratch,
+# they already match the models so there's nothing to migrate
+def upgrade(engine, fresh: bool = False):
+    with engine.begin() as connection:
+        version = get_version(connection)
+        if fresh:
+            set_version(connection, LATEST_VERSION)
+            return
+
+    for number in range(version + 1, LATEST_VERSION + 1):
+        with engine.begin() as connection:
+            MIGRATIONS[number - 1](connection)
+            set_version(connection, number)
@@ -10,10 +10,12 @@ Prisma docs also looks so much better in comparison
 or use SQLite, if you're not into fancy ORMs (but be mindful of Injection attacks :) )
 '''
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Text, DateTime
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
-from typing import Dict
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Text, LargeBinary, DateTime, Index, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship, Session
+from typing import Dict, Set, FrozenSet
 from datetime import datetime
+from green import blocking
 
 # data models
 Base = declarative_base()
@@ -38,15 +40,81 @@ class Message(Base):
     id = Column(Integer, primary_key=True)
     sender = Column(String, ForeignKey('user.username'))
     receiver = Column(String, ForeignKey('user.username'))
-    message = Column(Text)  # This will store the encrypted message text
-    iv = Column(String)  # Store the IV used in encryption
+    # raw bytes, not base64, see wire.py
+    message = Column(LargeBinary)  # This will store the encrypted message
+    iv = Column(LargeBinary)  # Store the IV used in encryption
     timestamp = Column(DateTime, default=datetime.utcnow)  # Automatically sets the timestamp
 
     # Define relationships to the User model for easier access to user objects
     sender_user = relationship("User", foreign_keys=[sender])
     receiver_user = relationship("User", foreign_keys=[receiver])
 
+    # history is always read per (sender, receiver) pair in (timestamp, id) order,
+    # so this index lets the cursor queries in db.py walk it without a sort
+    # unread messages are found per (receiver, sender) past the receiver's read cursor
+    __table_args__ = (
+        Index("ix_messages_pair_timestamp", "sender", "receiver", "timestamp", "id"),
+        Index("ix_messages_receiver_sender_id", "receiver", "sender", "id"),
+    )
+
+# how far a user has read their conversation with a peer,
+# every message from the peer with a bigger id is unread
+class ReadCursor(Base):
+    __tablename__ = "read_cursor"
+
+    username = Column(String, ForeignKey('user.username'), primary_key=True)
+    peer = Column(String, ForeignKey('user.username'), primary_key=True)
+    last_read_id = Column(Integer, nullable=False, default=0)
+
+# a group conversation, for more than two people
+class Conversation(Base):
+    __tablename__ = "conversation"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    created_by = Column(String, ForeignKey('user.username'))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ConversationMember(Base):
+    __tablename__ = "conversation_member"
+
+    conversation_id = Column(Integer, ForeignKey('conversation.id'), primary_key=True)
+    username = Column(String, ForeignKey('user.username'), primary_key=True)
+
+    # a user's groups, the primary key covers a group's members
+    __table_args__ = (
+        Index("ix_conversation_member_username", "username", "conversation_id"),
+    )
+
+# a message to a group, stored once however many members there are
+# body is encrypted with a key of its own (AES-GCM with iv), and that key is
+# encrypted for each member with their public key, one MessageKey row each
+class GroupMessage(Base):
+    __tablename__ = "group_message"
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversation.id'))
+    sender = Column(String, ForeignKey('user.username'))
+    body = Column(LargeBinary)
+    iv = Column(LargeBinary)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    # history is read per conversation in id order
+    __table_args__ = (
+        Index("ix_group_message_conversation_id", "conversation_id", "id"),
+    )
+
+# one member's copy of a group message's key (a few hundred bytes, whatever the message size)
+# members who joined after a message was sent have no row for it, so they can't read it
+class MessageKey(Base):
+    __tablename__ = "message_key"
+
+    message_id = Column(Integer, ForeignKey('group_message.id'), primary_key=True)
+    username = Column(String, ForeignKey('user.username'), primary_key=True)
+    envelope = Column(LargeBinary)
+
 # stateful counter used to generate the room id
+# ids are never reused, a client may still have an old one in a cookie
 class Counter():
     def __init__(self):
         self.counter = 0
@@ -55,34 +123,189 @@ class Counter():
         self.counter += 1
         return self.counter
 
-# Room class, used to keep track of which username is in which room
+# Room class, used to keep track of which usernames are in which rooms
+# every conversation (pair of users) gets one room, and a user can be
+# in several conversations at once. All operations are O(1), and a room
+# is forgotten as soon as its last member leaves.
 class Room():
     def __init__(self):
         self.counter = Counter()
-        # dictionary that maps the username to the room id
-        # for example self.dict["John"] -> gives you the room id of 
-        # the room where John is in
-        self.dict: Dict[str, int] = {}
-
-    def create_room(self, sender: str, receiver: str) -> int:
-        room_id = self.counter.get()
-        self.dict[sender] = room_id
-        self.dict[receiver] = room_id
+        # room id -> usernames in that room
+        self.members: Dict[int, Set[str]] = {}
+        # username -> ids of the rooms they're in
+        # for example self.rooms["John"] -> gives you every room John is in
+        self.rooms: Dict[str, Set[int]] = {}
+        # the conversation each room belongs to and back, so both users end up in the same room
+        self.pair_rooms: Dict[FrozenSet[str], int] = {}
+        self.room_pairs: Dict[int, FrozenSet[str]] = {}
+
+    # returns the room for the conversation between sender and receiver,
+    # creating it if needed, and puts the sender in it
+    def get_or_create_room(self, sender: str, receiver: str) -> int:
+        pair = frozenset((sender, receiver))
+        room_id = self.pair_rooms.get(pair)
+        if room_id is None:
+            room_id = self.counter.get()
+            self.pair_rooms[pair] = room_id
+            self.room_pairs[room_id] = pair
+            self.members[room_id] = set()
+        self.join_room(sender, room_id)
         return room_id
-    
-    def join_room(self,  sender: str, room_id: int) -> int:
-        self.dict[sender] = room_id
 
-    def leave_room(self, user):
-        if user not in self.dict.keys():
+    # returns False if the room doesn't exist (anymore)
+    def join_room(self, sender: str, room_id: int) -> bool:
+        members = self.members.get(room_id)
+        if members is None:
+            return False
+        members.add(sender)
+        self.rooms.setdefault(sender, set()).add(room_id)
+        return True
+
+    # leaves one room, or every room the user is in if room_id is None
+    def leave_room(self, user: str, room_id: int = None):
+        room_ids = self.rooms.get(user)
+        if not room_ids:
             return
-        del self.dict[user]
+        for leaving in ([room_id] if room_id is not None else list(room_ids)):
+            if leaving not in room_ids:
+                continue
+            room_ids.discard(leaving)
+            members = self.members[leaving]
+            members.discard(user)
+            if not members:
+                self._delete_room(leaving)
+        if not room_ids:
+            del self.rooms[user]
+
+    def _delete_room(self, room_id: int):
+        del self.members[room_id]
+        pair = self.room_pairs.pop(room_id)
+        del self.pair_rooms[pair]
+
+    # gets the ids of the rooms a user is in
+    def get_room_ids(self, user: str) -> Set[int]:
+        return set(self.rooms.get(user, ()))
+
+    def get_members(self, room_id: int) -> Set[str]:
+        return set(self.members.get(room_id, ()))
+
+    # the two users a room was created for, None if it doesn't exist
+    def get_pair(self, room_id: int):
+        return self.room_pairs.get(room_id)
 
-    # gets the room id from a user
-    def get_room_id(self, user: str):
-        if user not in self.dict.keys():
-            return None
-        return self.dict[user]
+    def room_count(self) -> int:
+        return len(self.members)
+
+    def user_count(self) -> int:
+        return len(self.rooms)
+
+
+# rooms shared between every worker process, used by SharedRoom below
+class ChatRoom(Base):
+    __tablename__ = "chat_room"
+
+    id = Column(Integer, primary_key=True)
+    # the conversation the room belongs to, user_1 < user_2 like in Friendship
+    user_1 = Column(String, ForeignKey('user.username'))
+    user_2 = Column(String, ForeignKey('user.username'))
+
+    # never hand out the id of a deleted room again, a client may still have it in a cookie
+    __table_args__ = (
+        Index("uq_chat_room_pair", "user_1", "user_2", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
+class RoomMember(Base):
+    __tablename__ = "room_member"
+
+    room_id = Column(Integer, ForeignKey('chat_room.id'), primary_key=True)
+    username = Column(String, ForeignKey('user.username'), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_room_member_username", "username"),
+    )
+
+# same interface as Room, but the rooms live in the database
+# so every worker process sees the same rooms, use it when running more than one worker
+# every operation is a lookup on a primary key or index
+class SharedRoom():
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _add_member(self, session: Session, user: str, room_id: int):
+        # merge, the user may already be in the room
+        session.merge(RoomMember(room_id=room_id, username=user))
+
+    @blocking
+    def get_or_create_room(self, sender: str, receiver: str) -> int:
+        user_1, user_2 = sorted((sender, receiver))
+        with Session(self.engine) as session:
+            room_id = session.query(ChatRoom.id).filter_by(user_1=user_1, user_2=user_2).scalar()
+            if room_id is None:
+                room = ChatRoom(user_1=user_1, user_2=user_2)
+                session.add(room)
+                try:
+                    session.flush()
+                    room_id = room.id
+                except IntegrityError:
+                    # another worker created it first
+                    session.rollback()
+                    room_id = session.query(ChatRoom.id).filter_by(user_1=user_1, user_2=user_2).scalar()
+            self._add_member(session, sender, room_id)
+            session.commit()
+            return room_id
+
+    @blocking
+    def join_room(self, sender: str, room_id: int) -> bool:
+        with Session(self.engine) as session:
+            if session.get(ChatRoom, room_id) is None:
+                return False
+            self._add_member(session, sender, room_id)
+            session.commit()
+            return True
+
+    @blocking
+    def leave_room(self, user: str, room_id: int = None):
+        with Session(self.engine) as session:
+            query = session.query(RoomMember).filter(RoomMember.username == user)
+            if room_id is not None:
+                query = query.filter(RoomMember.room_id == room_id)
+            room_ids = [member.room_id for member in query]
+            if not room_ids:
+                return
+            query.delete()
+            # and drop the rooms nobody is left in
+            still_used = select(RoomMember.room_id).where(RoomMember.room_id == ChatRoom.id).exists()
+            session.query(ChatRoom).filter(ChatRoom.id.in_(room_ids), ~still_used) \
+                .delete(synchronize_session=False)
+            session.commit()
+
+    # gets the ids of the rooms a user is in
+    @blocking
+    def get_room_ids(self, user: str) -> Set[int]:
+        with Session(self.engine) as session:
+            return set(session.scalars(select(RoomMember.room_id).where(RoomMember.username == user)))
+
+    @blocking
+    def get_members(self, room_id: int) -> Set[str]:
+        with Session(self.engine) as session:
+            return set(session.scalars(select(RoomMember.username).where(RoomMember.room_id == room_id)))
+
+    @blocking
+    def get_pair(self, room_id: int):
+        with Session(self.engine) as session:
+            room = session.get(ChatRoom, room_id)
+            return None if room is None else frozenset((room.user_1, room.user_2))
+
+    @blocking
+    def room_count(self) -> int:
+        with Session(self.engine) as session:
+            return session.query(ChatRoom).count()
+
+    @blocking
+    def user_count(self) -> int:
+        with Session(self.engine) as session:
+            return session.query(RoomMember.username).distinct().count()
 
 
 class Friendship(Base):
@@ -96,6 +319,13 @@ class Friendship(Base):
     user1 = relationship("User", foreign_keys=[user_1])
     user2 = relationship("User", foreign_keys=[user_2])
 
+    # a friendship is stored once, with user_1 < user_2 (see db.friendship_key)
+    # so checking one is a single lookup on uq_friendship_pair
+    __table_args__ = (
+        Index("uq_friendship_pair", "user_1", "user_2", unique=True),
+        Index("ix_friendship_user_2", "user_2", "user_1"),
+    )
+
 class FriendRequest(Base):
     __tablename__ = "friend_request"
     
@@ -108,4 +338,10 @@ class FriendRequest(Base):
     sender_user = relationship("User", foreign_keys=[sender])
     receiver_user = relationship("User", foreign_keys=[receiver])
 
-    
+    # pending requests are listed per receiver and per sender
+    # and there's at most one pending request from a sender to a receiver
+    __table_args__ = (
+        Index("ix_friend_request_receiver_status", "receiver", "status"),
+        Index("ix_friend_request_sender_status", "sender", "status"),
+        Index("uq_friend_request_pending", "sender", "receiver", unique=True, sqlite_where=text("status = 'pending'")),
+    )
@@ -0,0 +1,215 @@
+'''
+presence
+who's online and who's typing, sent out in batches
+
+Online status doesn't trust the disconnect event (a dropped connection might
+never send one). Every socket heartbeats instead, and a user is online until
+PRESENCE_TIMEOUT seconds pass without a heartbeat from any of their sockets.
+
+Nothing is emitted when an event comes in. Changes are collected and a
+background thread sends them every flush_interval seconds: one "presence"
+event per friend with every friend of theirs that came online or went
+offline, and one "typing" event per room with who's typing in it now.
+A user who keeps typing only changes anything when they start and stop, so
+one keypress or fifty cost the same fan-out. heartbeat and typing events are
+also rate limited per socket, anything past the limit is dropped.
+
+The state is per worker. With a socket.io message queue the emits still reach
+friends on other workers, but a new socket's first snapshot only knows about
+the users connected to its own worker.
+'''
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Set
+
+logger = logging.getLogger(__name__)
+
+
+# every socket.io connection also joins the room of its user, so "presence" can reach all their tabs
+def user_room(username: str) -> str:
+    return f"user:{username}"
+
+
+class RateLimiter():
+    # token bucket per key, rate tokens a second up to burst
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        # key -> [tokens left, when they were counted]
+        self.buckets: Dict[str, list] = {}
+
+    def allow(self, key: str, now: float) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def forget(self, key: str):
+        self.buckets.pop(key, None)
+
+
+class Presence():
+    # emit(event, data, to) sends one socket.io event to a room
+    # local_only sends presence only to friends connected to this worker, turn it off when there are more
+    def __init__(self, emit: Callable, timeout: float = 60, typing_timeout: float = 6,
+                 flush_interval: float = 1.0, rate: float = 2.0, burst: int = 5, local_only: bool = True):
+        self.emit = emit
+        self.timeout = timeout
+        self.typing_timeout = typing_timeout
+        self.flush_interval = flush_interval
+        self.local_only = local_only
+        self.limiter = RateLimiter(rate, burst)
+        # username -> when they go offline unless they heartbeat first
+        self.deadlines: Dict[str, float] = {}
+        # username -> their friends, read once on connect and kept while they're online
+        self.friends: Dict[str, Set[str]] = {}
+        # users whose friends have been told they're online
+        self.announced: Set[str] = set()
+        # users who came online since the last flush
+        self.arrived: Set[str] = set()
+        # room id -> username -> when their "typing" runs out
+        self.typing: Dict[object, Dict[str, float]] = {}
+        # rooms whose set of typing users changed since the last flush
+        self.dirty_rooms: Set[object] = set()
+        # events received, dropped by the rate limit and emitted, for the metrics and the benchmark
+        self.stats = {"received": 0, "dropped": 0, "emitted": 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # the flush thread starts with the first connection
+    def _ensure_started(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="presence", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # a failed emit shouldn't stop presence for everyone
+                logger.exception("presence flush failed")
+
+    # a socket of username connected, returns {friend: True} for the friends online right now
+    # friends who arrived since the last flush aren't in it, the flush tells this user about them
+    def connect(self, username: str, friends: Iterable[str], now: float = None) -> Dict[str, bool]:
+        self._ensure_started()
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.friends[username] = set(friends)
+            self._touch(username, now)
+            return {friend: True for friend in self.friends[username] if friend in self.announced}
+
+    # the socket is gone, its user stays online until their heartbeats run out
+    def disconnect(self, sid: str):
+        with self.lock:
+            self.limiter.forget(sid)
+
+    # returns False if the socket is over its rate limit and the event was dropped
+    def heartbeat(self, sid: str, username: str, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self._allow(sid, now):
+                return False
+            self._touch(username, now)
+            return True
+
+    # username started (active) or stopped typing in room_id
+    def set_typing(self, sid: str, username: str, room_id, active: bool = True, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self._allow(sid, now):
+                return False
+            self._touch(username, now)
+            self._set_typing(username, room_id, active, now)
+            return True
+
+    # sending a message ends typing, not rate limited since send isn't
+    def stop_typing(self, username: str, room_id):
+        with self.lock:
+            self._set_typing(username, room_id, False, 0)
+
+    def is_online(self, username: str) -> bool:
+        return username in self.deadlines
+
+    def online_count(self) -> int:
+        return len(self.deadlines)
+
+    def _allow(self, sid: str, now: float) -> bool:
+        self.stats["received"] += 1
+        if self.limiter.allow(sid, now):
+            return True
+        self.stats["dropped"] += 1
+        return False
+
+    def _touch(self, username: str, now: float):
+        if username not in self.deadlines:
+            self.arrived.add(username)
+        self.deadlines[username] = now + self.timeout
+
+    def _set_typing(self, username: str, room_id, active: bool, now: float):
+        typers = self.typing.get(room_id)
+        if active:
+            if typers is None:
+                typers = self.typing[room_id] = {}
+            # only starting to type is news, keeping on typing just moves the deadline
+            if username not in typers:
+                self.dirty_rooms.add(room_id)
+            typers[username] = now + self.typing_timeout
+        elif typers is not None and typers.pop(username, None) is not None:
+            self.dirty_rooms.add(room_id)
+            if not typers:
+                del self.typing[room_id]
+
+    # sends everything that changed since the last flush, returns how many events went out
+    def flush(self, now: float = None) -> int:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            left = [username for username, deadline in self.deadlines.items() if deadline <= now]
+            for username in left:
+                del self.deadlines[username]
+            for room_id, typers in list(self.typing.items()):
+                for username in [name for name, deadline in typers.items() if deadline <= now]:
+                    del typers[username]
+                    self.dirty_rooms.add(room_id)
+                if not typers:
+                    del self.typing[room_id]
+            # friend -> {username: online} for everyone whose status changed
+            updates: Dict[str, Dict[str, bool]] = {}
+            # someone who came and went between two flushes is no news either way
+            changed = [(username, True) for username in self.arrived
+                       if username in self.deadlines and username not in self.announced]
+            changed += [(username, False) for username in left if username in self.announced]
+            for username, online in changed:
+                for friend in self.friends.get(username, ()):
+                    if not self.local_only or friend in self.deadlines:
+                        updates.setdefault(friend, {})[username] = online
+                if online:
+                    self.announced.add(username)
+                else:
+                    self.announced.discard(username)
+            for username in left:
+                self.friends.pop(username, None)
+            self.arrived.clear()
+            rooms = {room_id: sorted(self.typing.get(room_id, ())) for room_id in self.dirty_rooms}
+            self.dirty_rooms.clear()
+
+        for friend, statuses in updates.items():
+            self.emit("presence", statuses, user_room(friend))
+        for room_id, typers in rooms.items():
+            self.emit("typing", {"room_id": room_id, "users": typers}, room_id)
+        emitted = len(updates) + len(rooms)
+        self.stats["emitted"] += emitted
+        return emitted
@@ -4,96 +4,197 @@ file containing all the routes related to socket.io
 '''
 
 
-from flask_socketio import join_room, emit, leave_room
+from flask_socketio import join_room, emit, leave_room, rooms
 from flask import request
+from typing import Dict
+import threading
 
-try:
-    from __main__ import socketio
-except ImportError:
-    from app import socketio
-
-from models import Room
+from models import Room, SharedRoom
+from presence import Presence, user_room
 
 import db
+import auth
+import wire
+import config
+import metrics
+
+# set by init(), with more than one worker the rooms have to live in the database so every worker sees them
+room = None
+
+# set by init(), who's online and typing, see presence.py
+presence = None
+
+# socket session id -> the username its jwt was issued to
+# set once on connect, events read it from here instead of trusting their arguments
+sessions: Dict[str, str] = {}
+# username -> how many of their sockets are connected to this worker, a user with
+# several tabs only leaves their (local) rooms when the last one disconnects
+socket_counts: Dict[str, int] = {}
+sessions_lock = threading.Lock()
+
+# (event, handler) for every handler below, init() registers them on the app's SocketIO
+handlers = []
+
+def on(event: str):
+    def decorator(fn):
+        handlers.append((event, fn))
+        return fn
+    return decorator
 
-room = Room()
+# RSA-OAEP with a 4096 bit key makes 512 bytes, anything bigger isn't a key envelope
+MAX_ENVELOPE_SIZE = 1024
+
+# group ids come from the client, anything but an int (bools are ints too) is turned away
+def is_group_id(group_id) -> bool:
+    return isinstance(group_id, int) and not isinstance(group_id, bool)
+
+# the room every member of a group is in, a group message is a single emit to it
+def group_room(group_id: int) -> str:
+    return f"group:{group_id}"
+
+# called by app.create_app() once the database is ready
+def init(socketio):
+    global room, presence
+    if room is None:
+        room = SharedRoom(db.engine) if config.ROOM_REGISTRY == "database" else Room()
+    if presence is None:
+        presence = Presence(lambda event, data, to: socketio.emit(event, data, to=to),
+                            timeout=config.PRESENCE_TIMEOUT, typing_timeout=config.TYPING_TIMEOUT,
+                            flush_interval=config.PRESENCE_FLUSH_INTERVAL, rate=config.PRESENCE_EVENT_RATE,
+                            burst=config.PRESENCE_EVENT_BURST,
+                            # friends connected to other workers only get emits through the message queue
+                            local_only=config.SOCKETIO_MESSAGE_QUEUE is None)
+    for event, handler in handlers:
+        socketio.on_event(event, handler)
+    metrics.gauge("chat_socketio_connections", "Authenticated sockets connected to this worker", lambda: len(sessions))
+    metrics.gauge("chat_rooms", "Chat rooms open", lambda: room.room_count())
+    metrics.gauge("chat_room_users", "Users in at least one chat room", lambda: room.user_count())
+    metrics.gauge("chat_online_users", "Users with a recent heartbeat on this worker", lambda: presence.online_count())
+    metrics.gauge("chat_presence_events_dropped", "Heartbeat and typing events over the rate limit",
+                  lambda: presence.stats["dropped"])
+
+# the chat rooms this socket has joined, kept by socket.io itself so checking them is free
+# chat rooms have int ids, the sid and user_room() are the socket's own rooms
+def joined_rooms():
+    return {room_id for room_id in rooms() if isinstance(room_id, int)}
 
 # when the client connects to a socket
 # this event is emitted when the io() function is called in JS
-@socketio.on('connect')
-def connect():
-    username = request.cookies.get("username")
+# _auth is the client's socket.io auth payload, unused, the jwt cookie is what counts
+@on('connect')
+@metrics.timed("connect")
+def connect(_auth=None):
+    # the jwt cookie is checked once here, sockets without a valid one are refused
+    username = auth.identify_request(request)
+    if username is None:
+        return False
+    with sessions_lock:
+        sessions[request.sid] = username
+        socket_counts[username] = socket_counts.get(username, 0) + 1
+
+    join_room(user_room(username))
+    for group_id in db.get_group_ids(username):
+        join_room(group_room(group_id))
+    online = presence.connect(username, db.list_friends(username))
+    if online:
+        emit("presence", online)
+    send_unread(username)
+
     room_id = request.cookies.get("room_id")
-    if room_id is None or username is None:
+    if room_id is None or not room_id.isdigit():
+        return
+    room_id = int(room_id)
+    # the cookie is only a hint, the room has to be one of this user's conversations
+    pair = room.get_pair(room_id)
+    if pair is not None and username not in pair:
         return
     # socket automatically leaves a room on client disconnect
     # so on client connect, the room needs to be rejoined
-    join_room(int(room_id))
-    emit("incoming", (f"{username} has connected", "green"), to=int(room_id))
+    if pair is None or not room.join_room(username, room_id):
+        # everyone left while we were gone and the room was cleaned up
+        emit("incoming", ("The room has closed, leave and start a new chat.", "red"))
+        return
+    join_room(room_id)
+    emit("incoming", (f"{username} has connected", "green"), to=room_id)
+
+# pushes the messages that arrived while the user was away, only to this client
+# then moves the read cursors past them, so a reconnect only costs the new messages
+def send_unread(username):
+    messages = db.get_unread_messages(username)
+    if not messages:
+        return
+    emit("unread", [{"id": message.id, "sender": message.sender, "message": message.message,
+                     "timestamp": message.timestamp.isoformat()} for message in messages])
+    newest = {}
+    for message in messages:
+        newest[message.sender] = message.id
+    for sender, message_id in newest.items():
+        db.mark_read(username, sender, message_id)
 
 # event when client disconnects
 # quite unreliable use sparingly
-@socketio.on('disconnect')
+@on('disconnect')
+@metrics.timed("disconnect")
 def disconnect():
-    username = request.cookies.get("username")
-    room_id = request.cookies.get("room_id")
-    if room_id is None or username is None:
-        return
-    emit("incoming", (f"{username} has disconnected", "red"), to=int(room_id))
+    with sessions_lock:
+        username = sessions.pop(request.sid, None)
+        if username is None:
+            return
+        remaining = socket_counts.get(username, 1) - 1
+        if remaining:
+            socket_counts[username] = remaining
+        else:
+            socket_counts.pop(username, None)
+    # the user stays online for their friends until their heartbeats stop
+    presence.disconnect(request.sid)
+    for room_id in joined_rooms():
+        emit("incoming", (f"{username} has disconnected", "red"), to=room_id)
+    # connect() puts the user back in if they come back, their other tabs keep them in.
+    # shared rooms stay as they are, this worker can't see the user's tabs on other workers
+    # and leaving would hand the peer a new room while those tabs sit in the old one.
+    # they're only left with an explicit "leave"
+    if not remaining and isinstance(room, Room):
+        room.leave_room(username)
 
 # send message event handler
-@socketio.on("send")
-def send(username, message, room_id):
+# the username argument is ignored, messages go out under the socket's own identity
+@on("send")
+@metrics.timed("send")
+def send(_username, message, room_id):
+    username = sessions.get(request.sid)
+    if username is None or room_id not in joined_rooms():
+        return
     # Here we structure the data as a dictionary before sending
-    print(f"Sending message from {username} to room {room_id}")
     emit("incoming", {"username": username, "message": message}, to=room_id)
+    presence.stop_typing(username, room_id)
 
-# join room event handler
-# sent when the user joins a room
-@socketio.on("join")
-def join(sender_name, receiver_name):
-    
-    receiver = db.get_user(receiver_name)
-    if receiver is None:
-        return "Unknown receiver!"
-    
-    sender = db.get_user(sender_name)
-    if sender is None:
-        return "Unknown sender!"
-
-    room_id = room.get_room_id(receiver_name)
-
-    # if the user is already inside of a room 
-    if room_id is not None:
-        
-        room.join_room(sender_name, room_id)
-        join_room(room_id)
-        # emit to everyone in the room except the sender
-        emit("incoming", (f"{sender_name} has joined the room.", "green"), to=room_id, include_self=False)
-        # emit only to the sender
-        emit("incoming", (f"{sender_name} has joined the room. Now talking to {receiver_name}.", "green"))
-        return room_id
-
-    # if the user isn't inside of any room, 
-    # perhaps this user has recently left a room
-    # or is simply a new user looking to chat with someone
-    room_id = room.create_room(sender_name, receiver_name)
-    join_room(room_id)
-    emit("incoming", (f"{sender_name} has joined the room. Now talking to {receiver_name}.", "green"), to=room_id)
-    return room_id
+# sent by every client every 20 seconds, keeps the user online
+@on("heartbeat")
+@metrics.timed("heartbeat")
+def heartbeat():
+    username = sessions.get(request.sid)
+    if username is not None:
+        presence.heartbeat(request.sid, username)
 
-# leave room event handler
-@socketio.on("leave")
-def leave(username, room_id):
-    emit("incoming", (f"{username} has left the room.", "red"), to=room_id)
-    leave_room(room_id)
-    room.leave_room(username)
+# sent while the user types in a room (every few seconds, not every key) and with False when they stop
+# the room hears about it with the next presence flush
+@on("typing")
+@metrics.timed("typing")
+def typing(room_id, active=True):
+    username = sessions.get(request.sid)
+    if username is None or room_id not in joined_rooms():
+        return
+    presence.set_typing(request.sid, username, room_id, bool(active))
 
-@socketio.on("join")
-def join(sender_name, receiver_name):
-    sender = db.get_user(sender_name)
-    if sender is None:
-        return "Unknown sender!"
+# join room event handler
+# sent when the user joins a room
+# the sender is always the socket's own user, whatever the client passes
+@on("join")
+@metrics.timed("join")
+def join(_sender_name, receiver_name):
+    sender_name = sessions.get(request.sid)
+    if sender_name is None:
+        return "Not logged in!"
 
     receiver = db.get_user(receiver_name)
     if receiver is None:
@@ -104,15 +205,73 @@ def join(sender_name, receiver_name):
         emit("error", "You can only join rooms with your friends.")
         return "You are not friends with the user."
 
-    room_id = room.get_room_id(receiver_name)
-    if room_id is not None:
-        room.join_room(sender_name, room_id)
-        join_room(room_id)
-        emit("incoming", (f"{sender_name} has joined the room.", "green"), to=room_id, include_self=False)
-        emit("incoming", (f"{sender_name} has joined the room. Now talking to {receiver_name}.", "green"))
-        return room_id
-
-    room_id = room.create_room(sender_name, receiver_name)
+    # every conversation has its own room, so if the receiver is already
+    # waiting the sender ends up in the same one
+    room_id = room.get_or_create_room(sender_name, receiver_name)
     join_room(room_id)
-    emit("incoming", (f"{sender_name} has joined the room. Now talking to {receiver_name}.", "green"), to=room_id)
+    # emit to everyone in the room except the sender
+    emit("incoming", (f"{sender_name} has joined the room.", "green"), to=room_id, include_self=False)
+    # emit only to the sender
+    emit("incoming", (f"{sender_name} has joined the room. Now talking to {receiver_name}.", "green"))
     return room_id
+
+# joins the room of a group the user was just added to (the "group_created" event),
+# the groups they were already in are joined on connect
+@on("group_join")
+@metrics.timed("group_join")
+def group_join(group_id):
+    username = sessions.get(request.sid)
+    if not is_group_id(group_id):
+        return "Invalid group."
+    if username is None or username not in db.get_group_members(group_id):
+        return "Not a member of this group."
+    join_room(group_room(group_id))
+    return True
+
+# a message to a group: body encrypted once with a fresh key, and keys holding that key
+# encrypted for every member ({username: envelope}, the sender included)
+# it's stored once and the body goes out in one emit to the group's room, returns the message id
+@on("group_send")
+@metrics.timed("group_send")
+def group_send(group_id, body, iv, keys):
+    username = sessions.get(request.sid)
+    if username is None:
+        return "Not logged in!"
+    if not is_group_id(group_id):
+        return "Invalid group."
+    members = db.get_group_members(group_id)
+    if username not in members:
+        return "Not a member of this group."
+    # every member needs their envelope, and nobody else gets one
+    if not isinstance(keys, dict) or set(keys) != members:
+        return "Send one key for every member of the group."
+    try:
+        body, iv = wire.to_bytes(body), wire.to_bytes(iv)
+        keys = {member: wire.to_bytes(envelope) for member, envelope in keys.items()}
+    except wire.InvalidPayload as e:
+        return str(e)
+    if body is None or iv is None or any(not envelope or len(envelope) > MAX_ENVELOPE_SIZE for envelope in keys.values()):
+        return "Invalid message."
+
+    message_id, timestamp = db.insert_group_message(group_id, username, body, iv, keys)
+    # each member only gets their own envelope, every envelope in the room emit would
+    # send each member all of them, growing with the square of the group size
+    # they go first so the key is there when the body arrives
+    for member, envelope in keys.items():
+        emit("group_key", {"id": message_id, "key": envelope}, to=user_room(member), include_self=False)
+    emit("group_message", {"id": message_id, "group_id": group_id, "sender": username, "body": body, "iv": iv,
+                           "timestamp": timestamp.isoformat()},
+         to=group_room(group_id), include_self=False)
+    return message_id
+
+# leave room event handler
+@on("leave")
+@metrics.timed("leave")
+def leave(_username, room_id):
+    username = sessions.get(request.sid)
+    if username is None or room_id not in joined_rooms():
+        return
+    emit("incoming", (f"{username} has left the room.", "red"), to=room_id)
+    leave_room(room_id)
+    room.leave_room(username, room_id)
+    presence.stop_typing(username, room_id)
@@ -0,0 +1,883 @@
+// the chat page's script, home.jinja loads it after the page content
+// it's a static file (fingerprinted and precompressed by assets.py) so browsers cache it,
+// the only per-user value, the username, comes from the page
+
+let room_id = 0;
+// the group being chatted in, null when it's a one to one chat
+let group_id = null;
+
+// routes behind a login check the JWT cookie's CSRF token on POST, flask_jwt_extended
+// leaves a copy in a cookie the page can read and wants it back in this header
+$.ajaxSetup({
+    beforeSend: function(xhr, settings) {
+        if (settings.type === "POST") {
+            xhr.setRequestHeader("X-CSRF-TOKEN", Cookies.get("csrf_access_token"));
+        }
+    }
+});
+
+// This function initializes the database and upgrades it if necessary
+function initDatabase() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open("chatAppDB", 1);  // Ensure the database name and version are consistent
+
+        request.onupgradeneeded = function(event) {
+            const db = event.target.result;
+            if (!db.objectStoreNames.contains("keys")) {
+                db.createObjectStore("keys", { keyPath: "username" });
+                hmacObj = db.createObjectStore("Hmackey");
+                console.log("Database upgraded and 'keys' object store created.");
+            } 
+        };
+
+        request.onsuccess = function() {
+            console.log("Database initialized successfully.");
+            resolve(request.result);
+        };
+
+        request.onerror = function(event) {
+            console.error("Database error: " + event.target.errorCode);
+            reject(event.target.error);
+        };
+    });
+}
+
+$(document).ready(() => {
+    // room_id is undefined if the user hasn't joined a room
+    // we early return in this case
+    if (Cookies.get("room_id") == undefined) {
+        return;
+    }
+
+    // the user has already joined an existing room
+    // we'll display the message box, instead of the "Chat with: " box
+    $("#chat_box").hide();
+    $("#input_box").show();
+    room_id = parseInt(Cookies.get("room_id"));
+})
+
+// Here's the Socket IO part of the code
+// things get a bit complicated here so brace yourselves :P
+// home.jinja puts the logged in user on <main>
+let username = document.querySelector("main").dataset.username;
+
+Cookies.set('username', username);
+
+// initializes the socket
+const socket = io();
+
+// Generate HMAC Key at the beginning of the session
+async function generateHMAC() {
+    try {
+        let Hkey = await window.crypto.subtle.generateKey(
+        {
+            name: "HMAC",
+            hash: { name: "SHA-256" },
+        },
+            true,
+            ["sign", "verify"],
+        );
+        const exportHkey = await window.crypto.subtle.exportKey("raw", Hkey)
+        const exportHkeyBase64 = btoa(String.fromCharCode.apply(null, [...new Uint8Array(exportHkey)]));
+        localStorage.setItem("Hkey", exportHkeyBase64);
+
+    } catch (error) {
+        console.error("HMAC Key Generation Error: ", error);
+        return null; 
+    }
+}
+generateHMAC();
+
+
+// Function to load private key from IndexedDB
+async function loadPrivateKey(username) {
+    const db = await initDatabase();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(["keys"], "readonly");
+        const store = transaction.objectStore("keys");
+        const request = store.get(username);
+
+        request.onsuccess = function() {
+            if (request.result) {
+                console.log("Private key loaded: ", request.result.privateKey);
+                resolve(request.result.privateKey);
+            } else {
+                console.error("No key found for username: ", username);
+                reject("No key found");
+            }
+        };
+
+        request.onerror = function(event) {
+            console.error("Error retrieving key: ", event.target.error);
+            reject("Error retrieving key");
+        };
+    });
+}
+
+function isBase64(str) {
+    try {
+        btoa(atob(str)); // This will throw an error if 'str' is not properly Base64 encoded
+        return true;
+    } catch (error) {
+        console.error("Base64 validation error: ", error);
+        console.error("Invalid Base64 string: ", str);
+        return false;
+    }
+}
+
+function str2ab(str) {
+    const buf = new ArrayBuffer(str.length);
+    const bufView = new Uint8Array(buf);
+    for (let i = 0, strLen = str.Length; i < strLen; i++) {
+        bufView[i] = str.charCodeAt(i);
+    }
+    return buf;
+}
+
+function b642ab(base64str) {
+    return Uint8Array.from(window.atob(base64str), c => c.charCodeAt(0));
+}
+
+// bytes as base64, for the places that still speak json
+function ab2b64(buffer) {
+    return btoa(String.fromCharCode(...new Uint8Array(buffer)));
+}
+
+// socket.io delivers the ciphertext as binary (an ArrayBuffer), older messages may still be base64 strings
+async function decryptMessage(encryptedMessage) {
+    console.log("Decrypting message: ", encryptedMessage);
+    if (typeof encryptedMessage === "string" && !isBase64(encryptedMessage)) {
+        console.error('Decryption failed: Invalid Base64 encoding');
+        throw new Error('Invalid encrypted message data');
+    }
+    try {
+        const privateKeyBase64 = await loadPrivateKey(username);
+        if (!isBase64(privateKeyBase64)) {
+            console.error('Decryption failed: Invalid private key data');
+            throw new Error('Invalid private key data');
+        }
+        console.log("Private key loaded:", privateKeyBase64);
+        const privateKeyBuffer = new Uint8Array(atob(privateKeyBase64).split('').map(char => char.charCodeAt(0)));
+        const privateKey = await window.crypto.subtle.importKey(
+            "pkcs8",
+            privateKeyBuffer,
+            {name: "RSA-OAEP", hash: {name: "SHA-256"}},
+            true,
+            ["decrypt"]
+        );
+
+        const encryptedBuffer = typeof encryptedMessage === "string"
+            ? b642ab(encryptedMessage)
+            : new Uint8Array(encryptedMessage);
+
+        const decrypted = await window.crypto.subtle.decrypt(
+            {name: "RSA-OAEP"},
+            privateKey,
+            encryptedBuffer
+        );
+        const decoder = new TextDecoder();
+        const decodedText = decoder.decode(decrypted);
+        console.log("Decrypted text:", decodedText);
+        return decodedText;
+    } catch (error) {
+        console.error("Decryption process error:", error);
+        throw new Error('Decryption failed');
+    }
+}
+
+async function verify(message) {
+    try {
+        let encMessage = new TextEncoder().encode(message);
+
+        let sig = localStorage.getItem("Signature");
+        let key = localStorage.getItem("Hkey");
+
+        console.log("Verify Signature", b642ab(sig));
+        console.log("Verify Key", b642ab(key));
+
+        const importHkey = await crypto.subtle.importKey(
+            'raw',
+            b642ab(key),
+            {name: 'HMAC',
+            hash: {
+                name: 'SHA-256'
+            }},
+            true,
+            ['verify']
+        );
+
+        let result = await window.crypto.subtle.verify(
+            "HMAC",
+            importHkey,
+            b642ab(sig),
+            encMessage
+        );
+
+        if(result) {
+            console.log("Verified True!")        //let keyArrayBuffer = Uint8Array.from(window.atob(key), c => c.charCodeAt(0));
+
+            return true;
+        } else {
+            console.log("Verified False!")
+            return false;
+        }
+    } catch (error) {
+        console.error("Verification Error: ", error);
+        return null; 
+    }
+};   
+
+// Modify the existing incoming message handler to decrypt messages
+socket.on("incoming", async (data, color = "black") => {
+    console.log("Received message data:", data);  // Log the raw data for debugging.
+
+    let messageToDisplay = "Hi how are you";
+
+    if (typeof data === 'string') {
+        messageToDisplay = data;  // Handle system messages or notifications directly
+    } else if (typeof data === 'object' && data.message && data.username) {
+        if (data.username !== username) {  // Check if the message is from another user
+            if (color === "black") {  // Assume "black" color means it needs decryption
+                const decryptedMessage = await decryptMessage(data.message);
+                const verifyMessage = await verify(decryptedMessage);
+                console.log("After waiting, we get the boolean, ", verifyMessage);
+                messageToDisplay = `${data.username}: ${decryptedMessage || "Decryption error"}`;
+            } else {
+                messageToDisplay = `${data.username}: ${data.message}`;
+            }
+        } else {
+            // If the message is from the user themselves, use the already displayed message
+            return;  // No need to add the message again
+        }
+    } else {
+        console.error("Received data in an unexpected format:", data);
+        messageToDisplay = "Error: Received data in an unexpected format.";
+    }
+
+    add_message(messageToDisplay, color);
+});
+
+// friends coming online or going offline, the server batches them, so one event can have several
+socket.on("presence", (statuses) => {
+    for (const [friend, online] of Object.entries(statuses)) {
+        $(`.presence[data-username="${friend}"]`).text(online ? "online" : "offline");
+    }
+});
+
+// everyone typing in a room, sent whenever that changes
+socket.on("typing", (data) => {
+    if (data.room_id !== room_id) {
+        return;
+    }
+    const others = data.users.filter((name) => name !== username);
+    $("#typing").text(others.length ? `${others.join(", ")} ${others.length > 1 ? "are" : "is"} typing...` : "");
+});
+
+// keeps us online for our friends, the server doesn't trust disconnects
+setInterval(() => socket.emit("heartbeat"), 20000);
+
+// typing is sent when we start and then at most every 3 seconds, the server drops it after 6 without one
+let lastTypingSent = 0;
+function typing() {
+    const now = Date.now();
+    // typing is only shown in one to one chats
+    if (group_id === null && now - lastTypingSent > 3000) {
+        lastTypingSent = now;
+        socket.emit("typing", room_id, true);
+    }
+}
+
+function stopTyping() {
+    if (group_id === null && lastTypingSent) {
+        lastTypingSent = 0;
+        socket.emit("typing", room_id, false);
+    }
+}
+
+// imported public keys, so we don't fetch and import a peer's key before every send
+const publicKeys = new Map();
+
+// messages that arrived while we were offline, pushed once when the socket connects
+socket.on("unread", async (messages) => {
+    for (const message of messages) {
+        try {
+            const decryptedMessage = await decryptMessage(message.message);
+            add_message(`${message.sender}: ${decryptedMessage}`, "black");
+        } catch (error) {
+            console.error("Failed to decrypt unread message:", error);
+        }
+    }
+});
+
+async function fetchPublicKey(username) {
+    if (publicKeys.has(username)) {
+        return publicKeys.get(username);
+    }
+    const url = `/get-public-key/${username}`;
+    try {
+        //console.log("Fetching public key for username: ", username);
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        //console.log("Public key data received: ", data.public_key);
+        const publicKey = await importPublicKey(data.public_key);
+        publicKeys.set(username, publicKey);
+        return publicKey;
+    } catch (error) {
+        console.error("Error fetching public key: ", error);
+        alert("Failed to fetch public key: " + error.message);
+    }
+}
+
+function importPublicKey(publicKeyBase64) {
+    return window.crypto.subtle.importKey(
+        "spki",
+        b642ab(publicKeyBase64),
+        {
+            name: "RSA-OAEP",
+            hash: {name: "SHA-256"}
+        },
+        true,
+        ["encrypt"]
+    );
+}
+
+// every member's public key for a group, from one request (minus the ones we already have)
+async function fetchGroupKeys(id) {
+    const response = await fetch(`/groups/${id}/keys`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const keys = {};
+    for (const [member, publicKeyBase64] of Object.entries(await response.json())) {
+        if (!publicKeys.has(member)) {
+            publicKeys.set(member, await importPublicKey(publicKeyBase64));
+        }
+        keys[member] = publicKeys.get(member);
+    }
+    return keys;
+}
+
+// socket.io hands us bytes as ArrayBuffers, json as base64 strings
+function toBytes(value) {
+    return typeof value === "string" ? b642ab(value) : new Uint8Array(value);
+}
+
+// a group message is encrypted once with a fresh AES key, and only that key
+// is encrypted with each member's public key (its "envelope")
+async function encryptGroupMessage(message, keys) {
+    const messageKey = await window.crypto.subtle.generateKey({name: "AES-GCM", length: 256}, true, ["encrypt"]);
+    const iv = window.crypto.getRandomValues(new Uint8Array(12));
+    const body = await window.crypto.subtle.encrypt({name: "AES-GCM", iv: iv}, messageKey, new TextEncoder().encode(message));
+    const rawKey = await window.crypto.subtle.exportKey("raw", messageKey);
+    const envelopes = {};
+    for (const [member, publicKey] of Object.entries(keys)) {
+        envelopes[member] = await window.crypto.subtle.encrypt({name: "RSA-OAEP"}, publicKey, rawKey);
+    }
+    return {body: body, iv: iv, envelopes: envelopes};
+}
+
+// opens our envelope with our private key, then the body with the key inside it
+async function decryptGroupMessage(body, iv, envelope) {
+    const privateKey = await window.crypto.subtle.importKey(
+        "pkcs8",
+        b642ab(await loadPrivateKey(username)),
+        {name: "RSA-OAEP", hash: {name: "SHA-256"}},
+        false,
+        ["decrypt"]
+    );
+    const rawKey = await window.crypto.subtle.decrypt({name: "RSA-OAEP"}, privateKey, toBytes(envelope));
+    const messageKey = await window.crypto.subtle.importKey("raw", rawKey, {name: "AES-GCM"}, false, ["decrypt"]);
+    const decrypted = await window.crypto.subtle.decrypt({name: "AES-GCM", iv: toBytes(iv)}, messageKey, toBytes(body));
+    return new TextDecoder().decode(decrypted);
+}
+
+async function sendGroup(message) {
+    let keys;
+    try {
+        keys = await fetchGroupKeys(group_id);
+    } catch (error) {
+        alert("Could not fetch the group's public keys");
+        return;
+    }
+    const {body, iv, envelopes} = await encryptGroupMessage(message, keys);
+    add_message(`${username}: ${message}`, "grey");
+    // stored once and the body sent to the whole group in one go, the server answers with the message id
+    socket.emit("group_send", group_id, body, iv, envelopes, (res) => {
+        if (typeof res != "number") {
+            alert(res);
+        }
+    });
+}
+
+async function startGroupChat(id) {
+    group_id = id;
+    $("#chat_box").hide();
+    $("#input_box").show();
+    try {
+        const response = await fetch(`/groups/${id}/messages`);
+        if (!response.ok) throw new Error('Failed to fetch messages');
+        for (const message of await response.json()) {
+            add_message(`${message.sender}: ${await decryptGroupMessage(message.body, message.iv, message.key)}`, "grey");
+        }
+    } catch (error) {
+        console.error('Failed to fetch or process group history:', error);
+    }
+}
+
+function createGroup() {
+    const members = $("#group_members").val().split(",").map((name) => name.trim()).filter((name) => name);
+    $.ajax({
+        url: "/groups",
+        type: "POST",
+        contentType: "application/json",
+        data: JSON.stringify({ name: $("#group_name").val(), members: members }),
+        success: function(response) {
+            // the "group_created" event adds it to the list
+            $("#group_name").val("");
+            $("#group_members").val("");
+        },
+        error: function(xhr, status, error) {
+            alert("Error creating group: " + xhr.responseText);
+        }
+    });
+}
+
+// we were put in a new group (maybe by ourselves), join its room to get its messages
+socket.on("group_created", (group) => {
+    socket.emit("group_join", group.id);
+    if ($(`#groups li[data-group-id="${group.id}"]`).length) {
+        return;
+    }
+    const item = $(`<li data-group-id="${group.id}"></li>`).text(group.name + " ");
+    item.append($("<small></small>").text(group.members.join(", ")));
+    item.append($("<button>Chat</button>").on("click", () => startGroupChat(group.id)));
+    $("#groups").append(item);
+});
+
+// our envelope for a group message, sent just before the message itself
+const groupKeys = new Map();
+socket.on("group_key", (data) => {
+    groupKeys.set(data.id, data.key);
+});
+
+// one emit to the whole group, opened with the envelope that came with "group_key"
+socket.on("group_message", async (data) => {
+    const envelope = groupKeys.get(data.id);
+    groupKeys.delete(data.id);
+    if (data.group_id !== group_id || envelope === undefined) {
+        return;
+    }
+    try {
+        add_message(`${data.sender}: ${await decryptGroupMessage(data.body, data.iv, envelope)}`, "black");
+    } catch (error) {
+        console.error("Failed to decrypt group message:", error);
+    }
+});
+
+// Function to Encrypt Message History
+async function encryptMessageHistory(message, keyBase64) {
+    const key = await importKeyFromBase64(keyBase64);
+    const iv = window.crypto.getRandomValues(new Uint8Array(12)); // Generate a random IV
+    const encryptedContent = await window.crypto.subtle.encrypt(
+        { name: "AES-GCM", iv: iv },
+        key,
+        new TextEncoder().encode(message)
+    );
+    return {
+        iv: btoa(String.fromCharCode(...iv)),
+        encryptedContent: btoa(String.fromCharCode(...new Uint8Array(encryptedContent)))
+    };
+}
+
+// Function to Decrypt Message History
+async function decryptMessageHistory(encryptedMessage, ivBase64, keyBase64) {
+    //console.log("Before decryption:", { encryptedMessage, ivBase64, keyBase64 });
+
+    if (!isBase64(encryptedMessage) || !isBase64(ivBase64) || !isBase64(keyBase64)) {
+        console.error('Invalid Base64 encoding found in one of the parameters');
+        return 'Decoding Error: Invalid Base64';
+    }
+
+    try {
+        const key = await importKeyFromBase64(keyBase64);
+        const iv = Uint8Array.from(atob(ivBase64), c => c.charCodeAt(0));
+        const encryptedContent = Uint8Array.from(atob(encryptedMessage), c => c.charCodeAt(0));
+
+        const decryptedContent = await window.crypto.subtle.decrypt(
+            { name: "AES-GCM", iv: iv },
+            key,
+            encryptedContent
+        );
+
+        const decodedText = new TextDecoder().decode(decryptedContent);
+        //console.log("Decrypted Text:", decodedText);
+        return decodedText;
+    } catch (error) {
+        console.error("Decryption process error:", error);
+        return 'Decryption Failed';
+    }
+}
+
+
+function isBase64(str) {
+    const base64Regex = /^(?:[A-Za-z0-9+\/]{4})*(?:[A-Za-z0-9+\/]{2}==|[A-Za-z0-9+\/]{3}=)?$/;
+    return base64Regex.test(str);
+}
+
+
+// Function to Import Key from Base64 (used in both encrypt and decrypt)
+async function importKeyFromBase64(keyBase64) {
+    //console.log(keyBase64)
+    const keyBytes = Uint8Array.from(atob(keyBase64), c => c.charCodeAt(0));
+    // Ensure the key length is 32 bytes (256 bits)
+    if (keyBytes.length !== 32) {
+        console.error("Key length is not 256 bits: ", keyBytes.length * 8);
+        throw new Error("AES key length must be 256 bits");
+    }
+    return window.crypto.subtle.importKey(
+        "raw",
+        keyBytes,
+        { name: "AES-GCM", length: 256 },
+        true, // Extractable
+        ["encrypt", "decrypt"] // Key usages
+    );
+}
+
+
+async function send() {
+    const receiver = $("#receiver").val();
+    const message = $("#message").val();
+    $("#message").val("");  // Clear the input after sending the message
+
+    if (group_id !== null) {
+        await sendGroup(message);
+        return;
+    }
+
+    // Fetch public key of the receiver
+    const publicKey = await fetchPublicKey(receiver);
+    if (!publicKey) {
+        alert('Could not fetch public key for encryption');
+        return;
+    }
+
+    await sign(message);
+
+    // Encrypt the message with the receiver's public key
+    const encryptedMessage = await encryptMessage(publicKey, message);
+
+    if (encryptedMessage) {
+        //console.log("Encrypted message sent: ", encryptedMessage);
+        // Emitting the message via socket for real-time communication
+        // Display the original message on the sender's side
+        add_message(`${username}: ${message}`, "grey");
+        socket.emit("send", username, encryptedMessage, room_id);
+
+        console.log("Emitting message:", {
+            username: username,
+            message: encryptedMessage,
+            room_id: room_id
+        });
+
+        // Store the encrypted message in the database
+        //console.log("Retrieved key from storage:", sessionStorage.getItem("key"));
+        const { encryptedContent, iv } = await encryptMessageHistory(message, sessionStorage.getItem("key"));
+        //console.log("Stored key:", sessionStorage.getItem("key"));
+
+        $.ajax({
+            url: '/send-message',
+            type: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify({
+                sender: username,
+                receiver: receiver,
+                encryptedMessage: ab2b64(encryptedMessage),
+                iv: iv,
+                encryptedContent: encryptedContent
+            }),
+            success: function(response) {
+                console.log("Message stored successfully.");
+            },
+            error: function(jqXHR, textStatus) {
+                console.error("Failed to send message for storage:", textStatus);
+                //alert("Failed to store message history.");
+            }
+        });
+    } else {
+        console.error("Failed to encrypt message");
+    }
+}
+
+async function sign(message) {
+    try {
+        let encMessage = new TextEncoder().encode(message);
+
+        let key = localStorage.getItem("Hkey");
+        //let keyArrBuffer = Uint8Array.from(atob(key), c => c.charCodeAt(0));
+
+        console.log("Sign Key", b642ab(key))
+
+        const importHkey = await crypto.subtle.importKey(
+            'raw',
+            b642ab(key),
+            {name: 'HMAC',
+            hash: {
+                name: 'SHA-256'
+            }},
+            true,
+            ['sign']
+        );
+
+        const signature = await window.crypto.subtle.sign(
+            "HMAC",
+            importHkey,
+            encMessage
+        );
+        const signatureBase64 = btoa(String.fromCharCode.apply(null, [...new Uint8Array(signature)]));
+
+        localStorage.setItem("Signature", signatureBase64);
+        //console.log("Message: ", encMessage);
+        //console.log("Imported Key", importHkey);
+        //console.log("Key get", keyArrBuffer);
+        //console.log("Signature", signatureBase64);
+
+    } catch (error) {
+        console.error("HMAC generation error: ", error);
+        return null; 
+    }
+}
+
+async function encryptMessage(publicKey, message) {
+    try {
+        const encoder = new TextEncoder();
+        const encodedMessage = encoder.encode(message);
+        const encrypted = await window.crypto.subtle.encrypt(
+            {name: "RSA-OAEP", hash: {name: "SHA-256"}},
+            publicKey,
+            encodedMessage
+        );
+        console.log("Successfully encrypted message.");
+        // the raw bytes, socket.io sends them as a binary attachment
+        return encrypted;
+    } catch (error) {
+        console.error("Encryption error: ", error);
+        return null; 
+    }
+}
+
+function startChatWith(friendUsername) {
+    // Set the receiver input to the friend's username
+    $("#receiver").val(friendUsername);
+
+    // Trigger join room directly with the friend's username
+    join_room(friendUsername);
+}
+
+// we emit a join room event to the server to join a room
+function join_room() {
+
+    let receiver = $("#receiver").val().trim();
+    if (!isFriend(receiver)) {
+        alert("You can only chat with friends.");
+        return;
+    }
+
+    // pass in the receiver of our message to the server
+    // as well as the current user's username
+    socket.emit("join", username, receiver, async (res) => {
+        // res is a string with the error message if the error occurs
+        // this is a pretty bad way of doing error handling, but watevs
+        if (typeof res != "number") {
+            alert(res);
+            return;
+        }
+
+        // set the room id variable to the room id returned by the server
+        room_id = res;
+        Cookies.set("room_id", room_id);
+
+        // Fetch and display message history after joining the room
+        await fetchAndDisplayMessageHistory(receiver);
+
+        // now we'll show the input box, so the user can input their message
+        $("#chat_box").hide();
+        $("#input_box").show();
+    });
+}
+
+// id of the newest message we've already shown for each receiver
+// so rejoining a room only fetches the messages sent since then
+const lastMessageIds = {};
+
+// Function to fetch message history from the server
+async function fetchAndDisplayMessageHistory(receiver) {
+    try {
+        let url = `/get-messages/${username}/${receiver}`;
+        if (lastMessageIds[receiver] !== undefined) {
+            url += `?since_id=${lastMessageIds[receiver]}`;
+        }
+        const response = await fetch(url);
+        if (!response.ok) throw new Error('Failed to fetch messages');
+
+        const messages = await response.json();
+        console.log("Messages received:", messages); // Log to inspect the data structure
+        if (messages.length > 0) {
+            lastMessageIds[receiver] = messages[messages.length - 1].id;
+        }
+
+        for (const message of messages) {
+            console.log("Individual message fetched:", message);
+            if (message.encryptedMessage && message.iv && sessionStorage.getItem("key")) {
+                const decryptedMessage = await decryptMessageHistory(message.encryptedMessage, message.iv, sessionStorage.getItem("key"));
+                add_message(`${message.sender}: ${decryptedMessage}`, "grey");
+            } else {
+                console.error('Message data incomplete or missing:', message);
+                add_message(`Error: Message data incomplete`, "red");
+            }
+        }
+    } catch (error) {
+        console.error('Failed to fetch or process message history:', error);
+        //alert('Could not load message history.');
+    }
+}
+
+// Function to display message history in the UI
+async function displayMessageHistory(messages) {
+    for (const message of messages) {
+        const decryptedMessage = await decryptMessageHistory(message.encryptedMessage, message.iv, sessionStorage.getItem("key"));
+        add_message(`${message.sender}: ${decryptedMessage}`, "grey"); // Assuming sender's name should be displayed
+    }
+}
+    // Helper function to check if a username is in the friends list
+    function isFriend(receiver) {
+        var isFriend = false;
+        $('li').not('#groups li').each(function() {
+            // Update to check against the text, ignoring the button
+            var listItemText = $(this).clone().children().remove().end().text().trim();
+            if (listItemText === receiver) {
+                isFriend = true;
+            }
+        });
+        return isFriend;
+    }
+
+// function when the user clicks on "Leave Room"
+// emits a "leave" event, telling the server that we want to leave the room
+function leave() {
+    lastTypingSent = 0;
+    $("#typing").text("");
+    // we stay in the group's room, its messages are ignored until it's opened again
+    if (group_id !== null) {
+        group_id = null;
+        $("#input_box").hide();
+        $("#chat_box").show();
+        return;
+    }
+    Cookies.remove("room_id");
+    socket.emit("leave", username, room_id);
+    $("#input_box").hide();
+    $("#chat_box").show();
+}
+
+// function to add a message to the message box
+// called when an incoming message has reached a client
+function add_message(message, color) {
+    let box = $("#message_box");
+    let child = $(`<p style="color:${color}; margin: 0px;"></p>`).text(message);
+    box.append(child);
+}
+
+// Function to send a friend request
+function sendFriendRequest() {
+    const receiver = $("#friend_username").val();  // Assuming you have an input field with id 'friend_username'
+    $.ajax({
+        url: "/add-friend",
+        type: "POST",
+        contentType: "application/json",
+        data: JSON.stringify({ receiver: receiver }),
+        success: function(response) {
+            alert(response);
+        },
+        error: function(xhr, status, error) {
+            alert("Error sending friend request: " + xhr.responseText);
+        }
+    });
+}
+
+// Function to accept a friend request
+function acceptFriendRequest(requestId) {
+    $.ajax({
+        url: "/accept-friend-request",
+        type: "POST",
+        contentType: "application/json",
+        data: JSON.stringify({ request_id: requestId }),
+        success: function(response) {
+            alert("Friend request accepted!");
+            location.reload();  // Reload the page to update the friends list
+        },
+        error: function(xhr, status, error) {
+            alert("Error accepting friend request: " + xhr.responseText);
+        }
+    });
+}
+
+// Function to reject a friend request
+function rejectFriendRequest(requestId) {
+    $.ajax({
+        url: "/reject-friend-request",
+        type: "POST",
+        contentType: "application/json",
+        data: JSON.stringify({ request_id: requestId }),
+        success: function(response) {
+            alert("Friend request rejected!");
+            location.reload();  // Reload the page to update the list of friend requests
+        },
+        error: function(xhr, status, error) {
+            alert("Error rejecting friend request: " + xhr.responseText);
+        }
+    });
+}
+
+// accepts or rejects every received request in one request (and one transaction)
+function answerAllFriendRequests(answer) {
+    const requestIds = $("#received_requests li").map(function() {
+        return Number(this.dataset.requestId);
+    }).get();
+    $.ajax({
+        url: `/friend-requests/${answer}`,
+        type: "POST",
+        contentType: "application/json",
+        data: JSON.stringify({ request_ids: requestIds }),
+        success: function(response) {
+            location.reload();
+        },
+        error: function(xhr, status, error) {
+            alert("Error answering friend requests: " + xhr.responseText);
+        }
+    });
+}
+
+// when the user presses the "Enter" key inside of the "message box", 
+// the message is sent to the server
+$("#message").on("keyup", (e) => {
+    if (e.key == "Enter") {
+        // the server ends typing when the message is sent
+        lastTypingSent = 0;
+        send();
+    } else if ($("#message").val()) {
+        typing();
+    } else {
+        stopTyping();
+    }
+})
+
+// when the user presses the enter key inside of the "receiver box"
+// the user joins a (socket) room
+ $("#receiver").on("keyup", (e) => {
+    if (e.key == "Enter") {
+        join_room();
+    }
+})
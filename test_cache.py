@@ -0,0 +1,84 @@
+'''
+LRUCache evicts the least recently used entry and expires entries after their ttl
+'''
+
+import pytest
+
+import cache
+from cache import LRUCache
+
+
+# stands in for the time module so tests can move the clock
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_least_recently_used_is_evicted():
+    """ Going over max_size drops the entry that was used longest ago, reads count as a use """
+    lru = LRUCache(max_size=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None, "Evicted the wrong entry"
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert len(lru) == 2
+
+def test_overwriting_counts_as_a_use():
+    """ Setting an existing key moves it to the back instead of adding a second entry """
+    lru = LRUCache(max_size=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.set("a", 10)
+    lru.set("c", 3)
+    assert lru.get("a") == 10
+    assert lru.get("b") is None
+    assert len(lru) == 2
+
+def test_entries_expire_after_the_ttl(clock):
+    """ An entry is returned until its ttl runs out and is dropped the first time it's read after """
+    lru = LRUCache(max_size=10, ttl=5)
+    lru.set("a", 1)
+    clock.now += 5
+    assert lru.get("a") == 1
+    clock.now += 0.1
+    assert lru.get("a", "gone") == "gone"
+    assert len(lru) == 0
+
+def test_setting_again_restarts_the_ttl(clock):
+    """ A fresh set gives the entry a new ttl """
+    lru = LRUCache(max_size=10, ttl=5)
+    lru.set("a", 1)
+    clock.now += 4
+    lru.set("a", 2)
+    clock.now += 4
+    assert lru.get("a") == 2
+
+def test_no_ttl_never_expires(clock):
+    """ Without a ttl only eviction and invalidate remove entries """
+    lru = LRUCache(max_size=10)
+    lru.set("a", 1)
+    clock.now += 10 ** 9
+    assert lru.get("a") == 1
+    lru.invalidate("a")
+    assert lru.get("a") is None
+
+def test_stats_count_hits_and_misses(clock):
+    """ Expired reads count as misses """
+    lru = LRUCache(max_size=10, ttl=1)
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("b")
+    clock.now += 2
+    lru.get("a")
+    assert lru.stats() == {"size": 0, "max_size": 10, "hits": 1, "misses": 2}
@@ -0,0 +1,68 @@
+'''
+the /home dashboard: friends with unread counts and the last message, pending
+requests and groups from one query, cached per user until something changes
+'''
+
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def home(database, add_users, befriend):
+    add_users("alice", "bob", "carol", "dave", "erin")
+    befriend(("alice", "bob"), ("alice", "carol"))
+    database.send_friend_request("dave", "alice")
+    database.send_friend_request("alice", "erin")
+    send(database, ("bob", "alice"), ("bob", "alice"), ("alice", "bob"))
+    return database
+
+# stores a message for each (sender, receiver)
+def send(database, *pairs):
+    database.insert_messages([{"sender": sender, "receiver": receiver, "message": b"m", "iv": b"iv",
+                               "timestamp": datetime.utcnow()} for sender, receiver in pairs])
+
+def unread(dashboard):
+    return {friend.username: friend.unread for friend in dashboard.friends}
+
+
+def test_dashboard(home):
+    """ Friends with their unread counts, and the requests the user sent and received """
+    dashboard = home.get_dashboard("alice")
+    assert unread(dashboard) == {"bob": 2, "carol": 0}
+    assert [(request.sender, request.receiver) for request in dashboard.received_requests] == [("dave", "alice")]
+    assert [(request.sender, request.receiver) for request in dashboard.sent_requests] == [("alice", "erin")]
+    assert dashboard.groups == []
+    assert all(friend.last_message_id is None for friend in dashboard.friends)
+
+def test_previews(home):
+    """ With previews every friend with messages has the newest one either way """
+    friends = {friend.username: friend for friend in home.get_dashboard("alice", previews=True).friends}
+    assert friends["bob"].last_message_id == 3
+    assert friends["bob"].last_message_at is not None
+    assert friends["carol"].last_message_id is None
+
+def test_dashboard_is_cached(home):
+    """ A second load comes from the cache """
+    assert home.get_dashboard("alice") is home.get_dashboard("alice")
+
+def test_writes_invalidate_the_dashboard(home):
+    """ New messages, read cursors, answered requests and new groups all show up on the next load """
+    home.get_dashboard("alice")
+    send(home, ("carol", "alice"))
+    assert unread(home.get_dashboard("alice")) == {"bob": 2, "carol": 1}
+
+    home.mark_read("alice", "bob", 2)
+    assert unread(home.get_dashboard("alice")) == {"bob": 0, "carol": 1}
+
+    assert len(home.get_dashboard("dave").sent_requests) == 1
+    home.accept_friend_requests("alice", senders=["dave"])
+    dashboard = home.get_dashboard("alice")
+    assert unread(dashboard) == {"bob": 0, "carol": 1, "dave": 0}
+    assert dashboard.received_requests == []
+    # the other side's cached dashboard is dropped too
+    assert home.get_dashboard("dave").sent_requests == []
+
+    group_id = home.create_group("bob", "lunch", ["alice", "carol"])
+    assert [(group.id, group.members) for group in home.get_dashboard("alice").groups] == \
+        [(group_id, ("alice", "bob", "carol"))]
@@ -0,0 +1,89 @@
+'''
+friend requests sent and answered in bulk, and the friend graph queries
+'''
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app as chat_app
+
+
+@pytest.fixture
+def people(database, add_users):
+    add_users("alice", "bob", "carol", "dave", "erin", "frank")
+    return database
+
+def received_ids(database, username):
+    return [request.id for request in database.get_dashboard(username).received_requests]
+
+
+def test_send_friend_requests_outcomes(people, befriend):
+    """ One call reports what happened for every receiver """
+    befriend(("alice", "bob"))
+    people.send_friend_request("carol", "alice")
+    people.send_friend_request("alice", "dave")
+    assert people.send_friend_requests("alice", ["bob", "carol", "dave", "erin", "alice", "nobody"]) == {
+        "bob": people.REQUEST_ALREADY_FRIENDS,
+        "carol": people.REQUEST_ACCEPTED,
+        "dave": people.REQUEST_PENDING,
+        "erin": people.REQUEST_SENT,
+        "alice": people.REQUEST_INVALID,
+        "nobody": people.REQUEST_INVALID,
+    }
+    assert people.are_friends("carol", "alice")
+    # still the one pending request to dave, and carol's was answered
+    assert len(received_ids(people, "dave")) == 1
+    assert received_ids(people, "alice") == []
+
+def test_bulk_accept(people):
+    """ Requests are accepted by id and by sender in one call, the rest stay pending """
+    for sender in ("bob", "carol", "dave"):
+        people.send_friend_request(sender, "alice")
+    bob, _, dave = received_ids(people, "alice")
+    assert people.get_dashboard("bob").sent_requests != []
+    assert people.accept_friend_requests("alice", request_ids=[bob], senders=["carol"]) == ["bob", "carol"]
+    assert sorted(people.list_friends("alice")) == ["bob", "carol"]
+    assert received_ids(people, "alice") == [dave]
+    assert people.get_dashboard("bob").sent_requests == []
+    assert people.reject_friend_requests("alice", senders=["dave"]) == ["dave"]
+    assert received_ids(people, "alice") == []
+    assert not people.are_friends("alice", "dave")
+
+def test_only_the_receiver_can_answer(people):
+    """ Ids of requests someone else received are ignored """
+    people.send_friend_request("alice", "bob")
+    request_id, = received_ids(people, "bob")
+    assert people.accept_friend_requests("erin", request_ids=[request_id]) == []
+    assert people.reject_friend_requests("alice", request_ids=[request_id]) == []
+    assert not people.are_friends("alice", "bob")
+    assert received_ids(people, "bob") == [request_id]
+
+def test_friend_suggestions(people, befriend):
+    """ Friends of friends, most mutual friends first, without friends or anyone with a pending request """
+    befriend(("alice", "bob"), ("alice", "carol"), ("bob", "dave"), ("carol", "dave"), ("bob", "erin"), ("carol", "frank"))
+    assert people.friend_suggestions("alice") == [("dave", 2), ("erin", 1), ("frank", 1)]
+    assert people.friend_suggestions("alice", limit=1) == [("dave", 2)]
+    assert people.mutual_friends("alice", "dave") == ["bob", "carol"]
+    people.send_friend_request("frank", "alice")
+    assert people.friend_suggestions("alice") == [("dave", 2), ("erin", 1)]
+
+def test_answer_routes_need_the_receiver(people):
+    """ /accept-friend-request needs a login and only answers the caller's own requests """
+    application = chat_app.create_app()
+    application.config["JWT_COOKIE_CSRF_PROTECT"] = False
+    people.send_friend_request("alice", "bob")
+    request_id, = received_ids(people, "bob")
+
+    def client(username=None):
+        client = application.test_client()
+        if username is not None:
+            with application.app_context():
+                client.set_cookie("localhost", application.config["JWT_ACCESS_COOKIE_NAME"], create_access_token(username))
+        return client
+
+    assert client().post("/accept-friend-request", json={"request_id": request_id}).status_code == 302
+    assert client("erin").post("/accept-friend-request", json={"request_id": request_id}).status_code == 404
+    assert client("bob").post("/accept-friend-request", json={"request_id": True}).status_code == 400
+    assert not people.are_friends("alice", "bob")
+    assert client("bob").post("/accept-friend-request", json={"request_id": request_id}).status_code == 200
+    assert people.are_friends("alice", "bob")
@@ -0,0 +1,86 @@
+'''
+group_send checks the key envelopes before anything is stored, and every
+member gets the body once plus only their own envelope
+'''
+
+import base64
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app as chat_app
+import socket_routes
+
+ENVELOPES = {"alice": b"for alice", "bob": b"for bob", "carol": b"for carol"}
+
+
+def b64(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+# a socket.io client logged in as username
+def connect(application, username):
+    client = application.test_client()
+    with application.app_context():
+        client.set_cookie("localhost", application.config["JWT_ACCESS_COOKIE_NAME"], create_access_token(username))
+    return chat_app.socketio.test_client(application, flask_test_client=client)
+
+@pytest.fixture
+def group(database, add_users, befriend):
+    add_users("alice", "bob", "carol", "dave")
+    application = chat_app.create_app()
+    group_id = database.create_group("alice", "lunch", ["bob", "carol"])
+    sockets = {username: connect(application, username) for username in ("alice", "bob", "dave")}
+    yield database, group_id, sockets
+    for socket in sockets.values():
+        socket.disconnect()
+
+def send(socket, group_id, keys, body=b64(b"body"), iv=b64(b"iv")):
+    return socket.emit("group_send", group_id, body, iv, keys, callback=True)
+
+def envelopes(**changes):
+    keys = {member: b64(envelope) for member, envelope in ENVELOPES.items()}
+    keys.update(changes)
+    return {member: envelope for member, envelope in keys.items() if envelope is not None}
+
+
+def test_members_get_the_body_and_their_own_envelope(group):
+    """ The message is stored once, each member hears their envelope and the body """
+    database, group_id, sockets = group
+    sockets["bob"].get_received()
+    message_id = send(sockets["alice"], group_id, envelopes())
+    assert isinstance(message_id, int)
+
+    received = {event["name"]: event["args"][0] for event in sockets["bob"].get_received()}
+    assert received["group_key"] == {"id": message_id, "key": b"for bob"}
+    assert received["group_message"]["body"] == b"body"
+    assert [row.envelope for row in database.get_group_messages(group_id, "carol")] == [b"for carol"]
+    assert sockets["dave"].get_received() == []
+
+@pytest.mark.parametrize("keys, error", [
+    (envelopes(carol=None), "Send one key for every member of the group."),
+    (envelopes(dave=b64(b"for dave")), "Send one key for every member of the group."),
+    (["not", "a", "dict"], "Send one key for every member of the group."),
+    (envelopes(bob=b64(b"x" * (socket_routes.MAX_ENVELOPE_SIZE + 1))), "Invalid message."),
+    (envelopes(bob=""), "Invalid message."),
+    (envelopes(bob="not base64!"), "not valid base64"),
+], ids=["missing", "extra", "not a dict", "too big", "empty", "not base64"])
+def test_bad_envelopes_are_turned_away(group, keys, error):
+    """ Missing, extra, oversized, empty or undecodable envelopes store nothing """
+    database, group_id, sockets = group
+    assert send(sockets["alice"], group_id, keys) == error
+    assert database.get_group_messages(group_id, "alice") == []
+
+def test_body_and_iv_are_required(group):
+    """ A message without a body or iv is turned away """
+    database, group_id, sockets = group
+    assert send(sockets["alice"], group_id, envelopes(), body=None) == "Invalid message."
+    assert send(sockets["alice"], group_id, envelopes(), iv=None) == "Invalid message."
+    assert database.get_group_messages(group_id, "alice") == []
+
+def test_only_members_can_send(group):
+    """ Someone outside the group, or a group id that isn't one, gets an error """
+    database, group_id, sockets = group
+    assert send(sockets["dave"], group_id, envelopes()) == "Not a member of this group."
+    assert send(sockets["alice"], group_id + 1, envelopes()) == "Not a member of this group."
+    assert send(sockets["alice"], [group_id], envelopes()) == "Invalid group."
+    assert sockets["alice"].emit("group_join", [group_id], callback=True) == "Invalid group."
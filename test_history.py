@@ -0,0 +1,83 @@
+'''
+message history out to NDJSON and back in, resuming a cut off export
+and re-running an import
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+import history
+from models import Message
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def messages(database, add_users):
+    add_users("alice", "bob", "carol")
+    pairs = [("alice", "bob"), ("bob", "alice"), ("carol", "bob"), ("alice", "carol"), ("bob", "alice")]
+    database.insert_messages([{"sender": sender, "receiver": receiver, "message": bytes([id, 0, 255]),
+                               "iv": None if id == 3 else b"iv%d" % id, "timestamp": START + timedelta(seconds=id)}
+                              for id, (sender, receiver) in enumerate(pairs, 1)])
+    return database
+
+def stored(database):
+    with database.engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(
+            select(Message.id, Message.sender, Message.receiver, Message.message, Message.iv, Message.timestamp)
+            .order_by(Message.id))]
+
+def clear(database):
+    with database.engine.begin() as connection:
+        connection.execute(delete(Message))
+
+
+def test_round_trip(messages, tmp_path):
+    """ Every message comes back exactly as it was exported, bytes and all """
+    path = tmp_path / "backup.ndjson"
+    before = stored(messages)
+    assert history.export_to(path) == 5
+    clear(messages)
+    assert history.import_from(path) == 5
+    assert stored(messages) == before
+
+def test_export_one_user(messages, tmp_path):
+    """ --user only exports the messages they sent or received """
+    path = tmp_path / "carol.ndjson"
+    assert history.export_to(path, "carol") == 2
+    assert [history.from_line(line)["id"] for line in open(path)] == [3, 4]
+
+def test_resume_after_a_cut_off_export(messages, tmp_path):
+    """ Resuming drops a half written last line and carries on after the last whole one """
+    full = tmp_path / "full.ndjson"
+    history.export_to(full)
+    lines = open(full).readlines()
+    path = tmp_path / "backup.ndjson"
+    with open(path, "w") as file:
+        file.writelines(lines[:2])
+        file.write(lines[2][:10])
+
+    assert history.last_exported_id(path) == 2
+    assert history.export_to(path, resume=True) == 3
+    assert open(path).readlines() == lines
+    # nothing new, nothing written
+    assert history.export_to(path, resume=True) == 0
+
+def test_import_twice_skips_existing_ids(messages, tmp_path):
+    """ Importing the same file again changes nothing, with new ids it adds copies """
+    path = tmp_path / "backup.ndjson"
+    history.export_to(path)
+    before = stored(messages)
+    history.import_from(path, batch_size=2)
+    assert stored(messages) == before
+    history.import_from(path, keep_ids=False)
+    assert [row[0] for row in stored(messages)] == list(range(1, 11))
+
+def test_malformed_line(messages, tmp_path):
+    """ A bad line fails the import with where it is """
+    path = tmp_path / "broken.ndjson"
+    path.write_text('{"id": 1, "sender": "alice", "receiver": "bob", "message": "not base64!"}\n')
+    with pytest.raises(ValueError, match="broken.ndjson:1"):
+        history.import_from(path)
@@ -0,0 +1,123 @@
+'''
+MessageWriter batches queued messages, and in commit mode tells each sender
+whether their own message was written
+'''
+
+import time
+import threading
+
+import pytest
+
+from message_writer import MessageWriter, QueueFull, WriteFailed
+
+
+# a write_batch that records its batches, holds the first one until released
+# (so whatever is submitted meanwhile piles up in the queue) and fails any batch with a "bad" row
+class Writes():
+    def __init__(self):
+        self.batches = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, rows):
+        self.writing.set()
+        self.release.wait(5)
+        if any(row.get("bad") for row in rows):
+            raise ValueError("bad row")
+        self.batches.append([row["n"] for row in rows])
+
+# submits a first message and waits until the writer is stuck writing it
+def hold(writer, writes):
+    thread = threading.Thread(target=writer.submit, args=({"n": 0},))
+    thread.start()
+    assert writes.writing.wait(5)
+    return thread
+
+# submits each row on its own thread (commit mode blocks), returns {n: the exception or None}
+def submit_all(writer, rows):
+    results = {}
+    def submit(row):
+        try:
+            writer.submit(row)
+            results[row["n"]] = None
+        except Exception as e:
+            results[row["n"]] = e
+    threads = [threading.Thread(target=submit, args=(row,)) for row in rows]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_queued_messages_are_written_in_batches():
+    """ Messages queued while a batch is being written go out together, at most batch_size at a time """
+    writes = Writes()
+    writer = MessageWriter(writes, batch_size=3, durability="enqueue")
+    hold(writer, writes)
+    for n in range(1, 8):
+        writer.submit({"n": n})
+    writes.release.set()
+    writer.close(5)
+    assert writes.batches == [[0], [1, 2, 3], [4, 5, 6], [7]]
+
+def test_commit_mode_waits_for_the_write():
+    """ In commit mode submit only returns once the message's batch is written """
+    writes = Writes()
+    writes.release.set()
+    writer = MessageWriter(writes, durability="commit")
+    writer.submit({"n": 1})
+    assert writes.batches == [[1]]
+    writer.close(5)
+
+def test_a_failed_write_reaches_the_sender():
+    """ The sender of a message that couldn't be written gets WriteFailed with the cause """
+    writes = Writes()
+    writes.release.set()
+    writer = MessageWriter(writes, durability="commit")
+    with pytest.raises(WriteFailed) as error:
+        writer.submit({"n": 1, "bad": True})
+    assert isinstance(error.value.__cause__, ValueError)
+    writer.close(5)
+
+def test_one_bad_row_only_fails_its_own_sender():
+    """ When a batch fails its rows are retried one by one, the good ones are still written """
+    writes = Writes()
+    writer = MessageWriter(writes, batch_size=10, durability="commit")
+    first = hold(writer, writes)
+    rows = [{"n": n, "bad": n == 3} for n in range(1, 6)]
+    threads, results = submit_all(writer, rows)
+    while writer.qsize() < len(rows):
+        time.sleep(0.001)
+    writes.release.set()
+    for thread in threads + [first]:
+        thread.join(5)
+
+    assert isinstance(results.pop(3), WriteFailed)
+    assert results == {1: None, 2: None, 4: None, 5: None}
+    # the senders' threads queue in any order, but every retry is a batch of one
+    assert sorted(writes.batches) == [[0], [1], [2], [4], [5]]
+    writer.close(5)
+
+def test_full_queue_sheds_the_message():
+    """ submit raises QueueFull once the queue has stayed full for queue_timeout """
+    writes = Writes()
+    writer = MessageWriter(writes, queue_size=1, queue_timeout=0.01, durability="enqueue")
+    hold(writer, writes)
+    writer.submit({"n": 1})
+    with pytest.raises(QueueFull):
+        writer.submit({"n": 2})
+    writes.release.set()
+    writer.close(5)
+    assert writes.batches == [[0], [1]]
+
+def test_close_writes_what_is_queued_and_stops_taking_more():
+    """ close drains the queue, submits after it are refused """
+    writes = Writes()
+    writer = MessageWriter(writes, batch_size=100, durability="enqueue")
+    hold(writer, writes)
+    for n in range(1, 4):
+        writer.submit({"n": n})
+    writes.release.set()
+    writer.close(5)
+    assert sum(writes.batches, []) == [0, 1, 2, 3]
+    with pytest.raises(QueueFull):
+        writer.submit({"n": 4})
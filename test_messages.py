@@ -0,0 +1,70 @@
+'''
+get_messages_between_users merges the two directions of a conversation
+and pages through them with before/after cursors and since_id
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+# (id, sender, receiver, seconds after START), 3 and 4 share a timestamp and 7 was
+# stamped before 6, so (timestamp, id) order isn't id order. 8 is another conversation
+MESSAGES = [
+    (1, "alice", "bob", 0), (2, "bob", "alice", 1), (3, "alice", "bob", 2), (4, "bob", "alice", 2),
+    (5, "alice", "bob", 3), (6, "bob", "alice", 5), (7, "alice", "bob", 4), (8, "carol", "alice", 6),
+    (9, "bob", "alice", 7), (10, "alice", "bob", 8),
+]
+# the conversation between alice and bob, oldest first
+CONVERSATION = [1, 2, 3, 4, 5, 7, 6, 9, 10]
+
+
+@pytest.fixture
+def conversation(database, add_users):
+    add_users("alice", "bob", "carol")
+    database.insert_messages([{"id": id, "sender": sender, "receiver": receiver, "message": b"m", "iv": b"iv",
+                               "timestamp": START + timedelta(seconds=seconds)}
+                              for id, sender, receiver, seconds in MESSAGES])
+    return database
+
+def ids(messages):
+    return [message.id for message in messages]
+
+def cursor(message):
+    return (message.timestamp, message.id)
+
+
+def test_latest_page(conversation):
+    """ Without a cursor the newest messages come back, oldest first, from both sides """
+    assert ids(conversation.get_messages_between_users("alice", "bob")) == CONVERSATION
+    assert ids(conversation.get_messages_between_users("bob", "alice", limit=4)) == [7, 6, 9, 10]
+
+def test_walking_back_with_before(conversation):
+    """ Following before cursors pages through the whole conversation once """
+    pages = []
+    page = conversation.get_messages_between_users("alice", "bob", limit=4)
+    while page:
+        pages.append(ids(page))
+        page = conversation.get_messages_between_users("alice", "bob", before=cursor(page[0]), limit=4)
+    assert pages == [[7, 6, 9, 10], [2, 3, 4, 5], [1]]
+
+def test_walking_forward_with_after(conversation):
+    """ An after cursor returns the messages right after it, ties broken by id """
+    messages = conversation.get_messages_between_users("alice", "bob", limit=50)
+    third = messages[2]
+    assert ids(conversation.get_messages_between_users("alice", "bob", after=cursor(third), limit=3)) == [4, 5, 7]
+    assert ids(conversation.get_messages_between_users("alice", "bob", after=cursor(messages[-1]))) == []
+
+def test_since_id(conversation):
+    """ since_id returns what arrived after a message id, oldest first """
+    assert ids(conversation.get_messages_between_users("alice", "bob", since_id=5)) == [7, 6, 9, 10]
+    assert ids(conversation.get_messages_between_users("alice", "bob", since_id=5, limit=2)) == [7, 6]
+    assert ids(conversation.get_messages_between_users("alice", "bob", since_id=10)) == []
+
+def test_cursor_round_trip(conversation):
+    """ encode_cursor and decode_cursor agree, and a malformed cursor is a ValueError """
+    message = conversation.get_messages_between_users("alice", "bob", limit=1)[0]
+    assert conversation.decode_cursor(conversation.encode_cursor(message)) == cursor(message)
+    with pytest.raises(ValueError):
+        conversation.decode_cursor("yesterday")
@@ -0,0 +1,102 @@
+'''
+upgrades a database file made with the original schema (no iv column,
+messages as base64 text, friendships stored both ways) and checks the data
+comes out the other end
+'''
+
+import base64
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import migrations
+from engine import make_engine
+from models import Base
+
+# the tables as the first version of models.py created them
+BASELINE_SCHEMA = """
+CREATE TABLE user (username VARCHAR NOT NULL, password VARCHAR NOT NULL, public_key TEXT NOT NULL,
+    salt VARCHAR NOT NULL, PRIMARY KEY (username));
+CREATE TABLE messages (id INTEGER NOT NULL, sender VARCHAR, receiver VARCHAR, message TEXT, timestamp DATETIME,
+    PRIMARY KEY (id), FOREIGN KEY(sender) REFERENCES user (username), FOREIGN KEY(receiver) REFERENCES user (username));
+CREATE TABLE friendship (id INTEGER NOT NULL, user_1 VARCHAR, user_2 VARCHAR, PRIMARY KEY (id),
+    FOREIGN KEY(user_1) REFERENCES user (username), FOREIGN KEY(user_2) REFERENCES user (username));
+CREATE TABLE friend_request (id INTEGER NOT NULL, sender VARCHAR, receiver VARCHAR, status VARCHAR(8),
+    PRIMARY KEY (id), FOREIGN KEY(sender) REFERENCES user (username), FOREIGN KEY(receiver) REFERENCES user (username));
+"""
+
+
+# a baseline database at path with rows that need every data migration, returns an upgraded engine
+def upgraded(path, seed):
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany("INSERT INTO user VALUES (?, 'x', 'x', 'x')", [(name,) for name in "abcd"])
+    seed(connection)
+    connection.commit()
+    connection.close()
+
+    engine = make_engine(f"sqlite:///{path}")
+    migrations.ensure_schema(engine, Base.metadata)
+    return engine
+
+def rows(engine, query):
+    with engine.connect() as connection:
+        return connection.execute(text(query)).all()
+
+
+def test_friendships_are_canonicalized_and_deduplicated(tmp_path):
+    """ Reversed friendships are swapped to (smaller, larger) and only the oldest copy of a pair is kept """
+    engine = upgraded(tmp_path / "main.db", lambda connection: connection.executemany(
+        "INSERT INTO friendship (id, user_1, user_2) VALUES (?, ?, ?)",
+        [(1, "b", "a"), (2, "a", "b"), (3, "c", "a"), (4, "b", "d"), (5, "d", "b")]))
+    assert rows(engine, "SELECT id, user_1, user_2 FROM friendship ORDER BY id") == \
+        [(1, "a", "b"), (3, "a", "c"), (4, "b", "d")]
+    with engine.connect() as connection:
+        assert migrations.get_version(connection) == migrations.LATEST_VERSION
+
+def test_base64_messages_become_bytes(tmp_path):
+    """ base64 text is decoded to the raw bytes, anything else is kept as its utf-8 bytes """
+    engine = upgraded(tmp_path / "main.db", lambda connection: connection.executemany(
+        "INSERT INTO messages (id, sender, receiver, message) VALUES (?, 'a', 'b', ?)",
+        [(1, base64.b64encode(b"\x00\xffcipher").decode()), (2, "not base64!"), (3, None)]))
+    assert rows(engine, "SELECT id, message, iv FROM messages ORDER BY id") == \
+        [(1, b"\x00\xffcipher", None), (2, b"not base64!", None), (3, None, None)]
+
+def test_base64_migration_crosses_batches(tmp_path, monkeypatch):
+    """ Every message is converted when there are more than one batch of them """
+    monkeypatch.setattr(migrations, "MIGRATION_BATCH_SIZE", 3)
+    engine = upgraded(tmp_path / "main.db", lambda connection: connection.executemany(
+        "INSERT INTO messages (id, sender, receiver, message) VALUES (?, 'a', 'b', ?)",
+        [(i, base64.b64encode(bytes([i])).decode()) for i in range(1, 11)]))
+    assert [message for message, in rows(engine, "SELECT message FROM messages ORDER BY id")] == \
+        [bytes([i]) for i in range(1, 11)]
+
+def test_pending_friend_requests_are_deduplicated(tmp_path):
+    """ Duplicate pending requests keep the oldest, requests between friends count as accepted """
+    def seed(connection):
+        connection.execute("INSERT INTO friendship (user_1, user_2) VALUES ('c', 'a')")
+        connection.executemany("INSERT INTO friend_request (id, sender, receiver, status) VALUES (?, ?, ?, ?)", [
+            (1, "a", "b", "pending"), (2, "a", "b", "pending"), (3, "a", "b", "rejected"),
+            (4, "b", "a", "pending"), (5, "a", "c", "pending"), (6, "d", "a", "pending"),
+        ])
+    engine = upgraded(tmp_path / "main.db", seed)
+    assert rows(engine, "SELECT id, sender, receiver, status FROM friend_request ORDER BY id") == [
+        (1, "a", "b", "pending"), (3, "a", "b", "rejected"), (4, "b", "a", "pending"),
+        (5, "a", "c", "accepted"), (6, "d", "a", "pending"),
+    ]
+
+    # and the index keeps it that way
+    with engine.connect() as connection, pytest.raises(IntegrityError):
+        connection.execute(text("INSERT INTO friend_request (sender, receiver, status) VALUES ('a', 'b', 'pending')"))
+
+def test_current_database_is_left_alone(tmp_path):
+    """ Running ensure_schema again on an upgraded file changes nothing """
+    path = tmp_path / "main.db"
+    engine = upgraded(path, lambda connection: connection.execute(
+        "INSERT INTO friendship (user_1, user_2) VALUES ('b', 'a')"))
+    engine.dispose()
+    engine = make_engine(f"sqlite:///{path}")
+    migrations.ensure_schema(engine, Base.metadata)
+    assert rows(engine, "SELECT user_1, user_2 FROM friendship") == [("a", "b")]
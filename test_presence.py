@@ -0,0 +1,46 @@
+'''
+the token bucket presence uses to rate limit heartbeat and typing events per socket
+'''
+
+from presence import Presence, RateLimiter
+
+
+def test_burst_then_refill():
+    """ A new key gets burst events straight away, then rate a second """
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.allow("sid", 0) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("sid", 0.25) is False, "Allowed an event before a whole token came back"
+    assert limiter.allow("sid", 0.5) is True
+    assert limiter.allow("sid", 0.5) is False
+
+def test_refill_stops_at_burst():
+    """ A key that was quiet for a long time still only gets burst events at once """
+    limiter = RateLimiter(rate=2, burst=3)
+    limiter.allow("sid", 0)
+    assert [limiter.allow("sid", 1000) for _ in range(4)] == [True, True, True, False]
+
+def test_dropped_events_do_not_cost_tokens():
+    """ Events over the limit don't push the next allowed one further out """
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.allow("sid", 0) is True
+    for now in (0.1, 0.2, 0.3, 0.9):
+        assert limiter.allow("sid", now) is False
+    assert limiter.allow("sid", 1.0) is True
+
+def test_keys_are_limited_separately():
+    """ One socket running out doesn't limit another, and a forgotten key starts over """
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.allow("a", 0) is True
+    assert limiter.allow("a", 0) is False
+    assert limiter.allow("b", 0) is True
+    limiter.forget("a")
+    assert limiter.allow("a", 0) is True
+
+def test_presence_counts_dropped_events():
+    """ Presence drops heartbeats and typing over the limit and counts them """
+    presence = Presence(lambda *args: None, rate=1, burst=2)
+    assert presence.heartbeat("sid", "alice", now=0) is True
+    assert presence.set_typing("sid", "alice", 1, now=0) is True
+    assert presence.heartbeat("sid", "alice", now=0) is False
+    assert presence.stats["received"] == 3
+    assert presence.stats["dropped"] == 1
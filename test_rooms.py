@@ -0,0 +1,67 @@
+'''
+Room and SharedRoom keep one room per conversation and forget a room
+once its last member leaves, both are run through the same checks
+'''
+
+import pytest
+from sqlalchemy import insert
+
+from engine import make_engine
+from models import Base, Room, SharedRoom, User
+
+
+@pytest.fixture(params=["Room", "SharedRoom"])
+def rooms(request, tmp_path):
+    if request.param == "Room":
+        return Room()
+    engine = make_engine(f"sqlite:///{tmp_path / 'rooms.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{"username": name, "password": "x", "public_key": "x", "salt": "x"}
+                                          for name in ("alice", "bob", "carol")])
+    return SharedRoom(engine)
+
+
+def test_both_users_share_one_room(rooms):
+    """ The conversation gets the same room whoever opens it first """
+    room_id = rooms.get_or_create_room("alice", "bob")
+    assert rooms.get_or_create_room("bob", "alice") == room_id
+    assert rooms.get_members(room_id) == {"alice", "bob"}
+    assert rooms.get_pair(room_id) == frozenset(("alice", "bob"))
+
+def test_room_is_deleted_when_the_last_member_leaves(rooms):
+    """ The room stays while anyone is in it and is forgotten after the last one leaves """
+    room_id = rooms.get_or_create_room("alice", "bob")
+    rooms.join_room("bob", room_id)
+    rooms.leave_room("alice", room_id)
+    assert rooms.get_members(room_id) == {"bob"}
+    assert rooms.room_count() == 1
+
+    rooms.leave_room("bob", room_id)
+    assert rooms.room_count() == 0
+    assert rooms.user_count() == 0
+    assert rooms.get_pair(room_id) is None
+    assert rooms.join_room("alice", room_id) is False, "Joined a deleted room"
+    assert rooms.get_or_create_room("alice", "bob") != room_id, "A deleted room id was handed out again"
+
+def test_leaving_every_room(rooms):
+    """ leave_room without a room id leaves all of the user's rooms and only deletes the empty ones """
+    with_bob = rooms.get_or_create_room("alice", "bob")
+    with_carol = rooms.get_or_create_room("alice", "carol")
+    rooms.join_room("carol", with_carol)
+    assert rooms.get_room_ids("alice") == {with_bob, with_carol}
+
+    rooms.leave_room("alice")
+    assert rooms.get_room_ids("alice") == set()
+    assert rooms.get_pair(with_bob) is None
+    assert rooms.get_members(with_carol) == {"carol"}
+    assert rooms.room_count() == 1
+    assert rooms.user_count() == 1
+
+def test_leaving_a_room_you_are_not_in(rooms):
+    """ Leaving a room the user isn't in changes nothing """
+    room_id = rooms.get_or_create_room("alice", "bob")
+    rooms.leave_room("carol", room_id)
+    rooms.leave_room("bob", room_id)
+    assert rooms.get_members(room_id) == {"alice"}
+    assert rooms.room_count() == 1
@@ -0,0 +1,44 @@
+'''
+unread counts and the messages pushed on connect, both past each friend's read cursor
+'''
+
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def inbox(database, add_users, befriend):
+    add_users("alice", "bob", "carol", "dave")
+    befriend(("alice", "bob"), ("carol", "alice"))
+    # dave isn't a friend, so dave's message never counts
+    senders = ["bob", "carol", "bob", "dave", "bob"]
+    database.insert_messages([{"id": id, "sender": sender, "receiver": "alice", "message": b"m", "iv": b"iv",
+                               "timestamp": datetime.utcnow()} for id, sender in enumerate(senders, 1)])
+    database.insert_messages([{"id": 6, "sender": "alice", "receiver": "bob", "message": b"m", "iv": b"iv",
+                               "timestamp": datetime.utcnow()}])
+    return database
+
+
+def test_unread_counts(inbox):
+    """ Every friend gets a count, messages from strangers and sent messages don't count """
+    assert inbox.get_unread_counts("alice") == {"bob": 3, "carol": 1}
+    assert inbox.get_unread_counts("bob") == {"alice": 1}
+    assert inbox.get_unread_counts("dave") == {}
+
+def test_unread_messages(inbox):
+    """ The unread messages from every friend come back oldest first, up to limit """
+    assert [message.id for message in inbox.get_unread_messages("alice")] == [1, 2, 3, 5]
+    assert [message.id for message in inbox.get_unread_messages("alice", limit=2)] == [1, 2]
+
+def test_mark_read_moves_the_cursor(inbox):
+    """ Reading up to a message only clears that friend's older messages """
+    inbox.mark_read("alice", "bob", 3)
+    assert inbox.get_unread_counts("alice") == {"bob": 1, "carol": 1}
+    assert [message.id for message in inbox.get_unread_messages("alice")] == [2, 5]
+
+def test_mark_read_never_moves_back(inbox):
+    """ An older message id than the cursor leaves it where it is """
+    inbox.mark_read("alice", "bob", 5)
+    inbox.mark_read("alice", "bob", 1)
+    assert inbox.get_unread_counts("alice") == {"bob": 0, "carol": 1}
@@ -0,0 +1,57 @@
+'''
+wire
+how encrypted message payloads travel between clients and the server
+
+The ciphertext and iv are stored as raw bytes. Socket.IO sends bytes as binary
+attachments, so live messages never get base64'd. Over HTTP, JSON needs base64
+(what the browser uses), and clients that send
+`Content-Type: application/msgpack` or `Accept: application/msgpack` get the
+raw bytes with no padding at all. msgpack is optional
+(`pip install msgpack`), and without it only JSON is offered.
+'''
+
+import base64
+import binascii
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+
+# raised when a payload isn't bytes or valid base64
+class InvalidPayload(ValueError):
+    pass
+
+
+def available_types():
+    return [JSON_TYPE, MSGPACK_TYPE] if msgpack is not None else [JSON_TYPE]
+
+# ciphertext/iv from a client as bytes, accepting raw bytes or a base64 string
+def to_bytes(value):
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        try:
+            return base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            raise InvalidPayload("not valid base64")
+    raise InvalidPayload(f"expected bytes or a base64 string, got {type(value).__name__}")
+
+# bytes as the base64 string JSON clients expect
+def to_base64(value):
+    return None if value is None else base64.b64encode(value).decode("ascii")
+
+def pack(payload) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+def unpack(data: bytes):
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except Exception:
+        raise InvalidPayload("not valid msgpack")